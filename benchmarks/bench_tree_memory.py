@@ -0,0 +1,83 @@
+"""
+展開済みツリー（expand_tree の結果）が保持するメモリを、以前の1手ごとの dict の表現と比べるベンチマーク。
+
+    python3 benchmarks/bench_tree_memory.py [--variations 100 150 200] [--engine compact]
+
+合流の多い棋譜を合成して展開し、ツリーを作った後に残るメモリ（tracemalloc）を1ノードあたりで表示する。
+比較のため、同じツリーを以前の表現（{'move': shogi.Move, 'branches': list, 'ki2_str': ノードごとの文字列,
+'comments': ...}）に作り直したものも測る。
+"""
+import argparse
+import gc
+import io
+import os
+import sys
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import GeneratorConfig, generate_ki2
+from extract_moves import parse_ki2_lines
+from logic.board import ENGINES, new_board
+from logic.expander import Tree, count_tree_nodes, expand_tree
+from logic.graph import decode_move
+from logic.position import PositionKeys
+
+def as_dict_tree(tree: Tree) -> List[Dict]:
+    """TreeNode のツリーを以前の dict の表現に作り直す（表記の文字列もノードごとに別に作る）。"""
+    root: List[Dict] = []
+    stack = [(tree, root)]
+    while stack:
+        nodes, target = stack.pop()
+        for node in nodes:
+            branches: List[Dict] = []
+            target.append({
+                'move': decode_move(node.move),
+                'branches': branches,
+                'ki2_str': node.ki2_str[:1] + node.ki2_str[1:],
+                'comments': node.comments,
+            })
+            stack.append((node.branches, branches))
+    return root
+
+def retained_bytes(build: Callable[[], object]) -> int:
+    """build() の結果を保持したまま、作る前からのメモリの増分を返す。"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory held by expanded trees")
+    parser.add_argument("--variations", type=int, nargs="+", default=[100, 150, 200],
+                        help="Numbers of variations in the generated records")
+    parser.add_argument("--transposition-rate", type=float, default=0.1)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="compact")
+    args = parser.parse_args()
+
+    print(f"{'variations':>10} {'nodes':>9} {'dict MB':>8} {'node MB':>8} {'dict B/node':>11} {'node B/node':>11} {'ratio':>6}")
+    for variations in args.variations:
+        text = generate_ki2(GeneratorConfig(variations=variations, transposition_rate=args.transposition_rate))
+        keys = PositionKeys()
+        graph = parse_ki2_lines(io.StringIO(text), keys, args.engine).graph
+        tree = expand_tree(new_board(args.engine), graph, keys=keys)
+        nodes = count_tree_nodes(tree)
+        del tree
+        node_bytes = retained_bytes(lambda: expand_tree(new_board(args.engine), graph, keys=keys))
+        # 以前の表現は変換元のツリーを除いた分を測る
+        source = expand_tree(new_board(args.engine), graph, keys=keys)
+        dict_bytes = retained_bytes(lambda: as_dict_tree(source))
+        del source
+        print(f"{variations:>10} {nodes:>9} {dict_bytes / (1 << 20):>8.1f} {node_bytes / (1 << 20):>8.1f} "
+              f"{dict_bytes / nodes:>11.0f} {node_bytes / nodes:>11.0f} {dict_bytes / node_bytes:>5.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+変化の多い KI2 ファイルのパース時間が変化の数に比例することを確かめるベンチマーク。
+
+    python3 benchmarks/bench_variations.py [--variations 5000 10000 20000] [--engine compact]
+
+本譜の各手に1手だけの変化を持つ棋譜を合成し、parse_ki2 の時間を測って変化1つあたりの時間を表示する。
+変化は一般的なソフトの出力と同じく深い手数から順に並ぶため、「変化：n手」の分岐元（n-1 手を含む
+直近の節）はそれまでのどの変化にも含まれず、節を遡って探すと変化の数の2乗に比例する時間がかかる。
+線形なら、サイズを増やしても1つあたりの時間はほぼ一定になる。
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from typing import List, Tuple
+
+import shogi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract_moves import parse_ki2
+from generator import ki2_label, random_move
+from logic.board import ENGINES
+
+def generate_variations_ki2(variations: int, seed: int = 0) -> str:
+    """本譜 variations 手と、その各手に対する1手の変化（深い手数から順）を持つ KI2 テキストを作る。"""
+    rng = random.Random(seed)
+    board = shogi.Board()
+    main_line: List[str] = []
+    alternatives: List[Tuple[int, str]] = []
+    for ply in range(1, variations + 1):
+        # 本譜は王手を避けて詰まないようにし、何手でも続けられるようにする
+        main_move = random_move(board, rng, allow_check=False)
+        if main_move is None:
+            break
+        alternative = random_move(board, rng, {main_move})
+        if alternative is not None:
+            alternatives.append((ply, ki2_label(board, alternative)))
+        main_line.append(ki2_label(board, main_move))
+        board.push(main_move)
+
+    out = io.StringIO()
+    out.write("手合割：平手\n")
+    for i in range(0, len(main_line), 10):
+        out.write(" ".join(main_line[i:i + 10]) + "\n")
+    for ply, label in reversed(alternatives):
+        out.write(f"\n変化：{ply}手\n{label}\n")
+    return out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KI2 parsing on files with many variations")
+    parser.add_argument("--variations", type=int, nargs="+", default=[5000, 10000, 20000],
+                        help="Numbers of variations to generate")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="compact")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'variations':>10} {'bytes':>10} {'seconds':>8} {'us/variation':>13}")
+    for count in args.variations:
+        text = generate_variations_ki2(count, seed=args.seed)
+        with tempfile.NamedTemporaryFile('w', suffix='.ki2', encoding='cp932', delete=False) as f:
+            f.write(text)
+        try:
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                parse_ki2(f.name, engine=args.engine)
+            seconds = time.perf_counter() - start
+            size = os.path.getsize(f.name)
+        finally:
+            os.unlink(f.name)
+        print(f"{count:>10} {size:>10} {seconds:>8.2f} {seconds / count * 1e6:>13.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+ベンチマーク用の合成 KI2 ジェネレーター。同じ設定と seed からは常に同じ棋譜を作る。
+
+    python3 benchmarks/generator.py --main-length 120 --variations 300 > synthetic.ki2
+"""
+import argparse
+import io
+import os
+import random
+import sys
+from typing import List, NamedTuple, Optional, Set
+
+import shogi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract_moves import parse_ki2_move
+from logic.expander import get_ki2_move_str
+
+class GeneratorConfig(NamedTuple):
+    # 本譜の手数
+    main_length: int = 120
+    # 変化の数
+    variations: int = 300
+    # 1つの変化の最大手数
+    variation_length: int = 8
+    # 変化の入れ子の最大の深さ（1 なら本譜から分かれる変化だけ）
+    max_depth: int = 3
+    # 変化のうち、既存の手順の手を入れ替えて同じ局面に合流させるものの割合
+    transposition_rate: float = 0.05
+    # 指し手にコメントを付ける割合
+    comment_rate: float = 0.05
+    seed: int = 0
+
+class _Node:
+    """合成する棋譜木の1手。children[0] がその先の本筋、残りが変化。"""
+    __slots__ = ('ply', 'depth', 'move', 'label', 'comments', 'parent', 'children')
+
+    def __init__(self, ply: int, depth: int, move: Optional[shogi.Move], label: str, parent: Optional['_Node']):
+        self.ply = ply
+        # 変化の入れ子の深さ（本譜は 0）
+        self.depth = depth
+        self.move = move
+        self.label = label
+        self.comments: List[str] = []
+        self.parent = parent
+        self.children: List['_Node'] = []
+
+def ki2_label(board: shogi.Board, move: shogi.Move) -> str:
+    """手番の記号付きの KI2 表記。"""
+    mark = "▲" if board.turn == shogi.BLACK else "△"
+    return mark + get_ki2_move_str(board, move)
+
+def is_readable(board: shogi.Board, move: shogi.Move) -> bool:
+    """表記からパーサーが同じ手を読み戻せるか（成駒の表記が成る手と重なる場合などを除く）。"""
+    last_to = board.move_stack[-1].to_square if board.move_stack else None
+    return parse_ki2_move(board, ki2_label(board, move), last_to) == move
+
+def random_move(board: shogi.Board, rng: random.Random, exclude: Set[shogi.Move] = frozenset(),
+                allow_check: bool = True) -> Optional[shogi.Move]:
+    """
+    読み戻せる合法手をランダムに選ぶ。allow_check=False なら王手になる手を除く
+    （王手を避けると詰まずに何手でも続けられる）。
+    """
+    candidates = list(board.generate_pseudo_legal_moves())
+    rng.shuffle(candidates)
+    for move in candidates:
+        if move in exclude or not board.is_legal(move) or not is_readable(board, move):
+            continue
+        if not allow_check:
+            board.push(move)
+            gives_check = board.is_check()
+            board.pop()
+            if gives_check:
+                continue
+        return move
+    return None
+
+class _TreeBuilder:
+    def __init__(self, config: GeneratorConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.board = shogi.Board()
+        self.root = _Node(0, 0, None, "", None)
+        self.nodes: List[_Node] = [self.root]
+        self.comment_count = 0
+
+    def _goto(self, node: _Node) -> List[shogi.Move]:
+        path = []
+        while node.move is not None:
+            path.append(node.move)
+            node = node.parent
+        path.reverse()
+        for move in path:
+            self.board.push(move)
+        return path
+
+    def _add(self, parent: _Node, move: shogi.Move, depth: int) -> _Node:
+        child = _Node(parent.ply + 1, depth, move, ki2_label(self.board, move), parent)
+        if self.rng.random() < self.config.comment_rate:
+            self.comment_count += 1
+            child.comments.append(f"コメント{self.comment_count} " + "解説" * self.rng.randint(1, 20))
+        parent.children.append(child)
+        self.board.push(move)
+        self.nodes.append(child)
+        return child
+
+    def _extend(self, node: _Node, moves: List[shogi.Move], length: int, depth: int) -> int:
+        """node から moves を指し、続けてランダムな手を合計 length 手まで加える。加えた手数を返す。"""
+        added = 0
+        exclude = {child.move for child in node.children}
+        for i in range(length):
+            move = moves[i] if i < len(moves) else random_move(self.board, self.rng, exclude, allow_check=depth > 0)
+            if move is None or move in exclude or not self.board.is_legal(move) or not is_readable(self.board, move):
+                break
+            node = self._add(node, move, depth)
+            exclude = {child.move for child in node.children}
+            added += 1
+        for _ in range(added):
+            self.board.pop()
+        return added
+
+    def _transposed(self, node: _Node) -> List[shogi.Move]:
+        """
+        node から本筋の3手 a b c を c b a の順に指す手順（同じ局面に合流する）。
+        入れ替えられない場合は空。
+        """
+        line = []
+        current = node
+        while current.children and len(line) < 3:
+            current = current.children[0]
+            line.append(current.move)
+        if len(line) < 3 or line[0] == line[2]:
+            return []
+        return [line[2], line[1], line[0]]
+
+    def build(self) -> _Node:
+        config = self.config
+        self._extend(self.root, [], config.main_length, 0)
+        created = attempts = 0
+        while created < config.variations and attempts < config.variations * 20:
+            attempts += 1
+            node = self.rng.choice(self.nodes)
+            if not node.children or node.children[0].depth >= config.max_depth:
+                continue
+            depth = node.children[0].depth + 1
+            path = self._goto(node)
+            moves = self._transposed(node) if self.rng.random() < config.transposition_rate else []
+            length = max(len(moves), self.rng.randint(1, config.variation_length))
+            added = self._extend(node, moves, length, depth)
+            for _ in path:
+                self.board.pop()
+            if added:
+                created += 1
+        return self.root
+
+def _write_line(out: io.StringIO, first: _Node, include_first_alternatives: bool):
+    """
+    first から本筋を辿った手順を書き、その途中の変化を深い手数から順に再帰的に書く
+    （KIF/KI2 を出力する一般的なソフトと同じ順序）。
+    """
+    line = [first]
+    while line[-1].children:
+        line.append(line[-1].children[0])
+    moves: List[str] = []
+    for node in line:
+        moves.append(node.label)
+        if node.comments:
+            out.write(" ".join(moves) + "\n")
+            out.write("".join(f"*{comment}\n" for comment in node.comments))
+            moves = []
+    if moves:
+        out.write(" ".join(moves) + "\n")
+    branch_points = line if include_first_alternatives else line[1:]
+    for node in reversed(branch_points):
+        for alternative in node.parent.children[1:]:
+            out.write(f"\n変化：{alternative.ply}手\n")
+            _write_line(out, alternative, False)
+
+def generate_ki2(config: GeneratorConfig = GeneratorConfig()) -> str:
+    """config に従って合成した棋譜の KI2 テキストを返す。"""
+    root = _TreeBuilder(config).build()
+    out = io.StringIO()
+    out.write("開始日時：2024/01/01 10:00:00\n手合割：平手\n先手：合成\n後手：合成\n")
+    if root.children:
+        _write_line(out, root.children[0], True)
+    return out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic KI2 file")
+    defaults = GeneratorConfig()
+    for field in GeneratorConfig._fields:
+        default = getattr(defaults, field)
+        parser.add_argument("--" + field.replace("_", "-"), type=type(default), default=default)
+    parser.add_argument("--encoding", default="cp932")
+    args = parser.parse_args()
+    config = GeneratorConfig(**{field: getattr(args, field) for field in GeneratorConfig._fields})
+    sys.stdout.buffer.write(generate_ki2(config).encode(args.encoding))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+合成棋譜によるベンチマークスイート。主要な処理ごとに時間・スループット・ピークメモリを測り、
+保存済みのベースラインと比べて遅く（大きく）なったものを回帰として報告する。
+
+    python3 benchmarks/run.py                   # 実行してベースラインと比較（回帰があれば終了コード 1）
+    python3 benchmarks/run.py --save-baseline   # 結果をベースラインとして保存
+    python3 benchmarks/run.py --only expand_tree format_as_ki2_text
+
+時間は repeat 回の最小値。ピークメモリは tracemalloc で測った Python のメモリ確保量で、
+時間を測る実行とは別に1回だけ測る。ベースラインは実行したマシンに依存する。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import shogi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import GeneratorConfig, generate_ki2
+from extract_moves import extract_moves_from_ki2, parse_ki2_move
+from logic.board import DEFAULT_ENGINE, ENGINES, new_board
+from logic.expander import count_tree_nodes, expand_tree, get_ki2_move_str
+from logic.graph import decode_move
+from logic.position import PositionKeys
+from main import format_as_ki2_text, process_file
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.3
+
+# パース系の計測に使う、変化とコメントの多い棋譜
+PARSE_CONFIG = GeneratorConfig(main_length=200, variations=2000, transposition_rate=0.02, comment_rate=0.1)
+# 展開系の計測に使う、合流の多い棋譜（展開後 約 7.7 万ノード）
+EXPAND_CONFIG = GeneratorConfig(variations=150, transposition_rate=0.1)
+# 局面ごとの計測に使う局面数の上限
+SAMPLE_POSITIONS = 1000
+
+class Benchmark(NamedTuple):
+    name: str
+    # 計測しない準備。run に渡す状態を返す
+    setup: Callable[['Workspace'], Any]
+    # 計測する処理。処理した量（unit の数）を返す
+    run: Callable[[Any], int]
+    unit: str
+
+class Result(NamedTuple):
+    name: str
+    seconds: float
+    count: int
+    unit: str
+    peak_mb: float
+
+    @property
+    def throughput(self) -> float:
+        return self.count / self.seconds if self.seconds > 0 else 0.0
+
+class Workspace:
+    """合成した棋譜ファイルとそのパース結果を、ベンチマーク間で共有して一度だけ作る。"""
+    def __init__(self, directory: str, engine: str):
+        self.directory = directory
+        self.engine = engine
+        self._files: Dict[str, str] = {}
+        self._parsed: Dict[str, tuple] = {}
+        self._samples: Optional[List[Tuple[Any, List]]] = None
+
+    def file(self, name: str, config: GeneratorConfig) -> str:
+        if name not in self._files:
+            path = os.path.join(self.directory, f"{name}.ki2")
+            with open(path, 'w', encoding='cp932') as f:
+                f.write(generate_ki2(config))
+            self._files[name] = path
+        return self._files[name]
+
+    def parsed(self, name: str, config: GeneratorConfig) -> tuple:
+        """(局面グラフ, PositionKeys)"""
+        if name not in self._parsed:
+            keys = PositionKeys()
+            with redirect_stdout(io.StringIO()):
+                graph, _ = extract_moves_from_ki2(self.file(name, config), keys, self.engine)
+            self._parsed[name] = (graph, keys)
+        return self._parsed[name]
+
+    def sample_positions(self) -> List[Tuple[Any, List]]:
+        """
+        パース系の棋譜から最大 SAMPLE_POSITIONS 局面の盤面と、その局面の (指し手, 表記, 直前の移動先) の一覧。
+        """
+        if self._samples is None:
+            graph, keys = self.parsed("parse", PARSE_CONFIG)
+            board = new_board(self.engine)
+            offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+            root = graph.position_id(keys.key(board))
+            visited = bytearray(len(graph))
+            self._samples = []
+            stack = [[root, offsets[root]]]
+            while stack and len(self._samples) < SAMPLE_POSITIONS:
+                frame = stack[-1]
+                pos, edge = frame
+                if edge == offsets[pos]:
+                    visited[pos] = 1
+                    last_to = board.move_stack[-1].to_square if board.move_stack else None
+                    mark = "▲" if board.turn == shogi.BLACK else "△"
+                    moves = []
+                    for e in range(offsets[pos], offsets[pos + 1]):
+                        move = decode_move(edge_moves[e])
+                        moves.append((move, mark + get_ki2_move_str(board, move), last_to))
+                    self._samples.append((new_board(self.engine, board.sfen()), moves))
+                if edge < offsets[pos + 1]:
+                    frame[1] = edge + 1
+                    if not visited[targets[edge]]:
+                        board.push(decode_move(edge_moves[edge]))
+                        stack.append([targets[edge], offsets[targets[edge]]])
+                    continue
+                stack.pop()
+                if stack:
+                    board.pop()
+        return self._samples
+
+# 1回では短すぎる計測を繰り返す回数
+PARSE_ROUNDS = 10
+
+def _parse_moves(samples) -> int:
+    count = 0
+    for _ in range(PARSE_ROUNDS):
+        for board, moves in samples:
+            for move, ki2, last_to in moves:
+                parse_ki2_move(board, ki2, last_to)
+                count += 1
+    return count
+
+def _legal_moves(workspace: Workspace):
+    samples = []
+    for board, _ in workspace.sample_positions():
+        reference = new_board('python-shogi', board.sfen())
+        samples.append((board, list(reference.legal_moves)))
+    return samples
+
+def _format_moves(samples) -> int:
+    count = 0
+    for board, moves in samples:
+        for move in moves:
+            get_ki2_move_str(board, move)
+            count += 1
+    return count
+
+def _extract(state) -> int:
+    engine, path = state
+    with redirect_stdout(io.StringIO()):
+        extract_moves_from_ki2(path, PositionKeys(), engine)
+    return os.path.getsize(path)
+
+def _expand_setup(workspace: Workspace):
+    graph, keys = workspace.parsed("expand", EXPAND_CONFIG)
+    return workspace.engine, graph, keys
+
+def _expand(state) -> int:
+    engine, graph, keys = state
+    return count_tree_nodes(expand_tree(new_board(engine), graph, keys=keys))
+
+def _format_setup(workspace: Workspace):
+    engine, graph, keys = _expand_setup(workspace)
+    tree = expand_tree(new_board(engine), graph, keys=keys)
+    return tree, count_tree_nodes(tree)
+
+def _format(state) -> int:
+    tree, nodes = state
+    format_as_ki2_text(tree)
+    return nodes
+
+def _process(state) -> int:
+    engine, path = state
+    with redirect_stdout(io.StringIO()):
+        stats = process_file(path, engine=engine, cache=None)
+    return stats.nodes
+
+BENCHMARKS = [
+    Benchmark("parse_ki2_move", lambda w: w.sample_positions(), _parse_moves, "moves"),
+    Benchmark("get_ki2_move_str", _legal_moves, _format_moves, "moves"),
+    Benchmark("extract_moves_from_ki2", lambda w: (w.engine, w.file("parse", PARSE_CONFIG)), _extract, "bytes"),
+    Benchmark("expand_tree", _expand_setup, _expand, "nodes"),
+    Benchmark("format_as_ki2_text", _format_setup, _format, "nodes"),
+    Benchmark("process_file", lambda w: (w.engine, w.file("expand", EXPAND_CONFIG)), _process, "nodes"),
+]
+
+def run_benchmark(benchmark: Benchmark, workspace: Workspace, repeat: int) -> Result:
+    state = benchmark.setup(workspace)
+    best = None
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = benchmark.run(state)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    tracemalloc.start()
+    try:
+        benchmark.run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return Result(benchmark.name, best, count, benchmark.unit, peak / (1 << 20))
+
+def load_baseline(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_baseline(path: str, results: List[Result], engine: str, previous: Optional[dict] = None):
+    """結果をベースラインとして保存する。一部だけ実行した場合は previous の他の項目を残す。"""
+    recorded = dict(previous["results"]) if previous is not None else {}
+    recorded.update({r.name: {"seconds": round(r.seconds, 6), "peak_mb": round(r.peak_mb, 3)} for r in results})
+    data = {
+        "engine": engine,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": recorded,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def compare(results: List[Result], baseline: Optional[dict], threshold: float) -> List[str]:
+    """ベースラインより threshold の割合を超えて遅い・大きい項目を表示し、回帰した項目名を返す。"""
+    header = f"{'benchmark':<24} {'seconds':>9} {'throughput':>20} {'peak MB':>8}"
+    if baseline is not None:
+        header += f" {'vs time':>8} {'vs mem':>8}"
+    print(header)
+    regressions = []
+    for r in results:
+        line = f"{r.name:<24} {r.seconds:>9.4f} {r.throughput:>14.0f} {r.unit + '/s':<5} {r.peak_mb:>8.2f}"
+        base = baseline["results"].get(r.name) if baseline is not None else None
+        if base is not None:
+            time_ratio = r.seconds / base["seconds"] if base["seconds"] > 0 else 1.0
+            mem_ratio = r.peak_mb / base["peak_mb"] if base["peak_mb"] > 0 else 1.0
+            line += f" {time_ratio:>7.2f}x {mem_ratio:>7.2f}x"
+            if time_ratio > 1 + threshold or mem_ratio > 1 + threshold:
+                line += "  REGRESSION"
+                regressions.append(r.name)
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite on synthetic KI2 files")
+    parser.add_argument("--only", nargs="+", metavar="NAME", choices=[b.name for b in BENCHMARKS],
+                        help="Run only these benchmarks")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per benchmark (the fastest is reported)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown or memory growth reported as a regression (default: 0.3)")
+    args = parser.parse_args()
+
+    benchmarks = [b for b in BENCHMARKS if args.only is None or b.name in args.only]
+    directory = tempfile.mkdtemp(prefix="ki2-bench-")
+    try:
+        workspace = Workspace(directory, args.engine)
+        results = [run_benchmark(b, workspace, max(args.repeat, 1)) for b in benchmarks]
+    finally:
+        shutil.rmtree(directory)
+
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and baseline.get("engine") != args.engine:
+        print(f"Baseline was recorded with engine {baseline.get('engine')}; not comparing.")
+        baseline = None
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, args.engine, baseline)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
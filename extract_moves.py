@@ -1,10 +1,14 @@
 import shogi
-from typing import Dict, Set, List, Optional, Tuple
+from typing import Dict, Iterable, NamedTuple, List, Optional, Tuple
 import re
 import collections
-
-ZEN_TO_INT = str.maketrans("１２３４５６７八九", "123456789")
-KAN_TO_INT = str.maketrans("一二三四五六七八九", "123456789")
+import io
+import functools
+from logic.attacks import candidate_origins, is_drop_possible
+from logic.board import AnyBoard, DEFAULT_ENGINE, new_board
+from logic.encoding import detect_encoding, open_text
+from logic.position import get_board_key, PositionKeys
+from logic.graph import PositionGraph, PositionGraphBuilder, encode_move
 
 PIECE_TYPE_MAP = {
     '歩': shogi.PAWN, '香': shogi.LANCE, '桂': shogi.KNIGHT, '銀': shogi.SILVER,
@@ -16,54 +20,66 @@ PIECE_TYPE_MAP = {
     '个': shogi.PROM_PAWN
 }
 
-def parse_ki2_move(board: shogi.Board, move_str: str, last_to_square: Optional[int] = None) -> Optional[shogi.Move]:
-    move_str = move_str.strip()
-    if not move_str: return None
-    move_str = re.sub(r'^[▲△▽▼＋]', '', move_str).strip()
-    if not move_str: return None
+# 筋・段として受け付ける文字（半角・全角数字と漢数字）
+_DIGITS = {}
+for _i, _chars in enumerate(zip("123456789", "１２３４５６７８９", "一二三四五六七八九"), 1):
+    for _c in _chars:
+        _DIGITS[_c] = _i
 
-    if move_str.startswith(('同', '〃')):
-        to_square = board.move_stack[-1].to_square if board.move_stack else last_to_square
-        if to_square is None: return None
-        piece_part = move_str[1:].strip()
+MARK_PATTERN = re.compile(r'^[▲△▽▼＋]')
+# 駒名は長いものから照合する（「成香」を「香」より先に）
+_PIECE_ALTERNATION = '|'.join(sorted(PIECE_TYPE_MAP, key=len, reverse=True))
+_MOVE_TOKEN = re.compile(
+    r'\s*[▲△▽▼＋]?\s*(?:(?P<dou>[同〃])|(?P<file>\S)(?P<rank>\S))\s*(?P<piece>' + _PIECE_ALTERNATION + r')(?P<rest>.*)',
+    re.DOTALL)
+DOU = -1
+# パース結果（局面グラフ・到達情報）が変わる修正を入れたら上げる。パースキャッシュのキーに含まれる
+PARSER_VERSION = 2
+
+@functools.lru_cache(maxsize=4096)
+def tokenize_ki2_move(move_str: str) -> Optional[Tuple[int, int, str]]:
+    """
+    指し手文字列を (移動先マス, 駒種, 残りの相対表記) に分解する。「同」の場合の移動先は DOU。
+    盤面に依存しないため文字列ごとにキャッシュする。
+    """
+    m = _MOVE_TOKEN.fullmatch(move_str)
+    if m is None:
+        return None
+    if m.group('dou'):
+        to_square = DOU
     else:
-        try:
-            to_file = int(move_str[0].translate(ZEN_TO_INT))
-            to_rank = int(move_str[1].translate(KAN_TO_INT))
-            to_square = (to_rank - 1) * 9 + (9 - to_file)
-            piece_part = move_str[2:].strip()
-        except (ValueError, IndexError):
+        to_file = _DIGITS.get(m.group('file'))
+        to_rank = _DIGITS.get(m.group('rank'))
+        if to_file is None or to_rank is None:
             return None
+        to_square = (to_rank - 1) * 9 + (9 - to_file)
+    return to_square, PIECE_TYPE_MAP[m.group('piece')], m.group('rest')
 
-    piece_type = None
-    relative_part = ""
-    for k in sorted(PIECE_TYPE_MAP.keys(), key=len, reverse=True):
-        if piece_part.startswith(k):
-            piece_type = PIECE_TYPE_MAP[k]
-            relative_part = piece_part[len(k):]
-            break
-    if piece_type is None: return None
+def parse_ki2_move(board: AnyBoard, move_str: str, last_to_square: Optional[int] = None) -> Optional[shogi.Move]:
+    token = tokenize_ki2_move(move_str)
+    if token is None: return None
+    to_square, piece_type, relative_part = token
+    if to_square == DOU:
+        to_square = board.move_stack[-1].to_square if board.move_stack else last_to_square
+        if to_square is None: return None
 
     is_prom = '成' in relative_part and '不成' not in relative_part
-    is_not_prom = '不成' in relative_part
     
+    # 全合法手を生成せず、移動先に利いている該当駒と持駒だけを候補にして合法性を確かめる。
+    # 候補の並びは legal_moves の生成順（駒種、移動元の昇順、打つ手は最後）に合わせる。
+    turn = board.turn
     candidates = []
-    for move in board.legal_moves:
-        if move.to_square != to_square: continue
-        if move.drop_piece_type:
-            if move.drop_piece_type == piece_type:
-                candidates.append(move)
-        else:
-            p = board.piece_at(move.from_square)
-            if p.piece_type == piece_type:
-                if is_prom:
-                    if move.promotion: candidates.append(move)
-                elif is_not_prom:
-                    if not move.promotion: candidates.append(move)
-                else:
-                    if not move.promotion: candidates.append(move)
-            elif (p.piece_type + 8) == piece_type:
-                if move.promotion: candidates.append(move)
+    if not board.occupied[turn] & shogi.BB_SQUARES[to_square]:
+        if piece_type >= shogi.PROM_PAWN:
+            # 成駒の名前で、成る前の駒が成る手
+            for from_square in candidate_origins(board, turn, piece_type - 8, to_square):
+                move = shogi.Move(from_square, to_square, True)
+                if board.is_legal(move): candidates.append(move)
+        for from_square in candidate_origins(board, turn, piece_type, to_square):
+            move = shogi.Move(from_square, to_square, is_prom)
+            if board.is_legal(move): candidates.append(move)
+        if is_drop_possible(board, piece_type, to_square):
+            candidates.append(shogi.Move(None, to_square, False, piece_type))
 
     if not candidates: return None
     if len(candidates) == 1: return candidates[0]
@@ -103,109 +119,276 @@ def parse_ki2_move(board: shogi.Board, move_str: str, last_to_square: Optional[i
 
     return board_candidates[0] if board_candidates else None
 
-def get_board_key(board: shogi.Board) -> str:
-    s = board.sfen()
-    parts = s.split(' ')
-    return " ".join(parts[:3]) + " 1"
+# 節（対局・変化）の始まりとみなす行頭
+SECTION_START = re.compile(r'開始日時：|手合割：|変化[：:]')
+VARIATION_START = re.compile(r'変化[：:]\s*(\d+)手')
+MOVE_PATTERN = re.compile(r'[▲△▽▼＋][^▲△▽▼\n\r*＋]+')
+HEADER_WORDS = ('開始日時', '終了日時', '手合割', '先手', '後手', '棋戦')
 
-def extract_moves_from_ki2(file_path: str) -> Tuple[Dict[str, Dict[str, List[str]]], Dict[str, Dict[str, Tuple[str, ...]]]]:
-    move_map: Dict[str, Dict[str, List[str]]] = {}
-    # arrival_info: SFEN -> { LastMoveLabel -> PathTuple }
-    arrival_info: Dict[str, Dict[str, Tuple[str, ...]]] = collections.defaultdict(dict)
-    
-    try:
-        with open(file_path, 'r', encoding='cp932', errors='replace') as f:
-            content = f.read()
-    except Exception as e:
-        print(f"Error: {e}"); return {}, {}
+def is_header_line(stripped: str) -> bool:
+    """ヘッダー部分の行か（指し手・変化の行が現れたらヘッダーは終わり）。"""
+    return not (stripped.startswith('▲') or stripped.startswith('△') or stripped.startswith('変化：'))
 
-    header_patterns = [r'^開始日時：', r'^手合割：', r'^変化[：:]']
-    combined_pattern = '|'.join(header_patterns)
-    matches = list(re.finditer(combined_pattern, content, re.MULTILINE))
-    
-    sections_raw = [content[m.start():(matches[i+1].start() if i+1 < len(matches) else len(content))] for i, m in enumerate(matches)]
-    if not sections_raw: sections_raw = [content]
+class _Ply:
+    """
+    棋譜上の1手。自分の指し手と直前の手への参照だけを持つ（経路は親を辿って復元する）。
+    変化は親の手を共有するので、手順全体の複製は作らない。
+    """
+    __slots__ = ('label', 'move', 'parent', 'depth')
+
+    def __init__(self, label: str, move: shogi.Move, parent: Optional['_Ply']):
+        self.label = label
+        self.move = move
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 1
 
-    move_pattern = re.compile(r'[▲△▽▼＋][^▲△▽▼\n\r*＋]+')
-    histories: Dict[int, Dict[int, Tuple[str, Optional[int], List[str]]]] = {}
+def _recent_labels(ply: Optional[_Ply], count: int) -> Tuple[str, ...]:
+    """ply までの直近 count 手の表記（古い順）。"""
+    labels = []
+    while ply is not None and len(labels) < count:
+        labels.append(ply.label)
+        ply = ply.parent
+    return tuple(reversed(labels))
 
-    total_found = 0; total_parsed = 0; errors = 0
+class _Ki2Reader:
+    """
+    KI2 を1行ずつ受け取り、節の区切りを検出しながら指し手を逐次パースする。
+    保持するのは現在の節の状態と、手数 -> その手数を含む最新の節の手（_Ply）の索引だけ。
+    """
+    def __init__(self, keys: PositionKeys, engine: str):
+        self.keys = keys
+        self.engine = engine
+        self.builder = PositionGraphBuilder()
+        # arrival_info: 局面キー -> { LastMoveLabel -> PathTuple }
+        self.arrival_info: Dict[int, Dict[str, Tuple[str, ...]]] = collections.defaultdict(dict)
+        # 手数 -> その手数を含む最も新しい節で、その手数まで指した時点の手（初期局面は None）。
+        # 「変化：n手」の分岐元は n-1 手を含む直近の節なので、節を遡って探さずに引ける
+        self.latest_plies: Dict[int, Optional[_Ply]] = {}
+        # 盤面は常に self.ply まで指した局面を表す。active は現在の節をパース中か
+        self.board = new_board(engine)
+        self.ply: Optional[_Ply] = None
+        self.active = False
+        self.total_found = 0; self.total_parsed = 0; self.errors = 0
 
-    for idx, section in enumerate(sections_raw):
-        if not section.strip(): continue
-        
-        var_match = re.search(r'^変化[：:]\s*(\d+)手', section, re.MULTILINE)
+    def start_section(self, first_line: str):
+        """節の最初の行を受け取り、その節の開始局面を決める。"""
+        self.active = False
+        self.last_move_info = None
+
+        var_match = VARIATION_START.match(first_line)
         if var_match:
             n = int(var_match.group(1))
-            parent_idx = -1
-            for prev_idx in range(idx - 1, -1, -1):
-                if prev_idx in histories and (n - 1) in histories[prev_idx]:
-                    parent_idx = prev_idx
-                    break
-            if parent_idx == -1: continue
-            parent_sfen, parent_lts, parent_path = histories[parent_idx][n - 1]
-            board = shogi.Board(parent_sfen)
-            last_to = parent_lts
-            current_path = list(parent_path)
-            start_move_count = n - 1
+            if (n - 1) not in self.latest_plies: return
+            self._move_to(self.latest_plies[n - 1])
+            self.curr_cnt = n - 1
         else:
-            board = shogi.Board()
-            last_to = None
-            current_path = []
-            start_move_count = 0
-        
-        histories[idx] = {start_move_count: (board.sfen(), last_to, list(current_path))}
-        last_move_info = None
-        curr_cnt = start_move_count
-
-        for line in section.splitlines():
-            line = line.strip()
-            if not line or line.startswith('変化'): continue
-            if line.startswith('*'):
-                if last_move_info:
-                    k, u = last_move_info
-                    if k in move_map and u in move_map[k]:
-                        if line[1:].strip() not in move_map[k][u]:
-                            move_map[k][u].append(line[1:].strip())
-                continue
-            if any(h in line for h in ['開始日時', '終了日時', '手合割', '先手', '後手', '棋戦']): continue
-
-            moves_in_line = move_pattern.findall(line)
-            for m_str in moves_in_line:
-                total_found += 1
-                key = get_board_key(board)
-                if key not in move_map: move_map[key] = {}
-                
-                move = parse_ki2_move(board, m_str, last_to)
-                if move:
-                    total_parsed += 1
-                    usi = move.usi()
-                    if usi not in move_map[key]: move_map[key][usi] = []
-                    
-                    # 符号の正規化（直前の手を識別するため）
-                    clean_move = re.sub(r'^[▲△▽▼＋]', '', m_str.strip())
-                    m_label = "▲" if board.turn == shogi.BLACK else "△"
-                    full_move_str = f"{m_label}{clean_move}"
-                    
-                    current_path.append(full_move_str)
-                    last_to = move.to_square
-                    board.push(move)
-                    last_move_info = (key, usi)
-                    curr_cnt += 1
-                    
-                    sfen_key = get_board_key(board)
-                    # 局面への到達情報（直前の手ごとにパスを保存）
-                    arrival_info[sfen_key][full_move_str] = tuple(current_path[-3:])
-                    
-                    histories[idx][curr_cnt] = (board.sfen(), last_to, list(current_path))
+            self.ply = None
+            self.board = new_board(self.engine)
+            self.curr_cnt = 0
+        self.last_to = self.ply.move.to_square if self.ply is not None else None
+        self.latest_plies[self.curr_cnt] = self.ply
+        self.active = True
+
+    def _move_to(self, target: Optional[_Ply]):
+        """
+        盤面を target まで指した局面に移す。共通の祖先まで戻してから target まで指すので、
+        直前の手順から分かれる変化では分岐点からの距離の分しか push/pop しない。
+        """
+        board, current = self.board, self.ply
+        current_depth = current.depth if current is not None else 0
+        target_depth = target.depth if target is not None else 0
+        forward = []
+        while current_depth > target_depth:
+            board.pop()
+            current = current.parent
+            current_depth -= 1
+        while target_depth > current_depth:
+            forward.append(target)
+            target = target.parent
+            target_depth -= 1
+        while current is not target:
+            board.pop()
+            current = current.parent
+            forward.append(target)
+            target = target.parent
+        for ply in reversed(forward):
+            board.push(ply.move)
+        self.ply = forward[0] if forward else current
+
+    def feed(self, text: str):
+        """現在の節の1行分（ファイルの1行）をパースする。"""
+        for line in text.splitlines():
+            if not self.active: return
+            self._feed_line(line.strip())
+
+    def _feed_line(self, line: str):
+        if not line or line.startswith('変化'): return
+        if line.startswith('*'):
+            if self.last_move_info is not None:
+                self.builder.add_comment(self.last_move_info, line[1:].strip())
+            return
+        if any(h in line for h in HEADER_WORDS): return
+
+        builder, keys, board = self.builder, self.keys, self.board
+        for m_str in MOVE_PATTERN.findall(line):
+            self.total_found += 1
+            src = builder.intern(keys.key(board))
+
+            move = parse_ki2_move(board, m_str, self.last_to)
+            if not move:
+                self.errors += 1
+                self.active = False
+                return
+            self.total_parsed += 1
+
+            # 符号の正規化（直前の手を識別するため）
+            clean_move = MARK_PATTERN.sub('', m_str.strip())
+            m_label = "▲" if board.turn == shogi.BLACK else "△"
+            full_move_str = f"{m_label}{clean_move}"
+
+            self.ply = _Ply(full_move_str, move, self.ply)
+            self.last_to = move.to_square
+            board.push(move)
+            self.curr_cnt += 1
+
+            arrived_key = keys.key(board)
+            self.last_move_info = builder.add_edge(src, encode_move(move), builder.intern(arrived_key))
+            # 局面への到達情報（直前の手ごとにパスを保存）
+            arrivals = self.arrival_info[arrived_key]
+            arrivals[full_move_str] = _recent_labels(self.ply, 3)
+            if len(arrivals) == 2:
+                # 合流局面のみレポート用に SFEN を残す
+                keys.remember(arrived_key, board)
+
+            self.latest_plies[self.curr_cnt] = self.ply
+
+class Ki2Parse(NamedTuple):
+    graph: PositionGraph
+    # 局面キー -> { 直前の手 -> そこまでの手順（最大3手） }
+    arrival_info: Dict[int, Dict[str, Tuple[str, ...]]]
+    header: str
+    moves_found: int
+    moves_parsed: int
+    # 解釈できなかった指し手の数（その節の残りは読み飛ばす）
+    errors: int
+    # デコードできずに U+FFFD に置き換えられた文字の数
+    replaced: int
+
+def parse_ki2_lines(
+    lines: Iterable[str],
+    keys: Optional[PositionKeys] = None,
+    engine: str = DEFAULT_ENGINE
+) -> Ki2Parse:
+    """
+    KI2 の行（改行付きでもよい）を先頭から一度だけ読み、局面グラフ、局面ごとの到達情報、ヘッダーと
+    パースの件数を返す。何も表示しない。
+    行を読みながら節（開始日時・手合割・変化）の区切りを検出して指し手を逐次パースするため、
+    全体を文字列として保持しない。最初の区切りより前の行は、区切りが一つもない場合に限り
+    それ自体を一つの節として扱う（区切りが現れるまでの間だけ保持する）。
+    engine で盤面の実装（logic.board.ENGINES のキー）を選ぶ。局面キーはどの実装でも同じになる。
+    """
+    if keys is None:
+        keys = PositionKeys()
+    reader = _Ki2Reader(keys, engine)
+    header_lines: List[str] = []
+    in_header = True
+    leading: Optional[List[str]] = []
+
+    replaced = 0
+    for text in lines:
+        if '\ufffd' in text:
+            replaced += text.count('\ufffd')
+        if in_header:
+            stripped = text.strip()
+            if stripped:
+                if is_header_line(stripped):
+                    header_lines.append(stripped)
                 else:
-                    errors += 1
-                    board = None
-                    break
-            if board is None: break
+                    in_header = False
+        if SECTION_START.match(text):
+            leading = None
+            reader.start_section(text)
+            reader.feed(text)
+        elif leading is not None:
+            leading.append(text)
+        else:
+            reader.feed(text)
+
+    if leading is not None and "".join(leading).strip():
+        # 区切りのないファイルは全体で一つの節
+        reader.start_section("")
+        for text in leading:
+            reader.feed(text)
+
+    return Ki2Parse(reader.builder.build(), reader.arrival_info, "\n".join(header_lines),
+                    reader.total_found, reader.total_parsed, reader.errors, replaced)
 
-    print(f"Found: {total_found}, Parsed: {total_parsed}, Errors: {errors}")
-    return move_map, arrival_info
+def _report(parsed: Ki2Parse, name: str, encoding: str):
+    if parsed.replaced:
+        print(f"Warning: {parsed.replaced} undecodable characters in {name} (read as {encoding})")
+    print(f"Found: {parsed.moves_found}, Parsed: {parsed.moves_parsed}, Errors: {parsed.errors}")
+
+def parse_ki2(
+    file_path: str,
+    keys: Optional[PositionKeys] = None,
+    engine: str = DEFAULT_ENGINE
+) -> Tuple[PositionGraph, Dict[int, Dict[str, Tuple[str, ...]]], str]:
+    """
+    KI2 ファイルを先頭から一度だけ読み、局面グラフ、局面ごとの到達情報、ヘッダーを返す（parse_ki2_lines）。
+    文字コードは BOM と先頭の内容から判定し（cp932 / UTF-8 / BOM 付き UTF-8 など）、チャンク単位でデコードする。
+    """
+    try:
+        f = open_text(file_path)
+    except Exception as e:
+        print(f"Error: {e}"); return PositionGraphBuilder().build(), {}, ""
+
+    with f:
+        parsed = parse_ki2_lines(f, keys, engine)
+
+    _report(parsed, file_path, f.encoding)
+    return parsed.graph, parsed.arrival_info, parsed.header
+
+def parse_ki2_bytes(
+    content: bytes,
+    file_path: str,
+    keys: Optional[PositionKeys] = None,
+    engine: str = DEFAULT_ENGINE
+) -> Tuple[PositionGraph, Dict[int, Dict[str, Tuple[str, ...]]], str]:
+    """
+    読み込み済みの KI2 ファイルの内容を parse_ki2 と同じ判定でデコードしてパースする。
+    内容のハッシュで結果を引く場合に、ハッシュを取ったのと同じバイト列をパースするために使う。
+    """
+    encoding = detect_encoding(content, complete=True)
+    parsed = parse_ki2_lines(io.StringIO(content.decode(encoding, errors='replace')), keys, engine)
+    _report(parsed, file_path, encoding)
+    return parsed.graph, parsed.arrival_info, parsed.header
+
+def extract_moves_from_ki2(
+    file_path: str,
+    keys: Optional[PositionKeys] = None,
+    engine: str = DEFAULT_ENGINE
+) -> Tuple[PositionGraph, Dict[int, Dict[str, Tuple[str, ...]]]]:
+    """
+    KI2 ファイルから局面グラフと局面ごとの到達情報を抽出する（ヘッダーが不要な場合の parse_ki2）。
+    """
+    graph, arrival_info, _ = parse_ki2(file_path, keys, engine)
+    return graph, arrival_info
+
+def read_ki2_header(file_path: str) -> str:
+    """
+    KI2 ファイルのヘッダー部分（最初の指し手・変化の行より前の空でない行）だけを読む。
+    """
+    header_lines = []
+    try:
+        with open_text(file_path) as f:
+            for line in f:
+                stripped = line.strip()
+                if not stripped: continue
+                if not is_header_line(stripped): break
+                header_lines.append(stripped)
+    except Exception:
+        pass
+    return "\n".join(header_lines)
 
 if __name__ == "__main__":
     import sys
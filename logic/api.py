@@ -0,0 +1,136 @@
+import io
+import threading
+from typing import NamedTuple, Optional, TextIO, Union
+
+import shogi
+
+from extract_moves import parse_ki2_lines
+from logic.board import DEFAULT_ENGINE, new_board
+from logic.cache import DEFAULT_MEMORY_ENTRIES, CachedParse, MemoryParseCache
+from logic.encoding import detect_encoding
+from logic.estimate import estimate_expansion
+from logic.graph_writer import write_graph_json, write_graph_ki2
+from logic.position import get_board_key, PositionKeys
+from logic.pruning import Pruner, PruningPolicy
+from logic.writer import write_expanded_ki2
+
+OUTPUT_FORMATS = ('expanded', 'graph', 'json')
+
+class ExpansionStats(NamedTuple):
+    positions: int
+    confluence_points: int
+    # 書き出したノード数（graph / json では指し手の数）
+    nodes: int
+    moves_parsed: int
+    # 解釈できなかった指し手の数
+    parse_errors: int
+    # 打ち切り条件で省いた箇所の数
+    pruned: int = 0
+    # パース結果をキャッシュから使ったか
+    cached: bool = False
+
+class ExpansionResult(NamedTuple):
+    text: str
+    stats: ExpansionStats
+
+class ExpansionTooLarge(ValueError):
+    """展開後のノード数の見積もりが上限を超える。"""
+    def __init__(self, limit: int):
+        # ワーカープロセスから返せるよう、args には引数をそのまま持つ
+        super().__init__(limit)
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return f"expansion would write more than {self.limit} nodes"
+
+class _Parsed(NamedTuple):
+    parse: CachedParse
+    moves_parsed: int
+    errors: int
+
+def decode_ki2(data: bytes) -> str:
+    """KI2 のバイト列を、ファイルと同じ判定（BOM、UTF-8 か cp932 か）でデコードする。"""
+    return data.decode(detect_encoding(data, complete=True), errors='replace')
+
+class Expander:
+    """
+    KI2 のテキスト（またはバイト列）を展開するライブラリ用の入口。表示もファイルの読み書きもしない。
+    パース結果は内容ごとに max_entries 件までメモリに残し、同じ棋譜の再展開（形式や打ち切り条件を
+    変えた場合など）ではパースを省く。キャッシュの操作はロックで守るので、スレッド間で共有してよい。
+    """
+    def __init__(self, engine: str = DEFAULT_ENGINE, max_entries: int = DEFAULT_MEMORY_ENTRIES):
+        self.engine = engine
+        # 値は CachedParse とパースの件数の組（_Parsed）
+        self._cache = MemoryParseCache(max_entries=max_entries)
+        self._lock = threading.Lock()
+
+    def _parse(self, source: Union[str, bytes]):
+        content = source if isinstance(source, bytes) else source.encode('utf-8')
+        with self._lock:
+            parsed = self._cache.load(content)
+        keys = PositionKeys()
+        if parsed is not None:
+            keys.restore(parsed.parse.sfens)
+            return parsed, keys, True
+        text = decode_ki2(source) if isinstance(source, bytes) else source
+        result = parse_ki2_lines(io.StringIO(text), keys, self.engine)
+        parsed = _Parsed(CachedParse(result.graph, result.arrival_info, result.header, keys.remembered()),
+                         result.moves_parsed, result.errors)
+        if result.graph:
+            with self._lock:
+                self._cache.store(content, parsed)
+        return parsed, keys, False
+
+    def write(self, stream: TextIO, source: Union[str, bytes], output_format: str = 'expanded',
+              pruning: Optional[PruningPolicy] = None, max_nodes: Optional[int] = None,
+              include_header: bool = True) -> ExpansionStats:
+        """
+        source を展開して stream に逐次書き出し、統計を返す。出力全体をメモリに載せないので、
+        stream の write が受け取った断片をそのまま送れば、チャンク単位のストリーミングになる。
+        出力は CLI の出力ファイルと同じ（include_header が偽ならヘッダーを付けない）。
+        max_nodes を指定すると、展開前に見積もったノード数がそれを超える場合に ExpansionTooLarge を送出する
+        （打ち切り条件は見積もりに含めない。pruning のノード数の上限が max_nodes 以下なら見積もらない）。
+        見積もりは max_nodes を超えると分かった時点で打ち切るので、手間も max_nodes で抑えられる。
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format: {output_format}")
+        parsed, keys, cached = self._parse(source)
+        graph, arrival_info, header = parsed.parse.graph, parsed.parse.arrival_info, parsed.parse.header
+        initial_key = get_board_key(shogi.Board())
+        confluence_points = sum(1 for key, arrivals in arrival_info.items() if len(arrivals) > 1 and key != initial_key)
+        stats = ExpansionStats(len(arrival_info), confluence_points, 0, parsed.moves_parsed, parsed.errors, cached=cached)
+        if not graph:
+            return stats
+
+        bounded = pruning is not None and pruning.max_nodes is not None and max_nodes is not None and pruning.max_nodes <= max_nodes
+        if max_nodes is not None and output_format == 'expanded' and not bounded:
+            if estimate_expansion(new_board(self.engine), graph, header, keys, max_nodes=max_nodes) is None:
+                raise ExpansionTooLarge(max_nodes)
+        if output_format == 'json':
+            return stats._replace(nodes=write_graph_json(stream, new_board(self.engine), graph, keys,
+                                                         header if include_header else ""))
+        if include_header:
+            stream.write(header + "\n\n")
+        if output_format == 'graph':
+            return stats._replace(nodes=write_graph_ki2(stream, new_board(self.engine), graph, keys))
+        pruner = Pruner(pruning) if pruning is not None else None
+        nodes = write_expanded_ki2(stream, new_board(self.engine), graph, keys, pruner)
+        return stats._replace(nodes=nodes, pruned=pruner.pruned if pruner is not None else 0)
+
+    def expand(self, source: Union[str, bytes], output_format: str = 'expanded',
+               pruning: Optional[PruningPolicy] = None, max_nodes: Optional[int] = None,
+               include_header: bool = True) -> ExpansionResult:
+        """source を展開したテキストと統計を返す（write の結果を文字列にまとめたもの）。"""
+        buffer = io.StringIO()
+        stats = self.write(buffer, source, output_format, pruning, max_nodes, include_header)
+        return ExpansionResult(buffer.getvalue(), stats)
+
+_default_expander: Optional[Expander] = None
+
+def expand_ki2(source: Union[str, bytes], output_format: str = 'expanded', pruning: Optional[PruningPolicy] = None,
+               max_nodes: Optional[int] = None, include_header: bool = True) -> ExpansionResult:
+    """既定の Expander（プロセスで1つ、パース結果のキャッシュを共有する）で source を展開する。"""
+    global _default_expander
+    if _default_expander is None:
+        _default_expander = Expander()
+    return _default_expander.expand(source, output_format, pruning, max_nodes, include_header)
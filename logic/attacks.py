@@ -0,0 +1,36 @@
+import shogi
+from typing import List
+
+from logic.board import AnyBoard, CompactBoard
+
+def candidate_origins(board: AnyBoard, color: int, piece_type: int, to_square: int) -> List[int]:
+    """
+    color 側の piece_type の駒のうち、to_square に利いている駒のマス（昇順）を返す。
+    to_square から手番を反転した同じ駒の利きを引くことで、全合法手を生成せずに求める。
+    合法性（自玉の王手放置など）は呼び出し側で候補ごとに確認すること。
+    """
+    if isinstance(board, CompactBoard):
+        return board.candidate_origins(color, piece_type, to_square)
+    mask = (
+        shogi.Board.attacks_from(piece_type, to_square, board.occupied, color ^ 1)
+        & board.piece_bb[piece_type]
+        & board.occupied[color]
+    )
+    squares = []
+    while mask:
+        low = mask & -mask
+        squares.append(low.bit_length() - 1)
+        mask ^= low
+    return squares
+
+def is_drop_possible(board: AnyBoard, piece_type: int, to_square: int) -> bool:
+    """持駒 piece_type を to_square に打つ手が合法か。"""
+    if isinstance(board, CompactBoard):
+        return board.is_drop_possible(piece_type, to_square)
+    if not shogi.PAWN <= piece_type <= shogi.ROOK:
+        return False
+    if board.occupied.bits & shogi.BB_SQUARES[to_square]:
+        return False
+    if not board.has_piece_in_hand(piece_type, board.turn):
+        return False
+    return board.is_legal(shogi.Move(None, to_square, False, piece_type))
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+class FileStats(NamedTuple):
+    input_file: str
+    positions: int = 0
+    confluence_points: int = 0
+    nodes: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+    # 打ち切り条件で省いた箇所の数（logic.pruning）
+    pruned: int = 0
+
+def _run_captured(process: Callable[..., FileStats], input_file: str, options: dict) -> Tuple[str, FileStats]:
+    """
+    1ファイル分の処理を実行し、その間のコンソール出力をまとめて返す。
+    例外は握りつぶさずに出力と結果へ記録し、他のファイルの処理は続ける。
+    """
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(buffer):
+        try:
+            stats = process(input_file, **options)
+        except Exception as e:
+            print(f"Error processing {input_file}: {e}")
+            stats = FileStats(input_file, error=str(e))
+    if stats is None:
+        stats = FileStats(input_file)
+    return buffer.getvalue(), stats._replace(seconds=time.perf_counter() - start)
+
+def run_batch(process: Callable[..., FileStats], input_files: List[str], jobs: int, **options) -> List[FileStats]:
+    """
+    独立したファイルごとの処理をプロセスプールで並列に実行する。
+    各ファイルの出力は終わったものから順に、ファイル単位でまとめて表示する。
+    結果は input_files と同じ順で返す。
+    """
+    results: List[Optional[FileStats]] = [None] * len(input_files)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_run_captured, process, f, options): i for i, f in enumerate(input_files)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                output, stats = future.result()
+            except Exception as e:
+                # ワーカープロセス自体が落ちた場合
+                output = f"Error processing {input_files[i]}: {e}\n"
+                stats = FileStats(input_files[i], error=str(e))
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            results[i] = stats
+    return results
+
+def print_batch_summary(results: List[FileStats], wall_seconds: float, slowest: int = 5):
+    """バッチ処理全体の集計を表示する。"""
+    failed = [r for r in results if r.error is not None]
+    print("\n=== Batch summary ===")
+    print(f"Files: {len(results)} (succeeded: {len(results) - len(failed)}, failed: {len(failed)})")
+    print(f"Total unique positions: {sum(r.positions for r in results)}")
+    print(f"Total confluence points: {sum(r.confluence_points for r in results)}")
+    print(f"Total nodes written: {sum(r.nodes for r in results)}")
+    pruned = [r for r in results if r.pruned]
+    if pruned:
+        print(f"Pruned: {sum(r.pruned for r in pruned)} cuts in {len(pruned)} files")
+    print(f"Wall time: {wall_seconds:.2f}s (sum of per-file times: {sum(r.seconds for r in results):.2f}s)")
+    if failed:
+        print("Failed files:")
+        for r in failed:
+            print(f"  {r.input_file}: {r.error}")
+    if results:
+        print("Slowest files:")
+        for r in sorted(results, key=lambda r: r.seconds, reverse=True)[:slowest]:
+            print(f"  {r.seconds:8.2f}s  {r.input_file}")
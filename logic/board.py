@@ -0,0 +1,479 @@
+import shogi
+from typing import List, Optional, Tuple, Union
+
+# マス番号は python-shogi と同じ（段 * 9 + (9 - 筋)）。駒は 駒種 | (手番 << 4) の1バイトで表す
+_COLOR_SHIFT = 4
+_TYPE_MASK = 0x0F
+
+# 方向（列の増分, 段の増分）。段の増分 -1 が先手から見た前方
+_DIRECTIONS = ((0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1))
+_OPPOSITE = (4, 5, 6, 7, 0, 1, 2, 3)
+# 先後で段の向きを反転したときの方向の対応
+_MIRROR = (4, 3, 2, 1, 0, 7, 6, 5)
+_STEP, _SLIDE = 1, 2
+
+_FORWARD = (0, 1, 7)
+_GOLD_STEPS = (0, 1, 7, 2, 6, 4)
+_ORTHOGONAL = (0, 2, 4, 6)
+_DIAGONAL = (1, 3, 5, 7)
+
+# 先手の駒の動き（方向 -> 一歩だけか走るか）。桂は別扱い
+_BLACK_MOVES = {
+    shogi.PAWN: {0: _STEP},
+    shogi.LANCE: {0: _SLIDE},
+    shogi.KNIGHT: {},
+    shogi.SILVER: {d: _STEP for d in _FORWARD + (3, 5)},
+    shogi.GOLD: {d: _STEP for d in _GOLD_STEPS},
+    shogi.BISHOP: {d: _SLIDE for d in _DIAGONAL},
+    shogi.ROOK: {d: _SLIDE for d in _ORTHOGONAL},
+    shogi.KING: {d: _STEP for d in range(8)},
+    shogi.PROM_PAWN: {d: _STEP for d in _GOLD_STEPS},
+    shogi.PROM_LANCE: {d: _STEP for d in _GOLD_STEPS},
+    shogi.PROM_KNIGHT: {d: _STEP for d in _GOLD_STEPS},
+    shogi.PROM_SILVER: {d: _STEP for d in _GOLD_STEPS},
+    shogi.PROM_BISHOP: {**{d: _SLIDE for d in _DIAGONAL}, **{d: _STEP for d in _ORTHOGONAL}},
+    shogi.PROM_ROOK: {**{d: _SLIDE for d in _ORTHOGONAL}, **{d: _STEP for d in _DIAGONAL}},
+}
+_KNIGHT_VECTORS = (((-1, -2), (1, -2)), ((-1, 2), (1, 2)))
+
+PROMOTED = {shogi.PAWN: shogi.PROM_PAWN, shogi.LANCE: shogi.PROM_LANCE, shogi.KNIGHT: shogi.PROM_KNIGHT,
+            shogi.SILVER: shogi.PROM_SILVER, shogi.BISHOP: shogi.PROM_BISHOP, shogi.ROOK: shogi.PROM_ROOK}
+UNPROMOTED = {v: k for k, v in PROMOTED.items()}
+
+def _on_board(col: int, row: int) -> bool:
+    return 0 <= col < 9 and 0 <= row < 9
+
+def _build_rays() -> Tuple[Tuple[Tuple[int, ...], ...], ...]:
+    rays = []
+    for sq in range(81):
+        col, row = sq % 9, sq // 9
+        per_dir = []
+        for dc, dr in _DIRECTIONS:
+            squares = []
+            c, r = col + dc, row + dr
+            while _on_board(c, r):
+                squares.append(r * 9 + c)
+                c, r = c + dc, r + dr
+            per_dir.append(tuple(squares))
+        rays.append(tuple(per_dir))
+    return tuple(rays)
+
+# _RAYS[マス][方向] = その方向に並ぶマス（近い順）
+_RAYS = _build_rays()
+
+def _build_attack_kinds() -> List[Tuple[int, ...]]:
+    kinds = [(0,) * 8] * 32
+    for piece_type, moves in _BLACK_MOVES.items():
+        kinds[piece_type] = tuple(moves.get(d, 0) for d in range(8))
+        kinds[piece_type | (shogi.WHITE << _COLOR_SHIFT)] = tuple(moves.get(_MIRROR[d], 0) for d in range(8))
+    return kinds
+
+# _ATTACK_KINDS[駒][方向] = 駒からその方向への利き（0: なし, _STEP, _SLIDE）
+_ATTACK_KINDS = _build_attack_kinds()
+
+def _build_knight_sources() -> Tuple[Tuple[Tuple[int, ...], ...], ...]:
+    # _KNIGHT_SOURCES[手番][マス] = そのマスに利く桂がいるべきマス
+    sources = []
+    for color in shogi.COLORS:
+        per_square = []
+        for sq in range(81):
+            col, row = sq % 9, sq // 9
+            per_square.append(tuple(
+                (row - dr) * 9 + (col - dc)
+                for dc, dr in _KNIGHT_VECTORS[color] if _on_board(col - dc, row - dr)))
+        sources.append(tuple(per_square))
+    return tuple(sources)
+
+_KNIGHT_SOURCES = _build_knight_sources()
+
+def _build_alignment() -> List[List[Optional[Tuple[int, int]]]]:
+    # _ALIGNMENT[移動元][移動先] = (方向, 距離)。直線上になければ None
+    table = []
+    for src in range(81):
+        row = [None] * 81
+        for d in range(8):
+            for distance, dst in enumerate(_RAYS[src][d], 1):
+                row[dst] = (d, distance)
+        table.append(row)
+    return table
+
+_ALIGNMENT = _build_alignment()
+
+# Zobrist 乱数は python-shogi と同じ表・同じ添字を使い、zobrist_hash() の値を一致させる
+_RANDOM = shogi.DEFAULT_RANDOM_ARRAY
+_ZOBRIST = [
+    [_RANDOM[81 * (((cell & _TYPE_MASK) - 1) * 2 + (cell >> _COLOR_SHIFT)) + sq] for sq in range(81)]
+    if 0 < cell & _TYPE_MASK <= shogi.PROM_ROOK else None
+    for cell in range(32)
+]
+_ZOBRIST_TURN = _RANDOM[2268]
+_HAND_WEIGHTS = ((shogi.ROOK, 35625), (shogi.BISHOP, 11875), (shogi.GOLD, 2375), (shogi.SILVER, 475),
+                 (shogi.KNIGHT, 95), (shogi.LANCE, 19), (shogi.PAWN, 1))
+
+# 手番を消して駒種だけにする変換表（python-shogi の pieces と同じ並びを作る）
+_TYPE_ONLY = bytes(cell & _TYPE_MASK for cell in range(256))
+
+def _can_move_without_promotion(to_square: int, piece_type: int, color: int) -> bool:
+    rank = to_square // 9 if color == shogi.BLACK else 8 - to_square // 9
+    if piece_type == shogi.PAWN or piece_type == shogi.LANCE:
+        return rank > 0
+    if piece_type == shogi.KNIGHT:
+        return rank > 1
+    return True
+
+def _in_promotion_zone(square: int, color: int) -> bool:
+    return square // 9 <= 2 if color == shogi.BLACK else square // 9 >= 6
+
+class CompactBoard:
+    """
+    展開・パースの処理に必要な操作だけを持つ軽量な盤面。
+    81マスの bytearray と持駒の個数、事前計算した利きの表で局面を表し、
+    合法性は指した後に自玉への利きを調べて判定する（打ち歩詰めは python-shogi と同じ簡易判定）。
+    python-shogi の Board と同じ名前の属性・メソッドを持ち、局面キー（zobrist_hash）も一致する。
+    """
+    __slots__ = ('_cells', 'turn', 'pieces_in_hand', 'occupied', 'move_stack', 'move_number',
+                 '_kings', '_hash', '_captured')
+
+    def __init__(self, sfen: Optional[str] = None):
+        self.set_sfen(sfen or shogi.STARTING_SFEN)
+
+    def set_sfen(self, sfen: str):
+        parts = sfen.split()
+        if len(parts) != 4:
+            raise ValueError(f"sfen string should consist of 4 parts: {sfen!r}")
+        rows = parts[0].split('/')
+        if len(rows) != 9:
+            raise ValueError(f"expected 9 rows in position part of sfen: {sfen!r}")
+        self._cells = bytearray(81)
+        self.pieces_in_hand = [[0] * 8, [0] * 8]
+        self.occupied = [0, 0]
+        self._kings: List[Optional[int]] = [None, None]
+        self._hash = 0
+        for row, text in enumerate(rows):
+            col = 0
+            promoted = False
+            for c in text:
+                if c.isdigit():
+                    col += int(c)
+                elif c == '+':
+                    promoted = True
+                else:
+                    piece = shogi.Piece.from_symbol(c)
+                    piece_type = PROMOTED[piece.piece_type] if promoted else piece.piece_type
+                    if col >= 9:
+                        raise ValueError(f"too many squares in row of sfen: {sfen!r}")
+                    self._put(row * 9 + col, piece_type | (piece.color << _COLOR_SHIFT))
+                    col += 1
+                    promoted = False
+            if col != 9:
+                raise ValueError(f"expected 9 squares in row of sfen: {sfen!r}")
+        if parts[1] not in ('b', 'w'):
+            raise ValueError(f"expected 'b' or 'w' for turn part of sfen: {sfen!r}")
+        self.turn = shogi.BLACK if parts[1] == 'b' else shogi.WHITE
+        if parts[2] != '-':
+            count = ''
+            for c in parts[2]:
+                if c.isdigit():
+                    count += c
+                    continue
+                piece = shogi.Piece.from_symbol(c)
+                self.pieces_in_hand[piece.color][piece.piece_type] += int(count or 1)
+                count = ''
+        self.move_number = int(parts[3]) or 1
+        self.move_stack: List[shogi.Move] = []
+        self._captured: List[int] = []
+
+    def _put(self, square: int, cell: int):
+        self._cells[square] = cell
+        color = cell >> _COLOR_SHIFT
+        self.occupied[color] |= 1 << square
+        self._hash ^= _ZOBRIST[cell][square]
+        if cell & _TYPE_MASK == shogi.KING:
+            self._kings[color] = square
+
+    def _remove(self, square: int) -> int:
+        cell = self._cells[square]
+        self._cells[square] = 0
+        self.occupied[cell >> _COLOR_SHIFT] ^= 1 << square
+        self._hash ^= _ZOBRIST[cell][square]
+        return cell
+
+    @property
+    def pieces(self) -> bytes:
+        """マスごとの駒種（python-shogi の Board.pieces と同じ並び）。"""
+        return self._cells.translate(_TYPE_ONLY)
+
+    def piece_type_at(self, square: int) -> int:
+        return self._cells[square] & _TYPE_MASK
+
+    def piece_at(self, square: int) -> Optional[shogi.Piece]:
+        cell = self._cells[square]
+        if not cell:
+            return None
+        return shogi.Piece(cell & _TYPE_MASK, cell >> _COLOR_SHIFT)
+
+    def has_piece_in_hand(self, piece_type: int, color: int) -> bool:
+        piece_type = UNPROMOTED.get(piece_type, piece_type)
+        return shogi.PAWN <= piece_type <= shogi.ROOK and self.pieces_in_hand[color][piece_type] > 0
+
+    def zobrist_hash(self) -> int:
+        """python-shogi の Board.zobrist_hash() と同じ値を返す。"""
+        h = self._hash
+        if self.turn == shogi.WHITE:
+            h ^= _ZOBRIST_TURN
+        hand = self.pieces_in_hand[shogi.BLACK]
+        packed = 0
+        for piece_type, weight in _HAND_WEIGHTS:
+            packed += hand[piece_type] * weight
+        bit = 0
+        while packed:
+            if packed & 1:
+                h ^= _RANDOM[2269 + bit]
+            packed >>= 1
+            bit += 1
+        return h
+
+    def push(self, move: shogi.Move):
+        """合法性は確かめずに指す。"""
+        turn = self.turn
+        to_square = move.to_square
+        captured = self._cells[to_square]
+        if captured:
+            self._remove(to_square)
+            captured_type = captured & _TYPE_MASK
+            self.pieces_in_hand[turn][UNPROMOTED.get(captured_type, captured_type)] += 1
+        if move.drop_piece_type:
+            self.pieces_in_hand[turn][move.drop_piece_type] -= 1
+            cell = move.drop_piece_type | (turn << _COLOR_SHIFT)
+        else:
+            cell = self._remove(move.from_square)
+            if move.promotion:
+                cell = PROMOTED[cell & _TYPE_MASK] | (turn << _COLOR_SHIFT)
+        self._put(to_square, cell)
+        self._captured.append(captured)
+        self.move_stack.append(move)
+        self.turn = turn ^ 1
+        self.move_number += 1
+
+    def pop(self) -> shogi.Move:
+        move = self.move_stack.pop()
+        captured = self._captured.pop()
+        self.move_number -= 1
+        turn = self.turn ^ 1
+        self.turn = turn
+        to_square = move.to_square
+        cell = self._remove(to_square)
+        if move.drop_piece_type:
+            self.pieces_in_hand[turn][move.drop_piece_type] += 1
+        else:
+            if move.promotion:
+                cell = UNPROMOTED[cell & _TYPE_MASK] | (turn << _COLOR_SHIFT)
+            self._put(move.from_square, cell)
+        if captured:
+            captured_type = captured & _TYPE_MASK
+            self.pieces_in_hand[turn][UNPROMOTED.get(captured_type, captured_type)] -= 1
+            self._put(to_square, captured)
+        return move
+
+    def _reaches(self, cell: int, from_square: int, to_square: int) -> bool:
+        """from_square の駒 cell が to_square に利いているか。"""
+        if cell & _TYPE_MASK == shogi.KNIGHT:
+            return from_square in _KNIGHT_SOURCES[cell >> _COLOR_SHIFT][to_square]
+        aligned = _ALIGNMENT[from_square][to_square]
+        if aligned is None:
+            return False
+        direction, distance = aligned
+        kind = _ATTACK_KINDS[cell][direction]
+        if kind == _STEP:
+            return distance == 1
+        if kind == _SLIDE:
+            cells = self._cells
+            ray = _RAYS[from_square][direction]
+            for i in range(distance - 1):
+                if cells[ray[i]]:
+                    return False
+            return True
+        return False
+
+    def is_attacked_by(self, color: int, square: Optional[int], include_king: bool = True) -> bool:
+        """color 側の駒が square に利いているか。"""
+        if square is None:
+            return False
+        cells = self._cells
+        rays = _RAYS[square]
+        for direction in range(8):
+            distance = 0
+            for other in rays[direction]:
+                distance += 1
+                cell = cells[other]
+                if not cell:
+                    continue
+                if cell >> _COLOR_SHIFT == color:
+                    kind = _ATTACK_KINDS[cell][_OPPOSITE[direction]]
+                    if kind == _SLIDE or (kind == _STEP and distance == 1):
+                        if include_king or cell & _TYPE_MASK != shogi.KING:
+                            return True
+                break
+        knight = shogi.KNIGHT | (color << _COLOR_SHIFT)
+        for other in _KNIGHT_SOURCES[color][square]:
+            if cells[other] == knight:
+                return True
+        return False
+
+    def candidate_origins(self, color: int, piece_type: int, to_square: int) -> List[int]:
+        """color 側の piece_type の駒のうち、to_square に利いている駒のマス（昇順）。"""
+        cells = self._cells
+        target = piece_type | (color << _COLOR_SHIFT)
+        if piece_type == shogi.KNIGHT:
+            return sorted(sq for sq in _KNIGHT_SOURCES[color][to_square] if cells[sq] == target)
+        kinds = _ATTACK_KINDS[target]
+        rays = _RAYS[to_square]
+        squares = []
+        for direction in range(8):
+            kind = kinds[_OPPOSITE[direction]]
+            if not kind:
+                continue
+            for other in rays[direction]:
+                cell = cells[other]
+                if cell:
+                    if cell == target:
+                        squares.append(other)
+                    break
+                if kind == _STEP:
+                    break
+        squares.sort()
+        return squares
+
+    def is_drop_possible(self, piece_type: int, to_square: int) -> bool:
+        """持駒 piece_type を to_square に打つ手が合法か。"""
+        if not shogi.PAWN <= piece_type <= shogi.ROOK or self._cells[to_square]:
+            return False
+        return self.is_legal(shogi.Move(None, to_square, False, piece_type))
+
+    def is_legal(self, move: shogi.Move) -> bool:
+        turn = self.turn
+        cells = self._cells
+        to_square = move.to_square
+        captured = cells[to_square]
+        if captured and captured >> _COLOR_SHIFT == turn:
+            return False
+        from_square = move.from_square
+        if from_square is not None:
+            cell = cells[from_square]
+            if not cell or cell >> _COLOR_SHIFT != turn:
+                return False
+            piece_type = cell & _TYPE_MASK
+            if move.promotion:
+                if piece_type not in PROMOTED:
+                    return False
+                if not _in_promotion_zone(from_square, turn) and not _in_promotion_zone(to_square, turn):
+                    return False
+                moved = PROMOTED[piece_type] | (turn << _COLOR_SHIFT)
+            else:
+                if not _can_move_without_promotion(to_square, piece_type, turn):
+                    return False
+                moved = cell
+            if not self._reaches(cell, from_square, to_square):
+                return False
+            # 盤面だけを仮に動かして自玉への利きを調べる
+            cells[from_square] = 0
+            cells[to_square] = moved
+            king = to_square if piece_type == shogi.KING else self._kings[turn]
+            suicide = self.is_attacked_by(turn ^ 1, king)
+            cells[to_square] = captured
+            cells[from_square] = cell
+            return not suicide
+
+        piece_type = move.drop_piece_type
+        if not piece_type or move.promotion or captured:
+            return False
+        if not shogi.PAWN <= piece_type <= shogi.ROOK or not self.pieces_in_hand[turn][piece_type]:
+            return False
+        if not _can_move_without_promotion(to_square, piece_type, turn):
+            return False
+        if piece_type == shogi.PAWN and self._has_pawn_on_file(turn, to_square % 9):
+            return False
+        cells[to_square] = piece_type | (turn << _COLOR_SHIFT)
+        legal = not self.is_attacked_by(turn ^ 1, self._kings[turn])
+        if legal and piece_type == shogi.PAWN:
+            legal = not self._is_pawn_drop_mate(turn, to_square)
+        cells[to_square] = 0
+        return legal
+
+    def _has_pawn_on_file(self, color: int, col: int) -> bool:
+        pawn = shogi.PAWN | (color << _COLOR_SHIFT)
+        cells = self._cells
+        for sq in range(col, 81, 9):
+            if cells[sq] == pawn:
+                return True
+        return False
+
+    def _is_pawn_drop_mate(self, color: int, pawn_square: int) -> bool:
+        """打った歩で相手玉が詰むか（python-shogi の was_check_by_dropping_pawn と同じ判定）。"""
+        opponent = color ^ 1
+        king = self._kings[opponent]
+        if king is None:
+            return False
+        if king != pawn_square + (-9 if color == shogi.BLACK else 9):
+            return False
+        cells = self._cells
+        for direction in range(8):
+            ray = _RAYS[king][direction]
+            if not ray:
+                continue
+            escape = ray[0]
+            cell = cells[escape]
+            if cell and cell >> _COLOR_SHIFT == opponent:
+                continue
+            if not self.is_attacked_by(color, escape):
+                return False
+        return not self.is_attacked_by(opponent, pawn_square, include_king=False)
+
+    def sfen(self) -> str:
+        """python-shogi の Board.sfen() と同じ形式の SFEN を返す。"""
+        rows = []
+        cells = self._cells
+        for row in range(9):
+            text = []
+            empty = 0
+            for sq in range(row * 9, row * 9 + 9):
+                cell = cells[sq]
+                if not cell:
+                    empty += 1
+                    continue
+                if empty:
+                    text.append(str(empty))
+                    empty = 0
+                symbol = shogi.PIECE_SYMBOLS[cell & _TYPE_MASK]
+                text.append(symbol.lower() if cell >> _COLOR_SHIFT == shogi.WHITE else symbol.upper())
+            if empty:
+                text.append(str(empty))
+            rows.append("".join(text))
+        hand = []
+        for color in shogi.COLORS:
+            counts = self.pieces_in_hand[color]
+            for piece_type in range(shogi.ROOK, shogi.NONE, -1):
+                count = counts[piece_type]
+                if count:
+                    if count > 1:
+                        hand.append(str(count))
+                    symbol = shogi.PIECE_SYMBOLS[piece_type]
+                    hand.append(symbol.lower() if color == shogi.WHITE else symbol.upper())
+        turn = 'w' if self.turn == shogi.WHITE else 'b'
+        return f"{'/'.join(rows)} {turn} {''.join(hand) or '-'} {self.move_number}"
+
+# 盤面の実装（--engine で選ぶ）
+ENGINES = {
+    'python-shogi': shogi.Board,
+    'compact': CompactBoard,
+}
+DEFAULT_ENGINE = 'python-shogi'
+
+AnyBoard = Union[shogi.Board, CompactBoard]
+
+def new_board(engine: str = DEFAULT_ENGINE, sfen: Optional[str] = None) -> AnyBoard:
+    """指定した実装の盤面を作る。sfen を省略すると平手の初期局面。"""
+    board_class = ENGINES.get(engine)
+    if board_class is None:
+        raise ValueError(f"Unknown board engine: {engine}")
+    return board_class(sfen) if sfen else board_class()
@@ -0,0 +1,257 @@
+import collections
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+
+from logic.graph import PositionGraph
+
+CACHE_FORMAT_VERSION = 1
+CACHE_MAGIC = b'KI2C'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ki2-branch-expander')
+DEFAULT_CACHE_LIMIT = 256 << 20
+# MemoryParseCache が保持するパース結果の数の既定値
+DEFAULT_MEMORY_ENTRIES = 64
+_CACHE_SUFFIX = '.bin'
+
+class CachedParse(NamedTuple):
+    graph: PositionGraph
+    arrival_info: Dict[int, Dict[str, Tuple[str, ...]]]
+    header: str
+    # 合流局面などレポート用に記録された局面キー -> SFEN
+    sfens: Dict[int, str]
+
+class _StringTable:
+    """同じ文字列（指し手・コメント）を一度だけ格納するための表。"""
+    def __init__(self):
+        self.strings: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def add(self, s: str) -> int:
+        i = self._index.get(s)
+        if i is None:
+            i = len(self.strings)
+            self._index[s] = i
+            self.strings.append(s)
+        return i
+
+def _write_array(f: BinaryIO, data: array):
+    f.write(struct.pack('<cI', data.typecode.encode(), len(data)))
+    f.write(data.tobytes())
+
+def _read_array(f: BinaryIO) -> array:
+    typecode, count = struct.unpack('<cI', f.read(5))
+    data = array(typecode.decode())
+    data.frombytes(f.read(count * data.itemsize))
+    if len(data) != count:
+        raise ValueError("truncated cache entry")
+    return data
+
+def dump_parse(f: BinaryIO, parsed: CachedParse):
+    """
+    パース結果をバイナリで書き出す。局面グラフの配列はそのまま、
+    文字列（ヘッダー・コメント・到達経路の指し手）は文字列表への添字で格納する。
+    """
+    table = _StringTable()
+    header_index = table.add(parsed.header)
+
+    graph = parsed.graph
+    comment_edges, comment_counts, comment_strings = array('I'), array('I'), array('I')
+    for edge in sorted(graph.comments):
+        comments = graph.comments[edge]
+        comment_edges.append(edge)
+        comment_counts.append(len(comments))
+        comment_strings.extend(table.add(c) for c in comments)
+
+    arrival_keys, arrival_counts = array('Q'), array('I')
+    labels, path_lengths, path_strings = array('I'), array('B'), array('I')
+    for key, arrivals in parsed.arrival_info.items():
+        arrival_keys.append(key)
+        arrival_counts.append(len(arrivals))
+        for label, path in arrivals.items():
+            labels.append(table.add(label))
+            path_lengths.append(len(path))
+            path_strings.extend(table.add(m) for m in path)
+
+    sfen_keys = array('Q', parsed.sfens)
+    sfen_strings = array('I', (table.add(s) for s in parsed.sfens.values()))
+
+    encoded = [s.encode('utf-8') for s in table.strings]
+    f.write(CACHE_MAGIC)
+    f.write(struct.pack('<II', CACHE_FORMAT_VERSION, header_index))
+    _write_array(f, array('I', (len(b) for b in encoded)))
+    f.write(b''.join(encoded))
+    for data in (graph.keys, graph.edge_offsets, graph.edge_moves, graph.edge_targets,
+                 comment_edges, comment_counts, comment_strings,
+                 arrival_keys, arrival_counts, labels, path_lengths, path_strings,
+                 sfen_keys, sfen_strings):
+        _write_array(f, data)
+
+def load_parse(f: BinaryIO) -> CachedParse:
+    """dump_parse の逆変換。形式が合わない場合は ValueError。"""
+    if f.read(4) != CACHE_MAGIC:
+        raise ValueError("not a parse cache entry")
+    version, header_index = struct.unpack('<II', f.read(8))
+    if version != CACHE_FORMAT_VERSION:
+        raise ValueError(f"unsupported cache format version: {version}")
+    lengths = _read_array(f)
+    blob = f.read(sum(lengths))
+    strings = []
+    pos = 0
+    for length in lengths:
+        strings.append(blob[pos:pos + length].decode('utf-8'))
+        pos += length
+
+    keys, offsets, moves, targets = (_read_array(f) for _ in range(4))
+    comment_edges, comment_counts, comment_strings = (_read_array(f) for _ in range(3))
+    comments = {}
+    pos = 0
+    for edge, count in zip(comment_edges, comment_counts):
+        comments[edge] = tuple(strings[i] for i in comment_strings[pos:pos + count])
+        pos += count
+
+    arrival_keys, arrival_counts, labels, path_lengths, path_strings = (_read_array(f) for _ in range(5))
+    arrival_info: Dict[int, Dict[str, Tuple[str, ...]]] = {}
+    arrival = path_pos = 0
+    for key, count in zip(arrival_keys, arrival_counts):
+        arrivals = {}
+        for _ in range(count):
+            length = path_lengths[arrival]
+            arrivals[strings[labels[arrival]]] = tuple(strings[i] for i in path_strings[path_pos:path_pos + length])
+            arrival += 1
+            path_pos += length
+        arrival_info[key] = arrivals
+
+    sfen_keys, sfen_strings = _read_array(f), _read_array(f)
+    sfens = {key: strings[i] for key, i in zip(sfen_keys, sfen_strings)}
+    graph = PositionGraph(keys, offsets, moves, targets, comments)
+    return CachedParse(graph, arrival_info, strings[header_index], sfens)
+
+class ParseCache:
+    """
+    ファイル内容のハッシュとパーサーのバージョンをキーにした、パース結果のディスクキャッシュ。
+    合計サイズが max_bytes を超えたら、最後に使われた時刻の古いエントリから削除する。
+    書き込みは一時ファイルからの置き換えで行うため、並列実行中でも壊れたエントリは見えない。
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, parser_version: int = 0, max_bytes: int = DEFAULT_CACHE_LIMIT):
+        self.directory = directory
+        self.parser_version = parser_version
+        self.max_bytes = max_bytes
+
+    def entry_path(self, content: bytes) -> str:
+        h = hashlib.blake2b(content, digest_size=20)
+        h.update(f":{self.parser_version}:{CACHE_FORMAT_VERSION}:{sys.byteorder}".encode())
+        return os.path.join(self.directory, h.hexdigest() + _CACHE_SUFFIX)
+
+    def load(self, content: bytes) -> Optional[CachedParse]:
+        path = self.entry_path(content)
+        try:
+            with open(path, 'rb') as f:
+                parsed = load_parse(f)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return parsed
+
+    def store(self, content: bytes, parsed: CachedParse):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    dump_parse(f, parsed)
+                os.replace(tmp_path, self.entry_path(content))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            print(f"Warning: could not write parse cache: {e}")
+            return
+        self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(_CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self) -> int:
+        """すべてのエントリを削除し、削除した数を返す。"""
+        removed = 0
+        for _, _, path in self._entries():
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+class MemoryParseCache:
+    """
+    パース結果をメモリに保持するキャッシュ（ParseCache と同じ load / store を持つ）。
+    長時間動かすプロセス（--watch）で使い、最近使った max_entries 件までを残す。
+    backing に ParseCache を渡すと、メモリにないものはそちらから読み、保存も両方に行う。
+    """
+    def __init__(self, backing: Optional[ParseCache] = None, max_entries: int = DEFAULT_MEMORY_ENTRIES):
+        self.backing = backing
+        self.max_entries = max_entries
+        self._entries: 'collections.OrderedDict[bytes, CachedParse]' = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(content: bytes) -> bytes:
+        return hashlib.blake2b(content, digest_size=20).digest()
+
+    def _remember(self, key: bytes, parsed: CachedParse):
+        self._entries[key] = parsed
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self, content: bytes) -> Optional[CachedParse]:
+        key = self._key(content)
+        parsed = self._entries.get(key)
+        if parsed is not None:
+            self._entries.move_to_end(key)
+            return parsed
+        if self.backing is not None:
+            parsed = self.backing.load(content)
+            if parsed is not None:
+                self._remember(key, parsed)
+        return parsed
+
+    def store(self, content: bytes, parsed: CachedParse):
+        self._remember(self._key(content), parsed)
+        if self.backing is not None:
+            self.backing.store(content, parsed)
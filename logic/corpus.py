@@ -0,0 +1,187 @@
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from extract_moves import parse_ki2_bytes
+from logic.board import AnyBoard, DEFAULT_ENGINE
+from logic.graph import PositionGraph, PositionGraphBuilder
+from logic.position import get_board_key, PositionKeys
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER PRIMARY KEY,
+    sfen TEXT
+);
+CREATE TABLE IF NOT EXISTS edges (
+    src INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    dst INTEGER NOT NULL,
+    PRIMARY KEY (src, move)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS edge_sources (
+    src INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    PRIMARY KEY (src, move, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS edges_dst ON edges(dst);
+CREATE INDEX IF NOT EXISTS edge_sources_file ON edge_sources(file_id);
+CREATE TABLE IF NOT EXISTS comments (
+    src INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    seq INTEGER NOT NULL,
+    comment TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_edge ON comments(src, move);
+CREATE INDEX IF NOT EXISTS comments_file ON comments(file_id);
+"""
+
+# SQLite の IN 句に一度に渡す局面数
+_QUERY_CHUNK = 500
+# subgraph() で読み出す局面数の既定の上限
+DEFAULT_MAX_POSITIONS = 1_000_000
+
+def _to_db(key: int) -> int:
+    """64ビット符号なしの局面キーを SQLite の符号付き整数に収める。"""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+def _from_db(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def _chunks(items: List[int], size: int) -> Iterator[List[int]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class CorpusIndex:
+    """
+    多数の KI2 ファイルの局面グラフをまとめて保持する SQLite の索引（定跡データベース）。
+    局面はキー、辺は (移動元, 指し手) を主キーとし、どのファイルに現れたかとコメントを別表に持つ。
+    subgraph() で任意の局面から到達できる部分だけを読み出し、expand_tree などに渡せる。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> 'CorpusIndex':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_file(self, file_path: str, engine: str = DEFAULT_ENGINE) -> Optional[int]:
+        """
+        KI2 ファイルをパースして索引に加え、登録した辺の数を返す。
+        内容が前回の登録から変わっていなければ何もせず None を返す。
+        変わっていれば、そのファイル由来の辺とコメントを入れ替える。
+        """
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        content_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+        row = self.connection.execute("SELECT id, content_hash FROM files WHERE path = ?", (file_path,)).fetchone()
+        if row is not None and row[1] == content_hash:
+            return None
+
+        keys = PositionKeys()
+        # ハッシュを取ったのと同じ内容をパースする
+        graph, _, _ = parse_ki2_bytes(content, file_path, keys, engine)
+        db_keys = [_to_db(k) for k in graph.keys]
+        edge_rows = []
+        comment_rows = []
+        for pos in range(len(graph)):
+            for edge in graph.edges(pos):
+                move = graph.edge_moves[edge]
+                edge_rows.append((db_keys[pos], move, db_keys[graph.edge_targets[edge]]))
+                for seq, comment in enumerate(graph.edge_comments(edge)):
+                    comment_rows.append((db_keys[pos], move, seq, comment))
+
+        with self.connection:
+            if row is None:
+                file_id = self.connection.execute(
+                    "INSERT INTO files(path, content_hash) VALUES (?, ?)", (file_path, content_hash)).lastrowid
+            else:
+                file_id = row[0]
+                self.connection.execute("UPDATE files SET content_hash = ? WHERE id = ?", (content_hash, file_id))
+                self.connection.execute("DELETE FROM edge_sources WHERE file_id = ?", (file_id,))
+                self.connection.execute("DELETE FROM comments WHERE file_id = ?", (file_id,))
+            self.connection.executemany("INSERT OR IGNORE INTO positions(key) VALUES (?)", ((k,) for k in db_keys))
+            self.connection.executemany(
+                "UPDATE positions SET sfen = ? WHERE key = ? AND sfen IS NULL",
+                ((sfen, _to_db(k)) for k, sfen in keys.remembered().items()))
+            self.connection.executemany("INSERT OR IGNORE INTO edges(src, move, dst) VALUES (?, ?, ?)", edge_rows)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO edge_sources(src, move, file_id) VALUES (?, ?, ?)",
+                ((src, move, file_id) for src, move, _ in edge_rows))
+            self.connection.executemany(
+                "INSERT INTO comments(src, move, file_id, seq, comment) VALUES (?, ?, ?, ?, ?)",
+                ((src, move, file_id, seq, comment) for src, move, seq, comment in comment_rows))
+            if row is not None:
+                # 入れ替えでどのファイルにも現れなくなった辺と局面を消す
+                self.connection.execute(
+                    "DELETE FROM edges WHERE NOT EXISTS "
+                    "(SELECT 1 FROM edge_sources s WHERE s.src = edges.src AND s.move = edges.move)")
+                self.connection.execute(
+                    "DELETE FROM positions WHERE NOT EXISTS (SELECT 1 FROM edges e WHERE e.src = positions.key) "
+                    "AND NOT EXISTS (SELECT 1 FROM edges e WHERE e.dst = positions.key)")
+        return len(edge_rows)
+
+    def add_files(self, file_paths: Iterable[str], engine: str = DEFAULT_ENGINE) -> Tuple[int, int]:
+        """複数ファイルを登録し、(登録したファイル数, 変更がなく飛ばしたファイル数) を返す。"""
+        indexed = skipped = 0
+        for file_path in file_paths:
+            if self.add_file(file_path, engine) is None:
+                skipped += 1
+            else:
+                indexed += 1
+        return indexed, skipped
+
+    def counts(self) -> Tuple[int, int, int]:
+        """(ファイル数, 局面数, 辺の数)"""
+        return tuple(self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                     for table in ("files", "positions", "edges"))
+
+    def sfen(self, key: int) -> Optional[str]:
+        row = self.connection.execute("SELECT sfen FROM positions WHERE key = ?", (_to_db(key),)).fetchone()
+        return row[0] if row else None
+
+    def subgraph(self, board: AnyBoard, keys: Optional[PositionKeys] = None,
+                 max_positions: Optional[int] = DEFAULT_MAX_POSITIONS) -> PositionGraph:
+        """
+        board の局面から到達できる局面と辺だけを幅優先で読み出して PositionGraph にする。
+        データベース全体はメモリに載せない。続きを読み出す局面は max_positions まで（None なら無制限）で、
+        その先の局面は葉として扱う。葉にした局面があれば、結果の局面数は max_positions を超える。
+        """
+        root = keys.key(board) if keys is not None else get_board_key(board)
+        builder = PositionGraphBuilder()
+        builder.intern(root)
+        seen = {root}
+        frontier = [root]
+        while frontier:
+            next_frontier = []
+            for chunk in _chunks([_to_db(k) for k in frontier], _QUERY_CHUNK):
+                placeholders = ",".join("?" * len(chunk))
+                edges: Dict[Tuple[int, int], int] = {}
+                for src, move, dst in self.connection.execute(
+                        f"SELECT src, move, dst FROM edges WHERE src IN ({placeholders})", chunk):
+                    src_key, dst_key = _from_db(src), _from_db(dst)
+                    edges[(src, move)] = builder.add_edge(builder.intern(src_key), move, builder.intern(dst_key))
+                    if dst_key not in seen and (max_positions is None or len(seen) < max_positions):
+                        seen.add(dst_key)
+                        next_frontier.append(dst_key)
+                for src, move, comment in self.connection.execute(
+                        f"SELECT src, move, comment FROM comments WHERE src IN ({placeholders}) "
+                        f"ORDER BY file_id, seq", chunk):
+                    edge = edges.get((src, move))
+                    if edge is not None:
+                        builder.add_comment(edge, comment)
+            frontier = next_frontier
+        return builder.build()
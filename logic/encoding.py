@@ -0,0 +1,67 @@
+import codecs
+import io
+from typing import BinaryIO, TextIO
+
+# 将棋ソフトの標準（Shift_JIS）。判定できない場合もこれとみなす
+DEFAULT_ENCODING = 'cp932'
+# エンコーディングの判定に一度に読むバイト数
+SNIFF_SIZE = 4096
+# 先頭が ASCII だけの場合に読み進める上限
+SNIFF_LIMIT = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+def detect_encoding(head: bytes, complete: bool = False) -> str:
+    """
+    ファイル先頭のバイト列からエンコーディングを判定する。
+    BOM があればそれに従い、なければ UTF-8 として正しくデコードできるかで UTF-8（.ki2u など）と
+    cp932 を見分ける。head がファイルの途中で切れていてもよい（complete=False）。
+    """
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    if head.isascii():
+        # ASCII だけなら cp932 と UTF-8 のどちらで読んでも同じ
+        return DEFAULT_ENCODING
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return DEFAULT_ENCODING
+    return 'utf-8'
+
+def sniff_encoding(f: BinaryIO) -> str:
+    """
+    バイナリストリームの先頭を読んでエンコーディングを判定し、読んだ位置を先頭に戻す。
+    先頭が ASCII だけなら、ASCII 以外のバイトが現れるまで SNIFF_LIMIT まで読み進める。
+    """
+    head = b''
+    at_end = False
+    while len(head) < SNIFF_LIMIT:
+        chunk = f.read(SNIFF_SIZE)
+        head += chunk
+        at_end = len(chunk) < SNIFF_SIZE
+        if at_end or not chunk.isascii():
+            break
+    f.seek(0)
+    return detect_encoding(head, complete=at_end)
+
+def detect_file_encoding(file_path: str) -> str:
+    with open(file_path, 'rb') as f:
+        return sniff_encoding(f)
+
+def open_text(file_path: str) -> TextIO:
+    """
+    エンコーディングを判定してファイルをテキストとして開く。デコードはチャンク単位で逐次行われ、
+    ファイル全体を一度にデコードすることはない。デコードできないバイトは U+FFFD に置き換える。
+    """
+    raw = open(file_path, 'rb')
+    try:
+        encoding = sniff_encoding(raw)
+    except BaseException:
+        raw.close()
+        raise
+    return io.TextIOWrapper(raw, encoding=encoding, errors='replace')
@@ -0,0 +1,217 @@
+import codecs
+from array import array
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from logic.expander import get_ki2_move_str
+from logic.board import AnyBoard
+from logic.encoding import DEFAULT_ENCODING
+from logic.graph import PositionGraph, decode_move
+from logic.position import get_board_key, PositionKeys
+
+# 部分木の集計値のインデックス
+NODES, VARIATIONS, COMMENTS, COMMENT_BYTES, COMMENTED_INNER, COMMENTED_LEAVES, LAST_LEAF_COMMENTED, MOVE_BYTES, HEADING_BYTES = range(9)
+_EMPTY = (0,) * 9
+
+class ExpansionEstimate(NamedTuple):
+    nodes: int
+    lines: int
+    approx_bytes: int
+    # 局面ID -> 展開後のツリーにその局面が現れる回数
+    multiplicity: Dict[int, int]
+
+def _byte_length(encoding: str) -> Callable[[str], int]:
+    """encoding で書き出したときの文字列のバイト数を返す関数。BOM はファイル先頭に一度だけ付くので数えない。"""
+    encoder = codecs.getincrementalencoder(encoding)('replace')
+    encoder.encode('')
+    return lambda s: len(encoder.encode(s))
+
+def estimate_expansion(board: AnyBoard, graph: PositionGraph, header: str = "", keys: Optional[PositionKeys] = None,
+                       encoding: str = DEFAULT_ENCODING, max_nodes: Optional[int] = None) -> Optional[ExpansionEstimate]:
+    """
+    展開後のツリーを作らずに、ノード数・出力行数・出力バイト数の概算と、
+    各局面の出現回数を局面グラフ上の動的計画法で求める。
+    強連結成分の外から入った局面の集計は経路に依存しないため一度だけ計算し、
+    循環を含む成分の内側だけを経路履歴付きで数え上げる。
+    出力行数とノード数は write_expanded_ki2 の結果と一致する。バイト数は
+    「変化：n手目」の n を根からの最短手数で近似するため概算となる。
+    バイト数は encoding（BOM を含む）で書き出した場合のもの。
+    max_nodes を指定すると、ノード数がそれを超えると分かった時点で打ち切って None を返す。
+    たどった手はどれも展開後のツリーに1回以上現れるので、数え上げの手間もノード数で抑えられる。
+    """
+    root = graph.position_id(keys.key(board) if keys is not None else get_board_key(board))
+    byte_length = _byte_length(encoding)
+    # 空白・改行・「*」などの ASCII 文字1文字のバイト数
+    ascii_bytes = byte_length(" ")
+    header_bytes = len("".encode(encoding)) + byte_length(header + "\n\n")
+    header_newlines = header.count("\n") + 2
+    if root is None:
+        return ExpansionEstimate(0, header_newlines, header_bytes, {})
+
+    move_bytes = _edge_move_bytes(board, graph, root, byte_length)
+    plies = _shortest_plies(graph, root)
+    component, cyclic = graph.strong_components()
+    offsets, targets = graph.edge_offsets, graph.edge_targets
+
+    # 強連結成分の外から入った局面の部分木の集計。経路上の局面には戻れないので経路に依存しない
+    memo: Dict[int, tuple] = {}
+    # 循環を含む成分の入口 -> (その入口から成分内で各局面が現れる回数, 成分の外へ出る手の行き先ごとの回数)
+    inside: Dict[int, Tuple[Dict[int, int], Dict[int, int]]] = {}
+
+    def heading_bytes(pos: int) -> int:
+        return byte_length(f"\n\n変化：{plies[pos] + 1}手目\n")
+
+    def combine(pos: int, children: List[tuple], edges: range) -> tuple:
+        total = [0] * 9
+        for edge, child in zip(edges, children):
+            comments = graph.edge_comments(edge)
+            total[NODES] += 1 + child[NODES]
+            total[MOVE_BYTES] += move_bytes[edge] + child[MOVE_BYTES]
+            total[COMMENTS] += len(comments) + child[COMMENTS]
+            total[COMMENT_BYTES] += sum(byte_length(c) for c in comments) + child[COMMENT_BYTES]
+            if comments:
+                total[COMMENTED_LEAVES if child[NODES] == 0 else COMMENTED_INNER] += 1
+            total[COMMENTED_LEAVES] += child[COMMENTED_LEAVES]
+            total[COMMENTED_INNER] += child[COMMENTED_INNER]
+            total[VARIATIONS] += child[VARIATIONS]
+            total[HEADING_BYTES] += child[HEADING_BYTES]
+        if children:
+            last_edge, last_child = edges[-1], children[-1]
+            if last_child[NODES] == 0:
+                total[LAST_LEAF_COMMENTED] = 1 if graph.edge_comments(last_edge) else 0
+            else:
+                total[LAST_LEAF_COMMENTED] = last_child[LAST_LEAF_COMMENTED]
+            total[VARIATIONS] += len(children) - 1
+            total[HEADING_BYTES] += (len(children) - 1) * heading_bytes(pos)
+        return tuple(total)
+
+    # スタックの各要素は [局面ID, 次の辺, 子の集計, 循環を含む成分の入口（なければ None）, 成分の外から入ったか]
+    history = set()
+    stack: List[list] = []
+
+    def enter(pos: int, parent_component: int, entry: Optional[int]) -> Optional[tuple]:
+        if pos in history or offsets[pos] == offsets[pos + 1]:
+            return _EMPTY
+        entering = component[pos] != parent_component
+        if entering:
+            cached = memo.get(pos)
+            if cached is not None:
+                return cached
+            # 経路ごとに数え上げるのは循環を含む成分の内側だけ
+            entry = pos if cyclic[component[pos]] else None
+            if entry is not None:
+                inside[pos] = ({pos: 1}, {})
+        history.add(pos)
+        stack.append([pos, offsets[pos], [], entry, entering])
+        return None
+
+    steps = 0
+    result = enter(root, -1, None)
+    while stack:
+        frame = stack[-1]
+        pos, edge, children, entry, entering = frame
+        if edge < offsets[pos + 1]:
+            steps += 1
+            if max_nodes is not None and steps > max_nodes:
+                return None
+            frame[1] = edge + 1
+            child = targets[edge]
+            if entry is not None:
+                counts, exits = inside[entry]
+                if component[child] == component[pos]:
+                    counts[child] = counts.get(child, 0) + 1
+                else:
+                    exits[child] = exits.get(child, 0) + 1
+            child_result = enter(child, component[pos], entry)
+            if child_result is not None:
+                children.append(child_result)
+            continue
+        stack.pop()
+        history.discard(pos)
+        summary = combine(pos, children, graph.edges(pos))
+        if max_nodes is not None and summary[NODES] > max_nodes:
+            return None
+        if entering:
+            memo[pos] = summary
+        if stack:
+            stack[-1][2].append(summary)
+        else:
+            result = summary
+
+    multiplicity = _multiplicity(graph, root, component, cyclic, inside)
+
+    nodes = result[NODES]
+    variations = result[VARIATIONS]
+    comments = result[COMMENTS]
+    # コメント直後に「変化：」が続く箇所は改行が1つ詰められる
+    collapsed = result[COMMENTED_LEAVES] - result[LAST_LEAF_COMMENTED]
+    newlines = 2 * comments + 3 * variations - collapsed
+    spaces = max(nodes - 1 - variations - result[COMMENTED_INNER], 0)
+    body_bytes = result[MOVE_BYTES] + (spaces + 3 * comments - collapsed) * ascii_bytes + result[COMMENT_BYTES] + result[HEADING_BYTES]
+    lines = header_newlines + newlines + (0 if result[LAST_LEAF_COMMENTED] else 1)
+    return ExpansionEstimate(nodes, lines, header_bytes + body_bytes, multiplicity)
+
+def _edge_move_bytes(board: AnyBoard, graph: PositionGraph, root: int, byte_length: Callable[[str], int]) -> array:
+    """
+    各辺の指し手断片（▲/△ + 表記）のバイト数。局面ごとに一度だけ盤面を再現して求める。
+    「同　」と筋・段の表記はどちらも全角2文字なので、バイト数は直前の手に依存しない。
+    """
+    sizes = array('I', bytes(4 * graph.edge_count))
+    offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    visited = bytearray(len(graph))
+    visited[root] = 1
+    stack = [[root, offsets[root]]]
+    while stack:
+        frame = stack[-1]
+        pos, edge = frame
+        if edge < offsets[pos + 1]:
+            frame[1] = edge + 1
+            move = decode_move(edge_moves[edge])
+            sizes[edge] = byte_length("▲" + get_ki2_move_str(board, move))
+            child = targets[edge]
+            if not visited[child]:
+                visited[child] = 1
+                board.push(move)
+                stack.append([child, offsets[child]])
+            continue
+        stack.pop()
+        if stack:
+            board.pop()
+    return sizes
+
+def _shortest_plies(graph: PositionGraph, root: int) -> array:
+    plies = array('I', bytes(4 * len(graph)))
+    seen = bytearray(len(graph))
+    seen[root] = 1
+    queue = [root]
+    for pos in queue:
+        for edge in graph.edges(pos):
+            child = graph.edge_targets[edge]
+            if not seen[child]:
+                seen[child] = 1
+                plies[child] = plies[pos] + 1
+                queue.append(child)
+    return plies
+
+def _multiplicity(graph: PositionGraph, root: int, component: List[int], cyclic: bytearray,
+                  inside: Dict[int, Tuple[Dict[int, int], Dict[int, int]]]) -> Dict[int, int]:
+    """
+    成分の外から各局面に入る回数を、成分の確定順の逆（入口側から）に伝播して、局面ごとの出現回数を求める。
+    循環を含む成分では、入口ごとに数えた成分内の出現回数と外へ出る手の回数を入る回数倍する。
+    """
+    entries = {root: 1}
+    multiplicity: Dict[int, int] = {}
+    for pos in sorted(range(len(graph)), key=component.__getitem__, reverse=True):
+        count = entries.get(pos)
+        if not count:
+            continue
+        if cyclic[component[pos]]:
+            counts, exits = inside[pos]
+        else:
+            counts, exits = {pos: 1}, {}
+            for edge in graph.edges(pos):
+                exits[graph.edge_targets[edge]] = exits.get(graph.edge_targets[edge], 0) + 1
+        for member, n in counts.items():
+            multiplicity[member] = multiplicity.get(member, 0) + count * n
+        for target, n in exits.items():
+            entries[target] = entries.get(target, 0) + count * n
+    return multiplicity
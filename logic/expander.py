@@ -1,140 +1,295 @@
 import shogi
-from typing import Dict, Set, List, Optional
-import re
+from typing import Dict, Set, List, Optional, Tuple, Union
+from logic.position import get_board_key, PositionKeys
+from logic.board import AnyBoard
+from logic.corpus import CorpusIndex
+from logic.graph import PositionGraph, decode_move, move_usi
+from logic.pruning import Pruner
+from logic.attacks import candidate_origins
 
-def get_ki2_move_str(board: shogi.Board, move: shogi.Move) -> str:
+ZEN_NUM = "　１２３４５６７８９"
+KAN_NUM = "　一二三四五六七八九"
+
+PIECE_MAP = {
+    shogi.PAWN: '歩', shogi.LANCE: '香', shogi.KNIGHT: '桂', shogi.SILVER: '銀',
+    shogi.GOLD: '金', shogi.BISHOP: '角', shogi.ROOK: '飛', shogi.KING: '玉',
+    shogi.PROM_PAWN: 'と', shogi.PROM_LANCE: '成香', shogi.PROM_KNIGHT: '成桂',
+    shogi.PROM_SILVER: '成銀', shogi.PROM_BISHOP: '馬', shogi.PROM_ROOK: '龍'
+}
+
+# 相対表記で左右を先に書く駒（金・銀の動きをする駒）
+LATERAL_FIRST_PIECE_TYPES = frozenset([
+    shogi.PAWN, shogi.LANCE, shogi.KNIGHT, shogi.SILVER, shogi.GOLD,
+    shogi.PROM_PAWN, shogi.PROM_LANCE, shogi.PROM_KNIGHT, shogi.PROM_SILVER
+])
+
+def get_ki2_move_str(board: AnyBoard, move: shogi.Move) -> str:
     """
     python-shogiのMoveオブジェクトをKI2形式の文字列に変換する。
     相対表記（上、引、寄、右、左、直、打）および「不成」をサポート。
     """
-    to_file = 9 - (move.to_square % 9)
-    to_rank = (move.to_square // 9) + 1
-    
-    ZEN_NUM = "　１２３４５６７８９"
-    KAN_NUM = "　一二三四五六七八九"
-    
     if board.move_stack and board.move_stack[-1].to_square == move.to_square:
         to_str = "同　"
     else:
+        to_file = 9 - (move.to_square % 9)
+        to_rank = (move.to_square // 9) + 1
         to_str = f"{ZEN_NUM[to_file]}{KAN_NUM[to_rank]}"
-    
+    return to_str + _piece_notation(board, move)
+
+def _piece_notation(board: AnyBoard, move: shogi.Move) -> str:
+    """
+    駒名・相対表記・成/不成の部分。同じ駒種で移動先に行ける駒と、成る手の有無を
+    移動先マスに利いている駒だけから一度に求める（全合法手は生成しない）。
+    """
     if move.drop_piece_type:
         piece_type = move.drop_piece_type
     else:
-        from_piece = board.piece_at(move.from_square)
-        piece_type = from_piece.piece_type
-    
-    PIECE_MAP = {
-        shogi.PAWN: '歩', shogi.LANCE: '香', shogi.KNIGHT: '桂', shogi.SILVER: '銀',
-        shogi.GOLD: '金', shogi.BISHOP: '角', shogi.ROOK: '飛', shogi.KING: '玉',
-        shogi.PROM_PAWN: 'と', shogi.PROM_LANCE: '成香', shogi.PROM_KNIGHT: '成桂',
-        shogi.PROM_SILVER: '成銀', shogi.PROM_BISHOP: '馬', shogi.PROM_ROOK: '龍'
-    }
+        piece_type = board.piece_type_at(move.from_square)
     
     piece_str = PIECE_MAP.get(piece_type, '?')
     
-    # 相対表記の判定
-    relative_str = ""
-    
-    # 同じ種類の駒が同じ目的地に行けるか（移動のみ）
+    # 同じ種類の駒が同じ目的地に行けるか（移動のみ。成る手でしか行けない駒も含む）
     board_candidates = []
-    for m in board.legal_moves:
-        if m.to_square == move.to_square and not m.drop_piece_type:
-            p = board.piece_at(m.from_square)
-            if p.piece_type == piece_type:
-                if m.from_square not in board_candidates:
-                    board_candidates.append(m.from_square)
+    for from_sq in candidate_origins(board, board.turn, piece_type, move.to_square):
+        if board.is_legal(shogi.Move(from_sq, move.to_square)) or board.is_legal(shogi.Move(from_sq, move.to_square, True)):
+            board_candidates.append(from_sq)
 
+    # 相対表記の判定
+    relative_str = ""
     if move.drop_piece_type:
         if board_candidates:
             relative_str = "打"
-    else:
-        if len(board_candidates) > 1:
-            is_black = board.turn == shogi.BLACK
-            from_sq = move.from_square
-            
-            def get_f(sq): return 9 - (sq % 9)
-            def get_r(sq): return (sq // 9) + 1
-            
-            from_f, from_r = get_f(from_sq), get_r(from_sq)
-            to_f, to_r = get_f(move.to_square), get_r(move.to_square)
-            
-            v_pos = ""
-            if from_r > to_r: v_pos = "上" if is_black else "引"
-            elif from_r < to_r: v_pos = "引" if is_black else "上"
-            else: v_pos = "寄"
-            
-            h_pos = ""
-            if from_f == to_f: h_pos = "直"
-            elif from_f > to_f: h_pos = "左" if is_black else "右"
-            else: h_pos = "右" if is_black else "左"
-            
-            if piece_type in [shogi.PAWN, shogi.LANCE, shogi.KNIGHT, shogi.SILVER, shogi.GOLD, shogi.PROM_PAWN, shogi.PROM_LANCE, shogi.PROM_KNIGHT, shogi.PROM_SILVER]:
-                if h_pos == "直":
-                    relative_str = v_pos + h_pos
-                else:
-                    relative_str = h_pos + v_pos
+    elif len(board_candidates) > 1:
+        is_black = board.turn == shogi.BLACK
+        from_sq = move.from_square
+        
+        def get_f(sq): return 9 - (sq % 9)
+        def get_r(sq): return (sq // 9) + 1
+        
+        from_f, from_r = get_f(from_sq), get_r(from_sq)
+        to_f, to_r = get_f(move.to_square), get_r(move.to_square)
+        
+        v_pos = ""
+        if from_r > to_r: v_pos = "上" if is_black else "引"
+        elif from_r < to_r: v_pos = "引" if is_black else "上"
+        else: v_pos = "寄"
+        
+        h_pos = ""
+        if from_f == to_f: h_pos = "直"
+        elif from_f > to_f: h_pos = "左" if is_black else "右"
+        else: h_pos = "右" if is_black else "左"
+        
+        if piece_type in LATERAL_FIRST_PIECE_TYPES:
+            if h_pos == "直":
+                relative_str = v_pos + h_pos
             else:
-                relative_str = v_pos
-                # 垂直方向で区別できなければ水平方向も追加
-                v_others = [sq for sq in board_candidates if sq != from_sq]
-                can_distinguish_v = all( ((get_r(sq) > to_r) != (from_r > to_r)) or ((get_r(sq) < to_r) != (from_r < to_r)) or ((get_r(sq) == to_r) != (from_r == to_r)) for sq in v_others)
-                if not can_distinguish_v:
-                    relative_str = h_pos + v_pos
+                relative_str = h_pos + v_pos
+        else:
+            relative_str = v_pos
+            # 垂直方向で区別できなければ水平方向も追加
+            v_others = [sq for sq in board_candidates if sq != from_sq]
+            can_distinguish_v = all( ((get_r(sq) > to_r) != (from_r > to_r)) or ((get_r(sq) < to_r) != (from_r < to_r)) or ((get_r(sq) == to_r) != (from_r == to_r)) for sq in v_others)
+            if not can_distinguish_v:
+                relative_str = h_pos + v_pos
 
     # 成・不成
     if move.promotion:
         piece_str += "成"
-    else:
-        can_promote = False
-        for m in board.legal_moves:
-            if m.from_square == move.from_square and m.to_square == move.to_square and m.promotion:
-                can_promote = True
-                break
-        if can_promote:
-            piece_str += "不成"
+    elif not move.drop_piece_type and board.is_legal(shogi.Move(move.from_square, move.to_square, True)):
+        piece_str += "不成"
             
-    return f"{to_str}{piece_str}{relative_str}"
+    return f"{piece_str}{relative_str}"
+
+class TreeNode:
+    """
+    展開済みツリーの1手。move は encode_move の整数、branches は続きの手のタプル（末端は空のタプル）。
+    ki2_str と comments は同じ辺（局面と指し手）のノードどうしで同じオブジェクトを共有する。
+    """
+    __slots__ = ('move', 'branches', 'ki2_str', 'comments')
+
+    def __init__(self, move: int, branches: Tuple['TreeNode', ...], ki2_str: str, comments: Tuple[str, ...]):
+        self.move = move
+        self.branches = branches
+        self.ki2_str = ki2_str
+        self.comments = comments
+
+    @property
+    def usi(self) -> str:
+        return move_usi(self.move)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TreeNode):
+            return NotImplemented
+        return (self.move, self.ki2_str, self.comments, self.branches) == \
+            (other.move, other.ki2_str, other.comments, other.branches)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"TreeNode({self.usi!r}, {self.ki2_str!r}, {len(self.branches)} branches)"
+
+# 展開済みツリー（最初の手の候補を並べたもの）
+Tree = Tuple[TreeNode, ...]
 
 def expand_tree(
-    board: shogi.Board, 
-    move_map: Dict[str, Dict[str, List[str]]], 
-    path_history: Set[str] = None
-) -> List[Dict]:
+    board: AnyBoard, 
+    move_map: Union[PositionGraph, CorpusIndex, Dict[int, Dict[str, List[str]]]], 
+    path_history: Set[int] = None,
+    keys: Optional[PositionKeys] = None,
+    memoize: bool = False,
+    pruner: Optional[Pruner] = None
+) -> Tree:
+    """
+    局面グラフを元に、再帰的に全分岐を展開したツリー構造（TreeNode のタプル）を生成する。
+    従来形式の move_map（局面キー -> { USI -> コメント }）も受け付ける。
+    CorpusIndex を渡すと、board の局面から到達できる部分だけをデータベースから読み出して展開する
+    （続きを読み出す局面の数は CorpusIndex.subgraph の既定の上限まで）。
+    keys にはパース時と同じ PositionKeys を渡すと、衝突時の退避キーも一致する。
+    board には python-shogi の Board と logic.board.CompactBoard のどちらも渡せる。
+
+    memoize=True の場合、循環の上にない局面の部分木は（局面, 直前の移動先）ごとに
+    一度だけ構築し、すべての到達経路で同じタプルを共有する。直前の移動先は
+    「同」表記の判定に使われるため文脈に含める。共有された部分木は読み取り専用として扱うこと。
+
+    pruner があれば、その打ち切り条件を展開しながら適用する。打ち切りは経路に依存するため、
+    このとき memoize は無視する。
     """
-    局面ハッシュマップを元に、再帰的に全分岐を展開したツリー構造を生成する。
+    if isinstance(move_map, PositionGraph):
+        graph = move_map
+    elif isinstance(move_map, CorpusIndex):
+        graph = move_map.subgraph(board, keys)
+    else:
+        graph = PositionGraph.from_move_map(move_map, board, keys)
+
+    root = graph.position_id(keys.key(board) if keys is not None else get_board_key(board))
+    if root is None:
+        return ()
+
+    history = set()
+    for key in path_history or ():
+        pos = graph.position_id(key)
+        if pos is not None:
+            history.add(pos)
+    if pruner is not None:
+        pruner.start(graph)
+        return _expand_graph(board, graph, root, history, pruner=pruner)
+    if memoize:
+        return _expand_graph(board, graph, root, history, {}, graph.on_cycle())
+    return _expand_graph(board, graph, root, history)
+
+def _expand_graph(
+    board: AnyBoard,
+    graph: PositionGraph,
+    root: int,
+    path_history: Set[int],
+    memo: Optional[Dict[Tuple[int, Optional[int]], Tree]] = None,
+    on_cycle: Optional[bytearray] = None,
+    pruner: Optional[Pruner] = None
+) -> Tree:
     """
-    if path_history is None:
-        path_history = set()
+    明示的なスタックで展開する。深い手順でも再帰上限に達しない。
+    スタックの各要素は [局面ID, 次の辺, 辺の終端, 構築中の子のリスト, メモのキー, 手数, 複製に入った局面の手数,
+    子を持たせるノード（根なら None）]。子のリストは局面を出るときにタプルにしてノードに持たせる。
+    """
+    offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    history = set(path_history)
+    # 表記は辺と「同」かどうかだけで決まるので、同じ文字列を使い回す
+    notations: Dict[Tuple[int, bool], str] = {}
+    stack: List[list] = []
+    max_nodes = pruner.max_nodes if pruner is not None else None
+    nodes = 0
+    root_tree: Tree = ()
 
-    from extract_moves import get_board_key
-    sfen_key = get_board_key(board)
+    def enter(pos: int, depth: int, copy_ply: Optional[int], owner: Optional[TreeNode]) -> bool:
+        """pos の続きを展開するなら積んで True を返す。展開済み（メモ）なら owner に持たせて False。"""
+        if pos in history:
+            return False
+        begin, end = offsets[pos], offsets[pos + 1]
+        if begin == end:
+            return False
+        if pruner is not None:
+            allowed = pruner.enter(pos, begin, end, depth, copy_ply)
+            if allowed is None:
+                return False
+            end, copy_ply = allowed
+        memo_key = None
+        if memo is not None and not on_cycle[pos]:
+            memo_key = (pos, board.move_stack[-1].to_square if board.move_stack else None)
+            cached = memo.get(memo_key)
+            if cached is not None:
+                owner.branches = cached
+                return False
+        history.add(pos)
+        stack.append([pos, begin, end, [], memo_key, depth, copy_ply, owner])
+        return True
 
-    if sfen_key in path_history:
-        return []
+    def close(frame: list) -> Tree:
+        nonlocal root_tree
+        branches = tuple(frame[3])
+        if frame[7] is not None:
+            frame[7].branches = branches
+        else:
+            root_tree = branches
+        return branches
 
-    next_moves_info = move_map.get(sfen_key, {})
-    if not next_moves_info:
-        return []
+    if not enter(root, 1, None, None):
+        return root_tree
 
-    new_path_history = path_history | {sfen_key}
-    tree = []
+    while stack:
+        frame = stack[-1]
+        edge = frame[1]
+        if edge < frame[2]:
+            if nodes == max_nodes:
+                pruner.node_limit_reached = True
+                # 展開済みの部分を返す。盤面は根の局面まで戻す
+                for _ in range(len(stack) - 1):
+                    board.pop()
+                while stack:
+                    close(stack.pop())
+                break
+            nodes += 1
+            # 辺は USI 順に格納済みなので出力は決定論的
+            frame[1] = edge + 1
+            code = edge_moves[edge]
+            move = decode_move(code)
+            notation_key = (edge, bool(board.move_stack) and board.move_stack[-1].to_square == move.to_square)
+            ki2_val = notations.get(notation_key)
+            if ki2_val is None:
+                ki2_val = get_ki2_move_str(board, move)
+                notations[notation_key] = ki2_val
+            node = TreeNode(code, (), ki2_val, graph.edge_comments(edge))
+            frame[3].append(node)
+            board.push(move)
+            if not enter(targets[edge], frame[5] + 1, frame[6], node):
+                board.pop()
+            continue
 
-    # 決定論的な出力のためソート
-    for move_usi in sorted(next_moves_info.keys()):
-        move = shogi.Move.from_usi(move_usi)
-        ki2_val = get_ki2_move_str(board, move)
-        comments = next_moves_info[move_usi]
-        
-        board.push(move)
-        branches = expand_tree(board, move_map, new_path_history)
-        board.pop()
-        
-        tree.append({
-            'move': move,
-            'branches': branches,
-            'ki2_str': ki2_val,
-            'comments': comments
-        })
-        
-    return tree
+        stack.pop()
+        history.discard(frame[0])
+        branches = close(frame)
+        if frame[4] is not None:
+            memo[frame[4]] = branches
+        if stack:
+            board.pop()
+
+    return root_tree
+
+def count_tree_nodes(tree: Tree) -> int:
+    """
+    展開済みツリーのノード数を数える。
+    共有された部分木（memoize=True）はタプルごとに一度だけ数えて再利用する。
+    """
+    counted: Dict[int, int] = {}
+    stack = [(tree, False)]
+    while stack:
+        current, children_done = stack.pop()
+        if id(current) in counted:
+            continue
+        if children_done:
+            counted[id(current)] = sum(1 + counted[id(node.branches)] for node in current)
+            continue
+        stack.append((current, True))
+        for node in current:
+            if id(node.branches) not in counted:
+                stack.append((node.branches, False))
+    return counted[id(tree)]
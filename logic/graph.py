@@ -0,0 +1,233 @@
+import shogi
+import functools
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from logic.position import get_board_key, PositionKeys
+
+# 指し手の16ビット表現: bit0-6 移動元（打つ手は 81 + 駒種 - 1）、bit7-13 移動先、bit14 成り
+DROP_FROM_BASE = 81
+PROMOTION_BIT = 1 << 14
+
+def encode_move(move: shogi.Move) -> int:
+    """shogi.Move を16ビット整数に詰める。"""
+    if move.drop_piece_type:
+        from_idx = DROP_FROM_BASE + move.drop_piece_type - 1
+    else:
+        from_idx = move.from_square
+    code = from_idx | (move.to_square << 7)
+    if move.promotion:
+        code |= PROMOTION_BIT
+    return code
+
+@functools.lru_cache(maxsize=None)
+def decode_move(code: int) -> shogi.Move:
+    """encode_move の逆変換。取りうる値は 2^15 通りしかないためキャッシュする。"""
+    from_idx = code & 0x7F
+    to_square = (code >> 7) & 0x7F
+    if from_idx >= DROP_FROM_BASE:
+        return shogi.Move(None, to_square, drop_piece_type=from_idx - DROP_FROM_BASE + 1)
+    return shogi.Move(from_idx, to_square, bool(code & PROMOTION_BIT))
+
+@functools.lru_cache(maxsize=None)
+def move_usi(code: int) -> str:
+    return decode_move(code).usi()
+
+class PositionGraph:
+    """
+    局面グラフ。局面は連番の整数IDに置き換え、辺は CSR 形式の配列に格納する。
+    ある局面 pos から出る辺は edge_offsets[pos]..edge_offsets[pos+1] の範囲で、
+    USI 文字列順（従来の出力順）に並んでいる。コメントは持つ辺の分だけ別表に置く。
+    """
+    def __init__(self, keys: array, edge_offsets: array, edge_moves: array, edge_targets: array, comments: Dict[int, Tuple[str, ...]]):
+        self.keys = keys
+        self.edge_offsets = edge_offsets
+        self.edge_moves = edge_moves
+        self.edge_targets = edge_targets
+        self.comments = comments
+        self._ids: Optional[Dict[int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edge_moves)
+
+    def position_id(self, key: int) -> Optional[int]:
+        if self._ids is None:
+            self._ids = {k: pos for pos, k in enumerate(self.keys)}
+        return self._ids.get(key)
+
+    def edges(self, pos: int) -> range:
+        return range(self.edge_offsets[pos], self.edge_offsets[pos + 1])
+
+    def edge_comments(self, edge: int) -> Tuple[str, ...]:
+        return self.comments.get(edge, ())
+
+    def in_degrees(self, root: int) -> List[int]:
+        """root から到達できる辺だけを数えた、局面ごとの入次数（2 以上なら合流局面）。"""
+        offsets, targets = self.edge_offsets, self.edge_targets
+        degrees = [0] * len(self.keys)
+        seen = bytearray(len(self.keys))
+        seen[root] = 1
+        stack = [root]
+        while stack:
+            pos = stack.pop()
+            for edge in range(offsets[pos], offsets[pos + 1]):
+                target = targets[edge]
+                degrees[target] += 1
+                if not seen[target]:
+                    seen[target] = 1
+                    stack.append(target)
+        return degrees
+
+    def strong_components(self) -> Tuple[List[int], bytearray]:
+        """
+        強連結成分分解（Tarjan、明示的なスタックで行う）。局面ごとの成分番号と、成分ごとに
+        循環を含む（2局面以上か、自分自身への手がある）なら 1 を立てた配列を返す。
+        成分番号は確定順（出口側から）なので、成分をまたぐ辺は必ず番号の大きい成分から小さい成分へ向かう。
+        """
+        n = len(self.keys)
+        offsets, targets = self.edge_offsets, self.edge_targets
+        component = [-1] * n
+        cyclic = bytearray()
+        index = [-1] * n
+        low = [0] * n
+        on_stack = bytearray(n)
+        scc_stack: List[int] = []
+        counter = 0
+
+        for start in range(n):
+            if index[start] != -1:
+                continue
+            work = [(start, offsets[start])]
+            index[start] = low[start] = counter; counter += 1
+            scc_stack.append(start); on_stack[start] = 1
+            while work:
+                pos, edge = work[-1]
+                if edge < offsets[pos + 1]:
+                    work[-1] = (pos, edge + 1)
+                    child = targets[edge]
+                    if index[child] == -1:
+                        index[child] = low[child] = counter; counter += 1
+                        scc_stack.append(child); on_stack[child] = 1
+                        work.append((child, offsets[child]))
+                    elif on_stack[child]:
+                        low[pos] = min(low[pos], index[child])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[pos])
+                if low[pos] != index[pos]:
+                    continue
+                # 強連結成分を確定する
+                number = len(cyclic)
+                size = 0
+                while True:
+                    member = scc_stack.pop()
+                    on_stack[member] = 0
+                    component[member] = number
+                    size += 1
+                    if member == pos:
+                        break
+                cyclic.append(size > 1 or any(targets[e] == pos for e in range(offsets[pos], offsets[pos + 1])))
+        return component, cyclic
+
+    def on_cycle(self) -> bytearray:
+        """
+        各局面が循環（同一経路での同一局面）の上にあるかを返す。循環の上にない局面の展開結果は
+        経路履歴に依存しないため、使い回せる（経路上の局面に戻れるなら、その局面と同じ強連結成分に属する）。
+        """
+        component, cyclic = self.strong_components()
+        return bytearray(cyclic[c] for c in component)
+
+    @classmethod
+    def from_move_map(cls, move_map: Dict[int, Dict[str, List[str]]], board: shogi.Board, keys: Optional[PositionKeys] = None) -> 'PositionGraph':
+        """
+        従来形式の move_map（局面キー -> { USI -> コメント }）から局面グラフを作る。
+        移動先の局面を求めるため board の局面から辿り、到達できない局面は含めない。
+        """
+        key_of = keys.key if keys is not None else get_board_key
+        builder = PositionGraphBuilder()
+        root_key = key_of(board)
+        builder.intern(root_key)
+        visited = {root_key}
+        # (局面キー, 未処理の指し手) のスタックで辿る。盤面はスタックの深さに合わせて push/pop する
+        stack = [(root_key, iter(move_map.get(root_key, {}).items()))]
+        while stack:
+            key, pending = stack[-1]
+            item = next(pending, None)
+            if item is None:
+                stack.pop()
+                if stack:
+                    board.pop()
+                continue
+            usi, comments = item
+            move = shogi.Move.from_usi(usi)
+            board.push(move)
+            child_key = key_of(board)
+            edge = builder.add_edge(builder.intern(key), encode_move(move), builder.intern(child_key))
+            for comment in comments:
+                builder.add_comment(edge, comment)
+            if child_key not in visited:
+                visited.add(child_key)
+                stack.append((child_key, iter(move_map.get(child_key, {}).items())))
+            else:
+                board.pop()
+        return builder.build()
+
+class PositionGraphBuilder:
+    """
+    パース中に局面と辺を受け取り、最後に PositionGraph へ固める。
+    """
+    def __init__(self):
+        self._keys = array('Q')
+        self._ids: Dict[int, int] = {}
+        self._src = array('I')
+        self._moves = array('H')
+        self._dst = array('I')
+        self._edge_index: Dict[int, int] = {}
+        self._comments: Dict[int, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def intern(self, key: int) -> int:
+        pos = self._ids.get(key)
+        if pos is None:
+            pos = len(self._keys)
+            self._ids[key] = pos
+            self._keys.append(key)
+        return pos
+
+    def add_edge(self, src: int, move_code: int, dst: int) -> int:
+        """辺を追加し、辺番号を返す。既存の辺であればその番号を返す。"""
+        edge_key = (src << 16) | move_code
+        edge = self._edge_index.get(edge_key)
+        if edge is None:
+            edge = len(self._moves)
+            self._edge_index[edge_key] = edge
+            self._src.append(src)
+            self._moves.append(move_code)
+            self._dst.append(dst)
+        return edge
+
+    def add_comment(self, edge: int, comment: str):
+        comments = self._comments.setdefault(edge, [])
+        if comment not in comments:
+            comments.append(comment)
+
+    def build(self) -> PositionGraph:
+        order = sorted(range(len(self._moves)), key=lambda e: (self._src[e], move_usi(self._moves[e])))
+        offsets = array('I', bytes(4 * (len(self._keys) + 1)))
+        for e in order:
+            offsets[self._src[e] + 1] += 1
+        for pos in range(len(self._keys)):
+            offsets[pos + 1] += offsets[pos]
+        moves = array('H', (self._moves[e] for e in order))
+        targets = array('I', (self._dst[e] for e in order))
+        new_index = {old: new for new, old in enumerate(order)}
+        comments = {new_index[e]: tuple(c) for e, c in self._comments.items() if c}
+        return PositionGraph(array('Q', self._keys), offsets, moves, targets, comments)
@@ -0,0 +1,139 @@
+import json
+from typing import Dict, Optional, TextIO
+
+from logic.board import AnyBoard
+from logic.expander import get_ki2_move_str
+from logic.graph import PositionGraph, decode_move, move_usi
+from logic.position import get_board_key, PositionKeys
+from logic.writer import Ki2Emitter
+
+# 合流局面の注釈（sample_code/kifu_sorter.py の #label / #merge と同じ考え方）。KI2 のコメント行として書く
+LABEL_MARK = "#label"
+MERGE_MARK = "#merge"
+JSON_FORMAT = "ki2-position-graph"
+JSON_VERSION = 1
+
+def _root_id(board: AnyBoard, graph: PositionGraph, keys: Optional[PositionKeys]) -> Optional[int]:
+    return graph.position_id(keys.key(board) if keys is not None else get_board_key(board))
+
+def write_graph_ki2(
+    stream: TextIO,
+    board: AnyBoard,
+    graph: PositionGraph,
+    keys: Optional[PositionKeys] = None
+) -> int:
+    """
+    局面グラフを複製せずに KI2 として書き出す。各局面の続きは最初に到達した経路の下に一度だけ書き、
+    複数の経路から到達する局面には最初の到達手の後に「*#label 番号」、それ以外の到達手の後に
+    「*#merge 番号」のコメント行を付けてその先を省く。出力は局面数と指し手数に比例する。
+    「同」の表記は書き出した経路の直前の手に従う。書き出した指し手の数を返す。
+    """
+    root = _root_id(board, graph, keys)
+    if root is None:
+        return 0
+    emitter = Ki2Emitter(stream)
+    offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    degrees = graph.in_degrees(root)
+    labels: Dict[int, int] = {}
+
+    def label(pos: int) -> Optional[str]:
+        """pos が合流局面なら注釈を返す（初めてなら番号を振る）。"""
+        if degrees[pos] < (1 if pos == root else 2):
+            return None
+        if pos in labels:
+            return f"{MERGE_MARK} {labels[pos]:03d}"
+        labels[pos] = len(labels) + 1
+        return f"{LABEL_MARK} {labels[pos]:03d}"
+
+    root_label = label(root)
+    if root_label is not None:
+        emitter.comment(root_label)
+    # スタックの各要素は [局面ID, 次の辺, 辺の終端, 手数]
+    stack = [[root, offsets[root], offsets[root + 1], 1]]
+    written = 0
+    while stack:
+        frame = stack[-1]
+        edge = frame[1]
+        if edge < frame[2]:
+            depth = frame[3]
+            if edge > offsets[frame[0]]:
+                emitter.variation(depth)
+            frame[1] = edge + 1
+            move = decode_move(edge_moves[edge])
+            emitter.move(depth, get_ki2_move_str(board, move))
+            for comment in graph.edge_comments(edge):
+                emitter.comment(comment)
+            written += 1
+
+            target = targets[edge]
+            annotation = label(target)
+            if annotation is not None:
+                emitter.comment(annotation)
+            if annotation is not None and annotation.startswith(MERGE_MARK):
+                continue
+            if offsets[target] < offsets[target + 1]:
+                board.push(move)
+                stack.append([target, offsets[target], offsets[target + 1], depth + 1])
+            continue
+
+        stack.pop()
+        if stack:
+            board.pop()
+    return written
+
+def write_graph_json(
+    stream: TextIO,
+    board: AnyBoard,
+    graph: PositionGraph,
+    keys: Optional[PositionKeys] = None,
+    header: str = ""
+) -> int:
+    """
+    局面グラフを JSON として書き出す。root から到達できる局面を1つずつ、SFEN と指し手
+    （USI、KI2 表記、行き先の局面ID、コメント）とともに書く。局面IDは局面グラフの ID で、
+    KI2 表記の「同」は最初に到達した経路の直前の手に従う。書き出した指し手の数を返す。
+    """
+    root = _root_id(board, graph, keys)
+    stream.write('{"format": %s, "version": %d, "header": %s, "root": %s, "positions": [' % (
+        json.dumps(JSON_FORMAT), JSON_VERSION, json.dumps(header, ensure_ascii=False),
+        json.dumps(root)))
+    if root is None:
+        stream.write(']}\n')
+        return 0
+    offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    degrees = graph.in_degrees(root)
+    seen = bytearray(len(graph))
+    seen[root] = 1
+    written = 0
+    first = True
+    # 各局面を最初に到達した経路で訪れ、その時点の盤面から SFEN と表記を作る
+    stack = [[root, offsets[root]]]
+    while stack:
+        frame = stack[-1]
+        pos, edge = frame
+        if edge == offsets[pos]:
+            moves = []
+            for e in range(offsets[pos], offsets[pos + 1]):
+                entry = {"usi": move_usi(edge_moves[e]), "ki2": get_ki2_move_str(board, decode_move(edge_moves[e])),
+                         "to": targets[e]}
+                comments = graph.edge_comments(e)
+                if comments:
+                    entry["comments"] = list(comments)
+                moves.append(entry)
+            written += len(moves)
+            position = {"id": pos, "sfen": board.sfen(), "confluence": degrees[pos] > 1, "moves": moves}
+            stream.write(("\n" if first else ",\n") + json.dumps(position, ensure_ascii=False))
+            first = False
+        if edge < offsets[pos + 1]:
+            frame[1] = edge + 1
+            target = targets[edge]
+            if not seen[target]:
+                seen[target] = 1
+                board.push(decode_move(edge_moves[edge]))
+                stack.append([target, offsets[target]])
+            continue
+        stack.pop()
+        if stack:
+            board.pop()
+    stream.write('\n]}\n')
+    return written
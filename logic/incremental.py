@@ -0,0 +1,280 @@
+import bisect
+import hashlib
+import os
+import struct
+from array import array
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, TextIO, Tuple
+
+import shogi
+
+from logic.board import AnyBoard
+from logic.cache import _read_array, _write_array
+from logic.expander import get_ki2_move_str
+from logic.graph import PositionGraph, decode_move
+from logic.position import get_board_key, PositionKeys
+from logic.writer import Ki2Emitter
+
+# 展開結果の索引は出力ファイルの隣に置く
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'KI2X'
+# 表記の生成や出力の整形を変えたら上げる（古い出力の断片を使わなくなる）
+INDEX_VERSION = 1
+_COPY_CHUNK = 1 << 20
+
+class Segment(NamedTuple):
+    """出力ファイル中の、ある局面以下を展開した部分（最初の指し手から最後の断片まで）のバイト範囲。"""
+    start: int
+    end: int
+    # 末尾の連続する改行の数
+    newlines: int
+    nodes: int
+
+# (局面キー, 直前の手の移動先（なければ -1）, その局面からの手の手数)
+SegmentKey = Tuple[int, int, int]
+
+class ExpansionIndex(NamedTuple):
+    encoding: str
+    # 索引を作ったときの出力ファイルのサイズ（出力が書き換えられていないかの確認用）
+    output_size: int
+    # 局面キー -> その局面から出る手の内容（指し手・行き先・コメント）のハッシュ
+    signatures: Dict[int, int]
+    segments: Dict[SegmentKey, Segment]
+
+class IncrementalStats(NamedTuple):
+    # 前回から出る手の内容が変わった（または新しい）局面の数
+    changed_positions: int
+    reused_segments: int
+    reused_nodes: int
+
+def index_path(output_file: str) -> str:
+    return output_file + INDEX_SUFFIX
+
+def open_previous(output_file: str) -> Tuple[Optional[ExpansionIndex], Optional[BinaryIO]]:
+    """
+    前回の索引と、索引を作ったときのままの前回の出力（バイナリ）を開く。
+    どちらかがない、または出力が書き換えられている場合は (None, None)。
+    """
+    index = load_index(index_path(output_file))
+    if index is None:
+        return None, None
+    try:
+        f = open(output_file, 'rb')
+    except OSError:
+        return None, None
+    if os.fstat(f.fileno()).st_size != index.output_size:
+        f.close()
+        return None, None
+    return index, f
+
+def position_signatures(graph: PositionGraph) -> List[int]:
+    """局面ごとに、出る手の指し手・行き先の局面キー・コメントから作った 64 ビットのハッシュ。"""
+    keys, offsets, edge_moves, targets = graph.keys, graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    signatures = []
+    for pos in range(len(keys)):
+        h = hashlib.blake2b(digest_size=8)
+        for edge in range(offsets[pos], offsets[pos + 1]):
+            h.update(struct.pack('<HQ', edge_moves[edge], keys[targets[edge]]))
+            for comment in graph.edge_comments(edge):
+                h.update(comment.encode('utf-8') + b'\0')
+            h.update(b'\1')
+        signatures.append(int.from_bytes(h.digest(), 'little'))
+    return signatures
+
+def clean_positions(graph: PositionGraph, signatures: List[int], previous: Dict[int, int]) -> Tuple[bytearray, int]:
+    """
+    前回から到達できる範囲が変わっていない局面（到達できるどの局面も出る手が同じ）に 1 を立てた配列と、
+    出る手が変わった局面の数を返す。変わった局面から辺を逆に辿った局面はすべて変わったとみなす。
+    """
+    n = len(graph)
+    keys, offsets, targets = graph.keys, graph.edge_offsets, graph.edge_targets
+    clean = bytearray(b'\1') * n
+    stack = [pos for pos in range(n) if previous.get(keys[pos]) != signatures[pos]]
+    changed = len(stack)
+    for pos in stack:
+        clean[pos] = 0
+    if not stack:
+        return clean, 0
+    predecessors: List[List[int]] = [[] for _ in range(n)]
+    for pos in range(n):
+        for edge in range(offsets[pos], offsets[pos + 1]):
+            predecessors[targets[edge]].append(pos)
+    while stack:
+        pos = stack.pop()
+        for parent in predecessors[pos]:
+            if clean[parent]:
+                clean[parent] = 0
+                stack.append(parent)
+    return clean, changed
+
+def save_index(path: str, index: ExpansionIndex):
+    """索引を一時ファイルに書いてから置き換える。"""
+    tmp_path = path + '.tmp'
+    segment_keys = list(index.segments)
+    with open(tmp_path, 'wb') as f:
+        encoding = index.encoding.encode('ascii')
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack('<IQB', INDEX_VERSION, index.output_size, len(encoding)))
+        f.write(encoding)
+        _write_array(f, array('Q', index.signatures))
+        _write_array(f, array('Q', index.signatures.values()))
+        _write_array(f, array('Q', (k[0] for k in segment_keys)))
+        _write_array(f, array('b', (k[1] for k in segment_keys)))
+        _write_array(f, array('I', (k[2] for k in segment_keys)))
+        segments = [index.segments[k] for k in segment_keys]
+        for field, typecode in (('start', 'Q'), ('end', 'Q'), ('newlines', 'B'), ('nodes', 'Q')):
+            _write_array(f, array(typecode, (getattr(s, field) for s in segments)))
+    os.replace(tmp_path, path)
+
+def load_index(path: str) -> Optional[ExpansionIndex]:
+    """索引を読む。ない・壊れている・版が違う場合は None。"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(4) != INDEX_MAGIC:
+                return None
+            version, output_size, length = struct.unpack('<IQB', f.read(13))
+            if version != INDEX_VERSION:
+                return None
+            encoding = f.read(length).decode('ascii')
+            signature_keys, signature_values = _read_array(f), _read_array(f)
+            segment_keys = zip(*(_read_array(f) for _ in range(3)))
+            segments = zip(*(_read_array(f) for _ in range(4)))
+            return ExpansionIndex(encoding, output_size, dict(zip(signature_keys, signature_values)),
+                                  {key: Segment(*segment) for key, segment in zip(segment_keys, segments)})
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        return None
+
+def supports_splicing(encoding: str) -> bool:
+    """出力の断片をバイト単位で切り貼りできるエンコーディングか（空白が1バイトで BOM 以外に状態を持たない）。"""
+    return " ".encode(encoding) == b" " and not encoding.replace('_', '-').lower().startswith(('utf-16', 'utf-32'))
+
+def _copy(source: BinaryIO, target: BinaryIO, start: int, end: int):
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(remaining, _COPY_CHUNK))
+        if not chunk:
+            raise ValueError("previous output is shorter than its index")
+        target.write(chunk)
+        remaining -= len(chunk)
+
+def write_incremental_ki2(
+    f: TextIO,
+    board: AnyBoard,
+    graph: PositionGraph,
+    keys: Optional[PositionKeys],
+    previous: Optional[ExpansionIndex] = None,
+    previous_output: Optional[BinaryIO] = None,
+    stream: Optional[TextIO] = None
+) -> Tuple[int, ExpansionIndex, IncrementalStats]:
+    """
+    write_expanded_ki2 と同じ出力を書きながら、局面ごとの展開部分の位置を索引に記録する。
+    previous（前回の索引）と previous_output（前回の出力、バイナリで開いたもの）があれば、
+    前回から到達範囲の変わっていない局面以下は展開せず、前回の出力からバイト列を写す。
+    循環の上にある局面の出力は経路（同じ局面に戻ったところでの打ち切り）によって変わるため写さない。
+    f は出力ファイル（tell と buffer を使う）、stream は指し手を書くストリーム（省略時は f）。
+    (書き出したノード数, 新しい索引, 再利用の統計) を返す。索引の output_size は呼び出し側で埋める。
+    """
+    stream = stream if stream is not None else f
+    signatures = position_signatures(graph)
+    index = ExpansionIndex(f.encoding, 0, dict(zip(graph.keys, signatures)), {})
+    root = graph.position_id(keys.key(board) if keys is not None else get_board_key(board))
+    if root is None:
+        return 0, index, IncrementalStats(0, 0, 0)
+
+    reuse: Dict[SegmentKey, Segment] = {}
+    changed = len(graph)
+    clean = bytearray(len(graph))
+    if previous is not None and previous_output is not None and previous.encoding == f.encoding:
+        clean, changed = clean_positions(graph, signatures, previous.signatures)
+        reuse = previous.segments
+    # 写した範囲の内側にある断片も次回のために索引へ引き継ぐ（開始位置の順に並べて範囲で探す）
+    by_start = sorted((segment.start, key) for key, segment in reuse.items())
+    starts = [start for start, _ in by_start]
+    space = 1 if supports_splicing(f.encoding) else None
+    on_cycle = graph.on_cycle()
+
+    emitter = Ki2Emitter(stream)
+    offsets, edge_moves, targets, position_keys = graph.edge_offsets, graph.edge_moves, graph.edge_targets, graph.keys
+    notations: Dict[Tuple[int, bool], str] = {}
+    path_history = set()
+    path: List[shogi.Move] = []
+    synced = 0
+    root_last_to = board.move_stack[-1].to_square if board.move_stack else None
+    # スタックの各要素は [局面ID, 次の辺, 辺の終端, 手数, 記録中の (索引のキー, 開始位置, 開始時のノード数)]
+    stack: List[list] = []
+    written = reused_segments = reused_nodes = 0
+
+    def enter(pos: int, depth: int, last_to: Optional[int]) -> bool:
+        nonlocal written, reused_segments, reused_nodes
+        if pos in path_history or offsets[pos] == offsets[pos + 1]:
+            return False
+        record = None
+        if space is not None and not on_cycle[pos]:
+            key = (position_keys[pos], -1 if last_to is None else last_to, depth)
+            segment = reuse.get(key) if clean[pos] else None
+            if segment is not None:
+                if emitter.needs_space:
+                    stream.write(" ")
+                start = f.tell()
+                f.flush()
+                _copy(previous_output, f.buffer, segment.start, segment.end)
+                emitter.resume(segment.newlines)
+                written += segment.nodes
+                reused_segments += 1
+                reused_nodes += segment.nodes
+                shift = start - segment.start
+                for i in range(bisect.bisect_left(starts, segment.start), bisect.bisect_left(starts, segment.end)):
+                    inner_key = by_start[i][1]
+                    inner = reuse[inner_key]
+                    if inner.end <= segment.end and inner_key not in index.segments:
+                        index.segments[inner_key] = inner._replace(start=inner.start + shift, end=inner.end + shift)
+                return False
+            if key not in index.segments:
+                record = (key, f.tell() + (space if emitter.needs_space else 0), written)
+        path_history.add(pos)
+        stack.append([pos, offsets[pos], offsets[pos + 1], depth, record])
+        return True
+
+    enter(root, 1, root_last_to)
+    while stack:
+        frame = stack[-1]
+        edge = frame[1]
+        if edge < frame[2]:
+            depth = frame[3]
+            if edge > offsets[frame[0]]:
+                emitter.variation(depth)
+            frame[1] = edge + 1
+            move = decode_move(edge_moves[edge])
+            last_to = path[-1].to_square if path else root_last_to
+            notation_key = (edge, move.to_square == last_to)
+            ki2_str = notations.get(notation_key)
+            if ki2_str is None:
+                while synced < len(path):
+                    board.push(path[synced])
+                    synced += 1
+                ki2_str = get_ki2_move_str(board, move)
+                notations[notation_key] = ki2_str
+            emitter.move(depth, ki2_str)
+            for comment in graph.edge_comments(edge):
+                emitter.comment(comment)
+            written += 1
+
+            path.append(move)
+            if not enter(targets[edge], depth + 1, move.to_square):
+                path.pop()
+            continue
+
+        stack.pop()
+        path_history.discard(frame[0])
+        record = frame[4]
+        if record is not None:
+            key, start, nodes = record
+            index.segments[key] = Segment(start, f.tell(), emitter.newline_run, written - nodes)
+        if stack:
+            path.pop()
+            if synced > len(path):
+                board.pop()
+                synced -= 1
+    for _ in range(synced):
+        board.pop()
+    return written, index, IncrementalStats(changed, reused_segments, reused_nodes)
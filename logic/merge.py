@@ -0,0 +1,67 @@
+from typing import Dict, Iterable, Set, Tuple
+
+from logic.board import AnyBoard
+from logic.graph import PositionGraph, PositionGraphBuilder, decode_move
+from logic.position import PositionKeys
+
+def merge_graphs(graphs: Iterable[PositionGraph]) -> PositionGraph:
+    """
+    複数の局面グラフの和を取る。局面はキー、辺は (移動元, 指し手) で重複を除き、
+    コメントも辺ごとに重複を除いて最初に現れた順に並べる。
+    各グラフの局面IDを辞書で一度だけ付け替えるので、総局面数・総辺数に比例する時間で済む。
+    """
+    builder = PositionGraphBuilder()
+    for graph in graphs:
+        ids = [builder.intern(key) for key in graph.keys]
+        offsets, moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+        for pos in range(len(graph)):
+            src = ids[pos]
+            for edge in range(offsets[pos], offsets[pos + 1]):
+                merged = builder.add_edge(src, moves[edge], ids[targets[edge]])
+                for comment in graph.edge_comments(edge):
+                    builder.add_comment(merged, comment)
+    return builder.build()
+
+def merge_arrival_info(infos: Iterable[Dict[int, Dict[str, Tuple[str, ...]]]]) -> Dict[int, Dict[str, Tuple[str, ...]]]:
+    """局面ごとの到達情報を合わせる。同じ直前の手は最初のファイルの経路を残す。"""
+    merged: Dict[int, Dict[str, Tuple[str, ...]]] = {}
+    for info in infos:
+        for key, arrivals in info.items():
+            target = merged.setdefault(key, {})
+            for label, path in arrivals.items():
+                target.setdefault(label, path)
+    return merged
+
+def remember_missing_sfens(graph: PositionGraph, board: AnyBoard, keys: PositionKeys, wanted: Iterable[int]):
+    """
+    wanted の局面のうち SFEN が記録されていないもの（ファイルをまたいだ合流局面）を、
+    board の局面からグラフを辿って再現し、keys に記録する。
+    """
+    missing: Set[int] = {key for key in wanted if keys.sfen(key) is None}
+    root = graph.position_id(keys.key(board))
+    if not missing or root is None:
+        return
+    offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    visited = bytearray(len(graph))
+    visited[root] = 1
+    stack = [[root, offsets[root]]]
+    while stack and missing:
+        frame = stack[-1]
+        pos, edge = frame
+        if edge < offsets[pos + 1]:
+            frame[1] = edge + 1
+            child = targets[edge]
+            if not visited[child]:
+                visited[child] = 1
+                board.push(decode_move(edge_moves[edge]))
+                key = graph.keys[child]
+                if key in missing:
+                    keys.remember(key, board)
+                    missing.discard(key)
+                stack.append([child, offsets[child]])
+            continue
+        stack.pop()
+        if stack:
+            board.pop()
+    for _ in range(len(stack) - 1):
+        board.pop()
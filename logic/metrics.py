@@ -0,0 +1,226 @@
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, NamedTuple, Optional, TextIO
+
+from logic.board import ENGINES
+from logic.graph import decode_move
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 計測する処理の段階
+PHASES = ('read', 'parse', 'merge', 'confluence', 'estimate', 'expand', 'write')
+# 盤面の操作回数を数える実装は「元の実装名 + この接尾辞」で ENGINES に登録する
+COUNTING_SUFFIX = '+counting'
+
+# 計測用の盤面が操作のたびに加算する、プロセス全体の累計
+COUNTERS: collections.Counter = collections.Counter()
+
+def _counting_class(board_class: type) -> type:
+    """push/pop・SFEN 化・合法性の判定・合法手の生成の回数を COUNTERS に数える盤面クラス。"""
+    namespace = {'__slots__': ()} if hasattr(board_class, '__slots__') else {}
+
+    def push(self, move):
+        COUNTERS['board_push'] += 1
+        return board_class.push(self, move)
+
+    def pop(self):
+        COUNTERS['board_pop'] += 1
+        return board_class.pop(self)
+
+    def sfen(self):
+        COUNTERS['sfen'] += 1
+        return board_class.sfen(self)
+
+    def is_legal(self, move):
+        COUNTERS['legality_checks'] += 1
+        return board_class.is_legal(self, move)
+
+    namespace.update(push=push, pop=pop, sfen=sfen, is_legal=is_legal)
+    if hasattr(board_class, 'generate_legal_moves'):
+        def generate_legal_moves(self, *args, **kwargs):
+            COUNTERS['legal_move_generations'] += 1
+            return board_class.generate_legal_moves(self, *args, **kwargs)
+        namespace['generate_legal_moves'] = generate_legal_moves
+    return type(f"Counting{board_class.__name__}", (board_class,), namespace)
+
+def counting_engine(engine: str) -> str:
+    """
+    engine の盤面を操作回数を数える版に差し替えた実装名を返す（必要なら ENGINES に登録する）。
+    計測しないときは元の実装をそのまま使うので、通常の処理には数える手間がかからない。
+    """
+    if engine.endswith(COUNTING_SUFFIX):
+        return engine
+    name = engine + COUNTING_SUFFIX
+    if name not in ENGINES:
+        ENGINES[name] = _counting_class(ENGINES[engine])
+    return name
+
+def _max_rss_mb() -> Optional[float]:
+    """プロセスの最大常駐メモリ（MiB）。取得できない環境では None。"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KiB、macOS はバイト単位
+    return rss / (1 << 20) if os.uname().sysname == 'Darwin' else rss / 1024
+
+def _lru_caches() -> Dict[str, object]:
+    from extract_moves import tokenize_ki2_move
+    return {'tokenize_ki2_move': tokenize_ki2_move, 'decode_move': decode_move}
+
+class TimedStream:
+    """書き込みにかかった時間を数えるテキストストリームのラッパー。"""
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.seconds = 0.0
+
+    def write(self, s: str) -> int:
+        start = time.perf_counter()
+        n = self.stream.write(s)
+        self.seconds += time.perf_counter() - start
+        return n
+
+class Metrics:
+    """
+    1回の処理（1ファイル、または --merge の1出力）の段階ごとの時間とメモリ、操作回数を記録する。
+    段階は phase() で囲む。同じ段階を何度も囲むと時間は合計される。
+    trace_memory なら tracemalloc で段階ごとの Python のピークメモリも測る（処理は遅くなる）。
+    profile_phase の段階は cProfile でも計測する。
+    """
+    def __init__(self, label: str, trace_memory: bool = False, profile_phase: Optional[str] = None):
+        self.label = label
+        self.trace_memory = trace_memory
+        self.profile_phase = profile_phase
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.counters: collections.Counter = collections.Counter()
+        self.profiles: List[cProfile.Profile] = []
+        self._counters_start = COUNTERS.copy()
+        self._caches_start = {name: func.cache_info() for name, func in _lru_caches().items()}
+        self._start = time.perf_counter()
+        self.total_seconds = 0.0
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile() if name == self.profile_phase else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profiles.append(profiler)
+            entry = self.phases.setdefault(name, {'seconds': 0.0})
+            entry['seconds'] += time.perf_counter() - start
+            entry['max_rss_mb'] = _max_rss_mb()
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+                entry['peak_mb'] = max(entry.get('peak_mb', 0.0), peak)
+
+    def transfer(self, source: str, target: str, seconds: float):
+        """source の段階に含まれていた seconds 秒を target の段階に付け替える。"""
+        self.phases[source]['seconds'] -= seconds
+        entry = self.phases.setdefault(target, {'seconds': 0.0, 'max_rss_mb': _max_rss_mb()})
+        entry['seconds'] += seconds
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def finish(self):
+        """計測を終え、盤面操作とキャッシュの回数をこの処理の分だけ集計する。"""
+        self.total_seconds = time.perf_counter() - self._start
+        for name, value in COUNTERS.items():
+            delta = value - self._counters_start.get(name, 0)
+            if delta:
+                self.counters[name] += delta
+        for name, func in _lru_caches().items():
+            info, start = func.cache_info(), self._caches_start[name]
+            self.counters[f'{name}_cache_hits'] += info.hits - start.hits
+            self.counters[f'{name}_cache_misses'] += info.misses - start.misses
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def to_dict(self, **extra) -> dict:
+        data = {'label': self.label}
+        data.update(extra)
+        data['total_seconds'] = round(self.total_seconds, 6)
+        data['max_rss_mb'] = _max_rss_mb()
+        data['phases'] = {name: {k: round(v, 6) if isinstance(v, float) else v for k, v in entry.items()}
+                          for name, entry in self.phases.items()}
+        data['counters'] = dict(sorted(self.counters.items()))
+        return data
+
+    def write_json(self, directory: str, **extra) -> str:
+        """directory/<label のファイル名>.metrics.json に書き出し、そのパスを返す。"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, os.path.basename(self.label) + '.metrics.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(**extra), f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        if self.profiles:
+            self.profile_stats().dump_stats(path[:-len('.metrics.json')] + f'.{self.profile_phase}.prof')
+        return path
+
+    def profile_stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiles[0])
+        for profiler in self.profiles[1:]:
+            stats.add(profiler)
+        return stats
+
+    def print_summary(self, profile_limit: int = 20):
+        print(f"\n--- Profile: {self.label} ---")
+        header = f"{'phase':<12} {'seconds':>9} {'max RSS MB':>11}"
+        if self.trace_memory:
+            header += f" {'peak MB':>9}"
+        print(header)
+        for name in sorted(self.phases, key=PHASES.index):
+            entry = self.phases[name]
+            rss = entry.get('max_rss_mb')
+            line = f"{name:<12} {entry['seconds']:>9.4f} {rss if rss is not None else float('nan'):>11.1f}"
+            if self.trace_memory:
+                line += f" {entry.get('peak_mb', 0.0):>9.2f}"
+            print(line)
+        print(f"{'total':<12} {self.total_seconds:>9.4f}")
+        if self.counters:
+            print("Counters: " + ", ".join(f"{k}={v}" for k, v in sorted(self.counters.items())))
+        if self.profiles:
+            print(f"\n--- cProfile: {self.profile_phase} ---")
+            self.profile_stats().sort_stats('cumulative').print_stats(profile_limit)
+
+class MetricsOptions(NamedTuple):
+    """計測の指定（--profile など）。並列処理のワーカーにも渡せるように値だけを持つ。"""
+    # 段階ごとの表（と cProfile の結果）を表示する
+    print_summary: bool = True
+    # JSON を書き出すディレクトリ
+    json_dir: Optional[str] = None
+    trace_memory: bool = False
+    cprofile_phase: Optional[str] = None
+
+    def create(self, label: str) -> Metrics:
+        return Metrics(label, self.trace_memory, self.cprofile_phase)
+
+    def report(self, metrics: Metrics, stats: NamedTuple):
+        """計測を終えて、stats（FileStats）の内容とともに表示・保存する。"""
+        metrics.finish()
+        if self.json_dir is not None:
+            path = metrics.write_json(self.json_dir, **stats._asdict())
+            print(f"Metrics written to {path}")
+        if self.print_summary:
+            metrics.print_summary()
+
+def phase(metrics: Optional[Metrics], name: str):
+    """metrics が None なら何もしない phase()。"""
+    return metrics.phase(name) if metrics is not None else contextlib.nullcontext()
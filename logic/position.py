@@ -0,0 +1,94 @@
+import shogi
+import hashlib
+from typing import Dict, Optional
+
+HAND_PIECE_TYPES = (shogi.PAWN, shogi.LANCE, shogi.KNIGHT, shogi.SILVER, shogi.GOLD, shogi.BISHOP, shogi.ROOK)
+
+def get_board_key(board: shogi.Board) -> int:
+    """
+    局面キー（64ビットZobristハッシュ）を返す。
+    盤面部分は python-shogi が push/pop ごとに差分更新しているため、
+    手番と持駒の分を加えるだけで済み、SFEN を生成するより桁違いに速い。
+    """
+    return board.zobrist_hash()
+
+def get_sfen_key(board: shogi.Board) -> str:
+    """
+    局面の SFEN 文字列（盤面、手番、持駒のみを抽出）を返す。
+    レポート表示や衝突時のフォールバックなど、必要な時にだけ使う。
+    """
+    s = board.sfen()
+    parts = s.split(' ')
+    return " ".join(parts[:3]) + " 1"
+
+def _position_check(board: shogi.Board) -> int:
+    """
+    ハッシュ衝突検査用の、Zobrist ハッシュとは独立な 64 ビットの局面ハッシュ
+    （駒配置・後手の駒の位置・手番・先手の持駒から作る）。平手からの対局では後手の持駒はこれらから一意に定まる。
+    局面ごとに保持するのはこの整数1つだけにする。
+    """
+    hand = board.pieces_in_hand[shogi.BLACK]
+    h = hashlib.blake2b(bytes(board.pieces), digest_size=8)
+    h.update(board.occupied[shogi.WHITE].to_bytes(11, 'little'))
+    h.update(bytes([board.turn] + [hand[p] for p in HAND_PIECE_TYPES]))
+    return int.from_bytes(h.digest(), 'little')
+
+def _fallback_key(sfen_key: str, salt: int) -> int:
+    digest = hashlib.blake2b(f"{salt}:{sfen_key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+class PositionKeys:
+    """
+    局面キーの払い出しと衝突検査を行う。
+    同じキーに異なる局面が現れた場合は、SFEN から導いた別のキーに退避する。
+    SFEN はレポート用に remember() された局面についてのみ保持する。
+    """
+    def __init__(self):
+        # 局面キー -> 衝突検査用の独立なハッシュ
+        self._checks: Dict[int, int] = {}
+        # 衝突した局面の検査用ハッシュ -> 退避先のキー
+        self._redirects: Dict[int, int] = {}
+        self._sfens: Dict[int, str] = {}
+        self.collisions = 0
+
+    def key(self, board: shogi.Board) -> int:
+        key = board.zobrist_hash()
+        check = _position_check(board)
+        known = self._checks.get(key)
+        if known is None:
+            self._checks[key] = check
+            return key
+        if known == check:
+            return key
+        return self._resolve_collision(board, check)
+
+    def _resolve_collision(self, board: shogi.Board, check: int) -> int:
+        redirected = self._redirects.get(check)
+        if redirected is not None:
+            return redirected
+        self.collisions += 1
+        sfen_key = get_sfen_key(board)
+        salt = 0
+        key = _fallback_key(sfen_key, salt)
+        while key in self._checks:
+            salt += 1
+            key = _fallback_key(sfen_key, salt)
+        self._checks[key] = check
+        self._redirects[check] = key
+        return key
+
+    def remember(self, key: int, board: shogi.Board):
+        """レポート用に局面の SFEN を記録する。"""
+        if key not in self._sfens:
+            self._sfens[key] = get_sfen_key(board)
+
+    def sfen(self, key: int) -> Optional[str]:
+        return self._sfens.get(key)
+
+    def remembered(self) -> Dict[int, str]:
+        """remember() された局面キーと SFEN の対応（キャッシュ保存用）。"""
+        return dict(self._sfens)
+
+    def restore(self, sfens: Dict[int, str]):
+        """remembered() で取り出した対応を復元する。"""
+        self._sfens.update(sfens)
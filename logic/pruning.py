@@ -0,0 +1,86 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+from logic.graph import PositionGraph
+
+class PruningPolicy(NamedTuple):
+    """展開の打ち切り条件。None の項目は制限しない。"""
+    # 合流局面の続きを2回目以降に展開する（複製する）とき、その合流局面から展開する最大手数
+    max_depth_after_confluence: Optional[int] = None
+    # 1つの局面の続き（部分木）を展開する最大回数
+    max_copies: Optional[int] = None
+    # 展開するノード（指し手）の総数の上限
+    max_nodes: Optional[int] = None
+    # この手数より深いところでは各局面の最初の手（出力上の本筋）だけを展開する
+    main_line_beyond: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return any(value is not None for value in self)
+
+class Pruner:
+    """
+    展開中に PruningPolicy を適用し、打ち切った内容を数える。
+    展開の走査から局面に入るたびに enter() を呼ぶ。完成したツリーを後から刈り込むことはしない。
+    """
+    def __init__(self, policy: PruningPolicy):
+        self.policy = policy
+        self.max_nodes = policy.max_nodes
+        # 局面ごとに続きを展開した回数
+        self._copies: Optional[List[int]] = None
+        # 複製の手数の制限で続きを省いた回数
+        self.depth_cuts = 0
+        # 展開回数の制限で続きを省いた回数
+        self.copy_cuts = 0
+        # 本筋だけにしたことで省いた変化の数
+        self.side_branches_cut = 0
+        self.node_limit_reached = False
+
+    def start(self, graph: PositionGraph):
+        """展開を始める前に、局面グラフに合わせた作業領域を用意する。"""
+        if self.policy.max_depth_after_confluence is not None or self.policy.max_copies is not None:
+            self._copies = [0] * len(graph)
+
+    def enter(self, pos: int, begin: int, end: int, depth: int,
+              copy_ply: Optional[int]) -> Optional[Tuple[int, Optional[int]]]:
+        """
+        局面 pos（そこからの手は depth 手目）の続きを展開してよいか判定する。
+        展開するなら (展開する辺の終端, 複製に入った局面の手数) を、打ち切るなら None を返す。
+        copy_ply は直前の局面までの値で、経路が既に展開した続きの複製の中にいなければ None。
+        """
+        policy = self.policy
+        copies = self._copies
+        if copies is not None:
+            if policy.max_copies is not None and copies[pos] >= policy.max_copies:
+                self.copy_cuts += 1
+                return None
+            if copy_ply is None and copies[pos]:
+                # 既に続きを展開した合流局面に別の経路から着いた
+                copy_ply = depth - 1
+            if (policy.max_depth_after_confluence is not None and copy_ply is not None
+                    and depth - copy_ply > policy.max_depth_after_confluence):
+                self.depth_cuts += 1
+                return None
+            copies[pos] += 1
+        if policy.main_line_beyond is not None and depth > policy.main_line_beyond and end - begin > 1:
+            self.side_branches_cut += end - begin - 1
+            end = begin + 1
+        return end, copy_ply
+
+    @property
+    def pruned(self) -> int:
+        """打ち切った箇所の数（ノード数の上限に達したことは含まない）。"""
+        return self.depth_cuts + self.copy_cuts + self.side_branches_cut
+
+    def summary(self) -> List[str]:
+        """打ち切った内容の説明（何も打ち切っていなければ空）。"""
+        policy = self.policy
+        lines = []
+        if self.depth_cuts:
+            lines.append(f"{self.depth_cuts} continuations cut {policy.max_depth_after_confluence} plies into a repeated confluence point")
+        if self.copy_cuts:
+            lines.append(f"{self.copy_cuts} continuations cut after {policy.max_copies} copies of the same position")
+        if self.side_branches_cut:
+            lines.append(f"{self.side_branches_cut} variations dropped beyond ply {policy.main_line_beyond} (main line only)")
+        if self.node_limit_reached:
+            lines.append(f"Expansion stopped at the limit of {policy.max_nodes} nodes")
+        return lines
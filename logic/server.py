@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from logic.api import OUTPUT_FORMATS, Expander, ExpansionResult, ExpansionTooLarge
+from logic.board import DEFAULT_ENGINE
+from logic.pruning import PruningPolicy
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_REQUEST_BYTES = 4 << 20
+DEFAULT_MAX_OUTPUT_NODES = 2_000_000
+DEFAULT_TIMEOUT = 120.0
+# クエリで指定できる打ち切り条件 -> PruningPolicy の項目
+PRUNING_PARAMETERS = {
+    'max_depth_after_confluence': 'max_depth_after_confluence',
+    'max_copies': 'max_copies',
+    'max_nodes': 'max_nodes',
+    'main_line_after': 'main_line_beyond',
+}
+# 展開の起動確認に使う短い棋譜（ワーカーの立ち上げ時に盤面の表などを用意させる）
+_WARMUP_KI2 = "手合割：平手\n▲７六歩 △３四歩 ▲２六歩\n\n変化：1手目\n▲２六歩 △３四歩 ▲７六歩\n"
+
+class ServiceOptions(NamedTuple):
+    host: str = DEFAULT_HOST
+    port: int = DEFAULT_PORT
+    # 展開を行うワーカープロセスの数（0 ならリクエストを受けたスレッドで展開する）
+    jobs: int = os.cpu_count() or 1
+    # 受け付ける棋譜の最大バイト数
+    max_request_bytes: int = DEFAULT_MAX_REQUEST_BYTES
+    # 展開前に見積もったノード数がこれを超えるリクエストは断る
+    max_output_nodes: Optional[int] = DEFAULT_MAX_OUTPUT_NODES
+    # 1つのリクエストの展開を待つ秒数
+    timeout: float = DEFAULT_TIMEOUT
+    engine: str = DEFAULT_ENGINE
+    # クエリで打ち切り条件を指定しなかった項目に使う値
+    pruning: PruningPolicy = PruningPolicy()
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# ワーカープロセスごとの Expander。プロセスが生きている間パース結果のキャッシュを保持する
+_worker_expander: Optional[Expander] = None
+
+def _init_worker(engine: str):
+    global _worker_expander
+    _worker_expander = Expander(engine)
+    _worker_expander.expand(_WARMUP_KI2)
+
+def _expand_in_worker(data: bytes, output_format: str, pruning: Optional[PruningPolicy],
+                      max_nodes: Optional[int]) -> ExpansionResult:
+    return _worker_expander.expand(data, output_format, pruning, max_nodes)
+
+def parse_options(query: str, defaults: PruningPolicy) -> Tuple[str, str, Optional[PruningPolicy]]:
+    """クエリから (出力形式, 出力のエンコーディング, 打ち切り条件) を読む。不正なら RequestError(400)。"""
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    output_format = params.pop('format', 'expanded')
+    if output_format not in OUTPUT_FORMATS:
+        raise RequestError(400, f"unknown format: {output_format}")
+    encoding = params.pop('encoding', 'utf-8')
+    try:
+        "".encode(encoding)
+    except LookupError:
+        raise RequestError(400, f"unknown encoding: {encoding}")
+    overrides: Dict[str, int] = {}
+    for name, value in params.items():
+        field = PRUNING_PARAMETERS.get(name)
+        if field is None:
+            raise RequestError(400, f"unknown parameter: {name}")
+        try:
+            overrides[field] = int(value)
+        except ValueError:
+            raise RequestError(400, f"{name} must be an integer")
+        if overrides[field] < 0:
+            raise RequestError(400, f"{name} must not be negative")
+    policy = defaults._replace(**overrides)
+    return output_format, encoding, policy if policy.active else None
+
+class ExpansionService:
+    """
+    HTTP のリクエストを展開に回す。展開は常駐するワーカープロセスのプールで行い（jobs が 0 なら同じプロセスで）、
+    リクエストごとにプロセスを起動しない。各ワーカーは起動時に一度展開を行って準備を済ませ、
+    パース結果のキャッシュと表記のキャッシュを保持し続ける。
+    """
+    def __init__(self, options: ServiceOptions):
+        self.options = options
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.expander: Optional[Expander] = None
+        if options.jobs > 0:
+            self.pool = ProcessPoolExecutor(max_workers=options.jobs, initializer=_init_worker,
+                                            initargs=(options.engine,))
+        else:
+            self.expander = Expander(options.engine)
+        # 展開中・待機中のリクエストの上限（超えたら 503）
+        self._slots = threading.BoundedSemaphore(max(options.jobs, 1) * 4)
+        self.requests = 0
+        # 枠を使っている（ワーカーで展開が続いている）リクエストの数
+        self.in_progress = 0
+        self._count_lock = threading.Lock()
+
+    def _release(self, _future=None):
+        with self._count_lock:
+            self.in_progress -= 1
+        self._slots.release()
+
+    def expand(self, data: bytes, output_format: str, pruning: Optional[PruningPolicy]) -> ExpansionResult:
+        if not self._slots.acquire(blocking=False):
+            raise RequestError(503, "too many requests in progress")
+        with self._count_lock:
+            self.requests += 1
+            self.in_progress += 1
+        max_nodes = self.options.max_output_nodes
+        if self.pool is None:
+            try:
+                return self.expander.expand(data, output_format, pruning, max_nodes)
+            except ExpansionTooLarge as e:
+                raise RequestError(413, str(e))
+            finally:
+                self._release()
+        try:
+            future = self.pool.submit(_expand_in_worker, data, output_format, pruning, max_nodes)
+        except BaseException:
+            self._release()
+            raise
+        # 枠はワーカーでの展開が終わったときに返す。時間切れで応答した後も展開は走り続けるので、
+        # その間は新しいリクエストに枠を渡さない
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.options.timeout)
+        except FutureTimeout:
+            # まだ始まっていなければ取り消せる（取り消しても done になり枠が返る）
+            future.cancel()
+            raise RequestError(504, f"expansion did not finish within {self.options.timeout:g}s")
+        except ExpansionTooLarge as e:
+            raise RequestError(413, str(e))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "KI2Expander/1"
+    service: ExpansionService
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), "application/json; charset=utf-8")
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/health':
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"status": "ok", "workers": self.service.options.jobs,
+                              "requests": self.service.requests, "in_progress": self.service.in_progress})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path != '/expand':
+                raise RequestError(404, "not found")
+            output_format, encoding, pruning = parse_options(url.query, self.service.options.pruning)
+            length = self.headers.get('Content-Length')
+            if length is None:
+                raise RequestError(411, "Content-Length is required")
+            try:
+                length = int(length)
+            except ValueError:
+                raise RequestError(400, "invalid Content-Length")
+            if length > self.service.options.max_request_bytes:
+                # 本文は読まずに接続を閉じる
+                self.close_connection = True
+                raise RequestError(413, f"request body exceeds {self.service.options.max_request_bytes} bytes")
+            data = self.rfile.read(length)
+            start = time.perf_counter()
+            result = self.service.expand(data, output_format, pruning)
+        except RequestError as e:
+            self._send_json(e.status, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        stats = result.stats
+        content_type = "application/json" if output_format == 'json' else "text/plain"
+        headers = {
+            "X-KI2-Nodes": str(stats.nodes),
+            "X-KI2-Positions": str(stats.positions),
+            "X-KI2-Confluence-Points": str(stats.confluence_points),
+            "X-KI2-Parse-Errors": str(stats.parse_errors),
+            "X-KI2-Pruned": str(stats.pruned),
+            "X-KI2-Cached": "1" if stats.cached else "0",
+            "X-KI2-Seconds": f"{time.perf_counter() - start:.3f}",
+        }
+        self._send(200, result.text.encode(encoding, errors='replace'), f"{content_type}; charset={encoding}", headers)
+
+    def log_message(self, format, *args):
+        pass
+
+def create_server(options: ServiceOptions) -> Tuple[ThreadingHTTPServer, ExpansionService]:
+    """展開サービスの HTTP サーバーを作る（port が 0 なら空いているポートを使う）。呼び出し側で serve_forever する。"""
+    service = ExpansionService(options)
+    handler = type('Handler', (_Handler,), {'service': service})
+    try:
+        server = ThreadingHTTPServer((options.host, options.port), handler)
+    except BaseException:
+        service.close()
+        raise
+    server.daemon_threads = True
+    return server, service
+
+def serve(options: ServiceOptions):
+    """展開サービスを起動し、Ctrl+C まで応答し続ける。"""
+    server, service = create_server(options)
+    host, port = server.server_address[:2]
+    print(f"Serving KI2 expansion on http://{host}:{port}/expand ({options.jobs} workers, Ctrl+C to stop)...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving.")
+    finally:
+        server.server_close()
+        service.close()
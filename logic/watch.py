@@ -0,0 +1,109 @@
+import hashlib
+import os
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# 監視する拡張子
+WATCH_SUFFIXES = ('.ki2', '.ki2u')
+DEFAULT_POLL_INTERVAL = 0.5
+# 最後の変更からこの秒数だけ変化がなければ保存が終わったとみなす
+DEFAULT_DEBOUNCE = 0.3
+
+class FileState(NamedTuple):
+    mtime_ns: int
+    size: int
+
+def _digest(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=20).digest()
+    except OSError:
+        return None
+
+class DirectoryWatcher:
+    """
+    ディレクトリ内の棋譜ファイルの追加・変更をポーリングで検出する。
+    更新日時とサイズで変更の候補を見つけ、debounce 秒のあいだ変化が止まってから内容のハッシュを比べ、
+    内容が本当に変わったファイルだけを返す。保存の連続（一時ファイルからの置き換えなど）は1回にまとまる。
+    exclude に当てはまるファイル（自分で書き出す出力など）は無視する。
+    """
+    def __init__(self, directory: str, debounce: float = DEFAULT_DEBOUNCE,
+                 exclude: Optional[Callable[[str], bool]] = None):
+        self.directory = directory
+        self.debounce = debounce
+        self.exclude = exclude
+        self._states: Dict[str, FileState] = {}
+        # 変更を検出した時刻（まだ処理していないもの）
+        self._pending: Dict[str, float] = {}
+        # 最後に返したときの内容のハッシュ
+        self._digests: Dict[str, bytes] = {}
+
+    def _scan(self) -> Dict[str, FileState]:
+        states = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return states
+        for entry in entries:
+            if not entry.name.lower().endswith(WATCH_SUFFIXES):
+                continue
+            if self.exclude is not None and self.exclude(entry.path):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if entry.is_file():
+                states[entry.path] = FileState(st.st_mtime_ns, st.st_size)
+        return states
+
+    def poll(self, now: Optional[float] = None) -> List[str]:
+        """1回走査し、処理すべきファイル（内容が変わって落ち着いたもの）をパス順に返す。"""
+        if now is None:
+            now = time.monotonic()
+        states = self._scan()
+        for path in list(self._states):
+            if path not in states:
+                # 削除された
+                del self._states[path]
+                self._pending.pop(path, None)
+                self._digests.pop(path, None)
+        for path, state in states.items():
+            if self._states.get(path) != state:
+                self._states[path] = state
+                self._pending[path] = now
+
+        ready = []
+        for path, changed in sorted(self._pending.items()):
+            if now - changed < self.debounce:
+                continue
+            del self._pending[path]
+            digest = _digest(path)
+            if digest is None or digest == self._digests.get(path):
+                continue
+            self._digests[path] = digest
+            ready.append(path)
+        return ready
+
+def watch(watcher: DirectoryWatcher, process: Callable[[str], object], interval: float = DEFAULT_POLL_INTERVAL,
+          cycles: Optional[int] = None):
+    """
+    watcher をポーリングし続け、変更されたファイルごとに process を呼ぶ（Ctrl+C で終了）。
+    1つのファイルの処理が失敗しても監視は続ける。cycles を指定するとその回数だけ走査して戻る。
+    """
+    print(f"Watching {watcher.directory} for changes (Ctrl+C to stop)...")
+    count = 0
+    try:
+        while cycles is None or count < cycles:
+            count += 1
+            for path in watcher.poll():
+                start = time.perf_counter()
+                try:
+                    process(path)
+                except Exception as e:
+                    print(f"Error processing {path}: {e}")
+                print(f"Updated {path} in {time.perf_counter() - start:.2f}s")
+            if cycles is None or count < cycles:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
@@ -0,0 +1,151 @@
+import shogi
+import re
+from typing import Dict, List, Optional, Set, TextIO, Tuple
+
+from logic.expander import get_ki2_move_str
+from logic.board import AnyBoard
+from logic.graph import PositionGraph, decode_move
+from logic.position import get_board_key, PositionKeys
+from logic.pruning import Pruner
+
+_NEWLINE_RUNS = re.compile(r'(\n+)')
+
+class Ki2Emitter:
+    """
+    KI2 の断片（指し手、コメント、変化の見出し）を逐次ストリームへ書き出す。
+    断片は空白区切りで並べ、改行に接する空白は省き、連続する改行は2つまでに詰める。
+    これは従来の「join してから replace で整える」処理と同じ結果になる。
+    """
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._started = False
+        self._newline_run = 0
+
+    def emit(self, fragment: str):
+        if self._started and self._newline_run == 0 and not fragment.startswith("\n"):
+            self.stream.write(" ")
+        self._started = True
+        for piece in _NEWLINE_RUNS.split(fragment):
+            if not piece:
+                continue
+            if piece[0] == "\n":
+                count = min(len(piece), 2 - self._newline_run)
+                if count > 0:
+                    self.stream.write("\n" * count)
+                    self._newline_run += count
+            else:
+                self.stream.write(piece)
+                self._newline_run = 0
+
+    @property
+    def needs_space(self) -> bool:
+        """次に改行で始まらない断片を書くと、その前に空白が入るか。"""
+        return self._started and self._newline_run == 0
+
+    @property
+    def newline_run(self) -> int:
+        """直前に書いた連続する改行の数。"""
+        return self._newline_run
+
+    def resume(self, newline_run: int):
+        """ストリームへ直接書き込んだ断片（改行 newline_run 個で終わる）の続きから書けるようにする。"""
+        self._started = True
+        self._newline_run = newline_run
+
+    def move(self, depth: int, ki2_str: str):
+        move_label = "▲" if depth % 2 != 0 else "△"
+        self.emit(f"{move_label}{ki2_str}")
+
+    def comment(self, comment: str):
+        self.emit(f"\n*{comment}\n")
+
+    def variation(self, depth: int):
+        # 再生アプリとの互換性のため「変化：」の前には空行、後には改行を入れる
+        self.emit(f"\n\n変化：{depth}手目\n")
+
+def write_expanded_ki2(
+    stream: TextIO,
+    board: AnyBoard,
+    graph: PositionGraph,
+    keys: Optional[PositionKeys] = None,
+    pruner: Optional[Pruner] = None
+) -> int:
+    """
+    局面グラフを辿りながら、全分岐を展開した KI2 の指し手部分を stream に直接書き出す。
+    展開済みツリーも出力全体もメモリ上に保持しない。書き出したノード数を返す。
+    pruner があれば、その打ち切り条件を辿りながら適用する。
+    """
+    root = graph.position_id(keys.key(board) if keys is not None else get_board_key(board))
+    if root is None:
+        return 0
+    emitter = Ki2Emitter(stream)
+    offsets, edge_moves, targets = graph.edge_offsets, graph.edge_moves, graph.edge_targets
+    # 表記は辺（局面と指し手）と「同」かどうかだけで決まるので使い回す
+    notations: Dict[Tuple[int, bool], str] = {}
+    path_history: Set[int] = set()
+    # 現在の経路の指し手。盤面は表記の生成が必要になった時だけ経路に追いつかせる
+    path: List[shogi.Move] = []
+    synced = 0
+    root_last_to = board.move_stack[-1].to_square if board.move_stack else None
+    # スタックの各要素は [局面ID, 次の辺, 辺の終端, 手数, 複製に入った局面の手数]
+    stack: List[list] = []
+    if pruner is not None:
+        pruner.start(graph)
+    max_nodes = pruner.max_nodes if pruner is not None else None
+
+    def enter(pos: int, depth: int, copy_ply: Optional[int] = None) -> bool:
+        if pos in path_history or offsets[pos] == offsets[pos + 1]:
+            return False
+        end = offsets[pos + 1]
+        if pruner is not None:
+            allowed = pruner.enter(pos, offsets[pos], end, depth, copy_ply)
+            if allowed is None:
+                return False
+            end, copy_ply = allowed
+        path_history.add(pos)
+        stack.append([pos, offsets[pos], end, depth, copy_ply])
+        return True
+
+    enter(root, 1)
+    written = 0
+    while stack:
+        frame = stack[-1]
+        edge = frame[1]
+        if edge < frame[2]:
+            if written == max_nodes:
+                pruner.node_limit_reached = True
+                break
+            depth = frame[3]
+            if edge > offsets[frame[0]]:
+                emitter.variation(depth)
+            frame[1] = edge + 1
+            move = decode_move(edge_moves[edge])
+            last_to = path[-1].to_square if path else root_last_to
+            notation_key = (edge, move.to_square == last_to)
+            ki2_str = notations.get(notation_key)
+            if ki2_str is None:
+                while synced < len(path):
+                    board.push(path[synced])
+                    synced += 1
+                ki2_str = get_ki2_move_str(board, move)
+                notations[notation_key] = ki2_str
+            emitter.move(depth, ki2_str)
+            for comment in graph.edge_comments(edge):
+                emitter.comment(comment)
+            written += 1
+
+            path.append(move)
+            if not enter(targets[edge], depth + 1, frame[4]):
+                path.pop()
+            continue
+
+        stack.pop()
+        path_history.discard(frame[0])
+        if stack:
+            path.pop()
+            if synced > len(path):
+                board.pop()
+                synced -= 1
+    for _ in range(synced):
+        board.pop()
+    return written
@@ -1,146 +1,476 @@
 import shogi
-import sys
-import re
 import argparse
+import codecs
 import os
-from extract_moves import extract_moves_from_ki2
-from logic.expander import expand_tree
+import io
+import time
+import functools
+from extract_moves import PARSER_VERSION, parse_ki2, parse_ki2_bytes, read_ki2_header
+from logic.writer import Ki2Emitter, write_expanded_ki2
+from logic.expander import Tree
+from logic.graph_writer import write_graph_json, write_graph_ki2
+from logic.estimate import estimate_expansion
 from logic.utils import to_bod
-from typing import List, Dict
+from logic.position import get_board_key, PositionKeys
+from logic.board import DEFAULT_ENGINE, ENGINES, new_board
+from logic.batch import FileStats, print_batch_summary, run_batch
+from logic.cache import DEFAULT_CACHE_DIR, CachedParse, MemoryParseCache, ParseCache
+from logic.corpus import DEFAULT_MAX_POSITIONS, CorpusIndex
+from logic.encoding import DEFAULT_ENCODING, detect_file_encoding
+from logic.pruning import Pruner, PruningPolicy
+from logic.incremental import index_path, open_previous, save_index, write_incremental_ki2
+from logic.merge import merge_arrival_info, merge_graphs, remember_missing_sfens
+from logic.watch import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, DirectoryWatcher, watch
+from logic.server import DEFAULT_HOST, DEFAULT_MAX_OUTPUT_NODES, DEFAULT_MAX_REQUEST_BYTES, ServiceOptions, serve
+from logic.metrics import PHASES, Metrics, MetricsOptions, TimedStream, counting_engine, phase
+from typing import List, Optional
 
-def format_as_ki2_text(tree: List[Dict]) -> str:
+OUTPUT_BUFFER_SIZE = 1 << 20
+# 出力形式 -> (出力ファイル名の接尾辞, 拡張子（None なら入力と同じ）)
+OUTPUT_FORMATS = {
+    'expanded': ("_expanded", None),
+    'graph': ("_graph", None),
+    'json': ("_graph", ".json"),
+}
+
+def format_as_ki2_text(tree: Tree) -> str:
     """
     ツリー構造をKI2のテキスト形式に整形する。
     """
-    lines = []
+    buffer = io.StringIO()
+    emitter = Ki2Emitter(buffer)
     
-    def traverse(current_tree: List[Dict], current_depth: int, is_main: bool):
-        if not current_tree:
-            return
-        
-        node = current_tree[0]
-        move_label = "▲" if current_depth % 2 != 0 else "△"
-        lines.append(f"{move_label}{node['ki2_str']}")
+    # (兄弟ノードのリスト, 次に出力する位置, 手数) のスタックで辿る
+    stack = [(tree, 0, 1)]
+    while stack:
+        current_tree, i, current_depth = stack.pop()
+        if i >= len(current_tree):
+            continue
+        node = current_tree[i]
+        if i > 0:
+            emitter.variation(current_depth)
+        emitter.move(current_depth, node.ki2_str)
         
         # コメントの出力
-        for comment in node.get('comments', []):
-            lines.append(f"\n*{comment}\n")
-        
-        traverse(node['branches'], current_depth + 1, True)
+        for comment in node.comments:
+            emitter.comment(comment)
         
-        for alt_node in current_tree[1:]:
-            lines.append(f"\n\n変化：{current_depth}手目\n")
-            move_label = "▲" if current_depth % 2 != 0 else "△"
-            lines.append(f"{move_label}{alt_node['ki2_str']}")
-            
-            # 変化の指し手に対するコメント
-            for comment in alt_node.get('comments', []):
-                lines.append(f"\n*{comment}\n")
-                
-            traverse(alt_node['branches'], current_depth + 1, False)
+        stack.append((current_tree, i + 1, current_depth))
+        stack.append((node.branches, 0, current_depth + 1))
 
-    traverse(tree, 1, True)
-    # フォーマットの微調整
-    text = " ".join(lines).replace(" \n", "\n").replace("\n ", "\n")
-    # 連続する改行を整理
-    while "\n\n\n" in text:
-        text = text.replace("\n\n\n", "\n\n")
-    return text
+    return buffer.getvalue()
 
 def get_ki2_header(file_path: str) -> str:
     """
     元のKI2ファイルからヘッダー情報を抽出する。
     """
-    header_lines = []
-    try:
-        with open(file_path, 'r', encoding='cp932', errors='replace') as f:
-            for line in f:
-                stripped = line.strip()
-                if not stripped: continue
-                # 指し手らしき文字が含まれない行をヘッダーとみなす
-                if not (stripped.startswith('▲') or stripped.startswith('△') or stripped.startswith('変化：')):
-                    header_lines.append(stripped)
-                else:
-                    break
-    except:
-        pass
-    return "\n".join(header_lines)
+    return read_ki2_header(file_path)
+
+def load_or_parse(input_file: str, keys: PositionKeys, engine: str = DEFAULT_ENGINE, cache: Optional[ParseCache] = None,
+                  metrics: Optional[Metrics] = None):
+    """
+    パース結果（局面グラフ、到達情報、ヘッダー）を返す。
+    cache があればファイル内容のハッシュで引き、変更のないファイルはパースを省く。
+    """
+    content = None
+    if cache is not None:
+        with phase(metrics, 'read'):
+            try:
+                with open(input_file, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                content = None
+            cached = cache.load(content) if content is not None else None
+        if metrics is not None:
+            metrics.count('parse_cache_hits' if cached is not None else 'parse_cache_misses')
+        if cached is not None:
+            print("Using cached parse result.")
+            keys.restore(cached.sfens)
+            return cached.graph, cached.arrival_info, cached.header
 
-def process_file(input_file: str):
+    with phase(metrics, 'parse'):
+        if content is not None:
+            # キャッシュのキーにしたのと同じ内容をパースする（読んだ後にファイルが書き換えられても食い違わない）
+            graph, arrival_info, header = parse_ki2_bytes(content, input_file, keys, engine)
+        else:
+            graph, arrival_info, header = parse_ki2(input_file, keys, engine)
+    if content is not None and graph:
+        cache.store(content, CachedParse(graph, arrival_info, header, keys.remembered()))
+    return graph, arrival_info, header
+
+def output_path(input_file: str, output_format: str = 'expanded') -> str:
+    """入力ファイルに対応する出力ファイル名。"""
     base, ext = os.path.splitext(input_file)
-    output_file = f"{base}_expanded{ext}"
+    suffix, format_ext = OUTPUT_FORMATS[output_format]
+    return f"{base}{suffix}{format_ext or ext}"
+
+def is_output_file(path: str) -> bool:
+    """このツールが書き出した出力ファイルか（--watch で入力とみなさないため）。"""
+    base = os.path.splitext(os.path.basename(path))[0]
+    return any(base.endswith(suffix) for suffix, _ in OUTPUT_FORMATS.values())
+
+def process_file(input_file: str, dry_run: bool = False, engine: str = DEFAULT_ENGINE, cache: Optional[ParseCache] = None,
+                 output_encoding: Optional[str] = None, metrics_options: Optional[MetricsOptions] = None,
+                 output_format: str = 'expanded', pruning: Optional[PruningPolicy] = None,
+                 incremental: bool = False) -> FileStats:
+    """
+    1つの KI2 ファイルを処理し、集計用の統計を返す。
+    output_encoding を省略すると入力ファイルと同じエンコーディング（JSON は UTF-8）で書き出す。
+    metrics_options があれば段階ごとの時間・メモリと盤面操作の回数を計測して報告する。
+    output_format で展開した KI2（expanded）か、複製しない局面グラフ（graph / json）かを選ぶ。
+    pruning があれば展開をその条件で打ち切る。
+    incremental なら前回の出力のうち変わっていない部分を再利用する。
+    """
+    output_file = output_path(input_file, output_format)
+    metrics = metrics_options.create(input_file) if metrics_options is not None else None
+    if metrics is not None:
+        engine = counting_engine(engine)
     
     print(f"--- Processing {input_file} ---")
     print(f"Reading and analyzing...")
-    move_map, arrival_info = extract_moves_from_ki2(input_file)
+    keys = PositionKeys()
+    graph, arrival_info, header = load_or_parse(input_file, keys, engine, cache, metrics)
     
-    if not move_map:
+    if not graph:
         print(f"No moves extracted from {input_file}. Skipping.")
-        return
+        stats = FileStats(input_file, error="No moves extracted")
+    else:
+        encoding = output_encoding or ('utf-8' if output_format == 'json' else detect_file_encoding(input_file))
+        stats = report_and_write(input_file, output_file, graph, arrival_info, header, keys, dry_run, engine, encoding, metrics,
+                                 output_format, pruning, incremental)
+    if metrics is not None:
+        metrics_options.report(metrics, stats)
+    return stats
 
-    # 直前の手が異なる合流ポイントのみを抽出
-    initial_sfen = get_board_key(shogi.Board())
-    confluence_positions = [
-        sfen for sfen, arrivals in arrival_info.items() 
-        if len(arrivals) > 1 and sfen != initial_sfen
-    ]
-    
-    print(f"Total unique positions found: {len(arrival_info)}")
-    print(f"Number of primary confluence points: {len(confluence_positions)}")
-    
-    if confluence_positions:
-        print("\n--- Primary Confluence Points (Different incoming moves) ---")
-        for sfen in confluence_positions:
-            board = shogi.Board(sfen)
-            side = "先手" if board.turn == shogi.BLACK else "後手"
-            print(f"\n[合流局面] 手番: {side}")
-            
-            # 各到達経路（直前の手）を表示
-            for i, (last_move, path) in enumerate(arrival_info[sfen].items(), 1):
-                path_str = " ".join(path)
-                print(f"  経路 {i}: ... {path_str}")
-            
-            # 盤面をBOD形式で表示
-            print(to_bod(board))
-            print("-" * 40)
-
-    print(f"\nExpanding tree branches...")
-    board = shogi.Board()
-    expanded_tree = expand_tree(board, move_map)
-    
-    def count_total_moves(tree):
-        total = 0
-        for node in tree:
-            total += 1
-            total += count_total_moves(node['branches'])
-        return total
-    
-    print(f"Expansion complete. Total nodes in expanded tree: {count_total_moves(expanded_tree)}")
-    
-    print(f"Generating KI2 output...")
-    header = get_ki2_header(input_file)
-    ki2_text = format_as_ki2_text(expanded_tree)
-    
-    final_output = header + "\n\n" + ki2_text
+def process_merged(input_files: List[str], output_file: str, header_file: Optional[str] = None, dry_run: bool = False,
+                   engine: str = DEFAULT_ENGINE, cache: Optional[ParseCache] = None, output_encoding: Optional[str] = None,
+                   metrics_options: Optional[MetricsOptions] = None, output_format: str = 'expanded',
+                   pruning: Optional[PruningPolicy] = None, incremental: bool = False) -> FileStats:
+    """
+    複数の KI2 ファイルの局面グラフを合わせ、ファイルをまたいだ合流も含めて1つの KI2 に展開する（--merge）。
+    ヘッダーは header_file（省略時は最初の入力）のものを使う。
+    output_encoding を省略すると header_file と同じエンコーディングで書き出す。
+    """
+    header_file = header_file or input_files[0]
+    if header_file not in input_files:
+        print(f"Error: header file {header_file} is not one of the input files.")
+        return FileStats(output_file, error="Header file not among inputs")
+    metrics = metrics_options.create(output_file) if metrics_options is not None else None
+    if metrics is not None:
+        engine = counting_engine(engine)
+
+    print(f"--- Merging {len(input_files)} files into {output_file} ---")
+    keys = PositionKeys()
+    graphs, arrival_infos = [], []
+    header = ""
+    for input_file in input_files:
+        print(f"Reading and analyzing {input_file}...")
+        graph, arrival_info, file_header = load_or_parse(input_file, keys, engine, cache, metrics)
+        graphs.append(graph)
+        arrival_infos.append(arrival_info)
+        if input_file == header_file:
+            header = file_header
+
+    with phase(metrics, 'merge'):
+        graph = merge_graphs(graphs)
+        if graph:
+            arrival_info = merge_arrival_info(arrival_infos)
+            # ファイルをまたいで初めて合流した局面はパース中に SFEN が記録されていない
+            remember_missing_sfens(graph, new_board(engine), keys,
+                                   (key for key, arrivals in arrival_info.items() if len(arrivals) > 1))
+    if not graph:
+        print("No moves extracted from the input files. Skipping.")
+        stats = FileStats(output_file, error="No moves extracted")
+    else:
+        encoding = output_encoding or ('utf-8' if output_format == 'json' else detect_file_encoding(header_file))
+        stats = report_and_write(output_file, output_file, graph, arrival_info, header, keys, dry_run, engine, encoding, metrics,
+                                 output_format, pruning, incremental)
+    if metrics is not None:
+        metrics_options.report(metrics, stats)
+    return stats
+
+def report_and_write(label: str, output_file: str, graph, arrival_info, header: str, keys: PositionKeys,
+                     dry_run: bool = False, engine: str = DEFAULT_ENGINE, encoding: str = DEFAULT_ENCODING,
+                     metrics: Optional[Metrics] = None, output_format: str = 'expanded',
+                     pruning: Optional[PruningPolicy] = None, incremental: bool = False) -> FileStats:
+    """
+    合流局面をレポートし、展開した KI2 を書き出す（dry_run なら見積もりだけ表示する）。
+    output_format が graph / json なら展開せず、局面グラフをそのまま書き出す。
+    pruning があれば展開をその条件で打ち切り、省いた内容を表示する。
+    incremental なら出力の隣に展開の索引を残し、次回は到達範囲の変わっていない局面以下を前回の出力から写す。
+    """
+    with phase(metrics, 'confluence'):
+        # 直前の手が異なる合流ポイントのみを抽出
+        initial_key = get_board_key(shogi.Board())
+        confluence_positions = [
+            key for key, arrivals in arrival_info.items() 
+            if len(arrivals) > 1 and key != initial_key
+        ]
+        
+        print(f"Total unique positions found: {len(arrival_info)}")
+        print(f"Number of primary confluence points: {len(confluence_positions)}")
+        
+        if confluence_positions:
+            print("\n--- Primary Confluence Points (Different incoming moves) ---")
+            for key in confluence_positions:
+                board = shogi.Board(keys.sfen(key))
+                side = "先手" if board.turn == shogi.BLACK else "後手"
+                print(f"\n[合流局面] 手番: {side}")
+                
+                # 各到達経路（直前の手）を表示
+                for i, (last_move, path) in enumerate(arrival_info[key].items(), 1):
+                    path_str = " ".join(path)
+                    print(f"  経路 {i}: ... {path_str}")
+                
+                # 盤面をBOD形式で表示
+                print(to_bod(board))
+                print("-" * 40)
+
+    if dry_run:
+        with phase(metrics, 'estimate'):
+            print_expansion_estimate(graph, header, keys, confluence_positions, engine, encoding)
+        if pruning is not None and output_format == 'expanded':
+            print("Note: the estimate is for the full expansion; pruning limits are not applied.")
+        return FileStats(label, len(arrival_info), len(confluence_positions))
+
+    # 局面グラフの出力は複製しないので打ち切る必要がない
+    pruner = Pruner(pruning) if pruning is not None and output_format == 'expanded' else None
+    use_index = incremental and output_format == 'expanded' and pruner is None
+    if incremental and not use_index:
+        print("Note: --incremental applies only to expanded output without pruning limits.")
+    if output_format == 'expanded':
+        print(f"\nExpanding tree branches and writing KI2 output...")
+    else:
+        print(f"\nWriting position graph ({output_format})...")
     
+    # 差分更新では前回の出力を読みながら書くので、一時ファイルに書いてから置き換える
+    target_file = output_file + ".tmp" if use_index else output_file
+    previous, previous_output = open_previous(output_file) if use_index else (None, None)
     try:
-        with open(output_file, 'w', encoding='cp932', errors='replace') as f:
-            f.write(final_output)
+        # 展開しながら直接書き出す（ツリー全体も出力全体もメモリに載せない）
+        with open(target_file, 'w', encoding=encoding, errors='replace', buffering=OUTPUT_BUFFER_SIZE) as f:
+            # 指し手の表記は展開と一体で作るので、計測では書き込み時間だけを 'write' に分ける
+            stream = TimedStream(f) if metrics is not None else f
+            with phase(metrics, 'expand'):
+                if output_format == 'json':
+                    total_nodes = write_graph_json(stream, new_board(engine), graph, keys, header)
+                else:
+                    stream.write(header + "\n\n")
+                    if output_format == 'graph':
+                        total_nodes = write_graph_ki2(stream, new_board(engine), graph, keys)
+                    elif use_index:
+                        total_nodes, index, reuse = write_incremental_ki2(f, new_board(engine), graph, keys, previous,
+                                                                          previous_output, stream)
+                    else:
+                        total_nodes = write_expanded_ki2(stream, new_board(engine), graph, keys, pruner)
+            with phase(metrics, 'write'):
+                f.flush()
+            if metrics is not None:
+                metrics.transfer('expand', 'write', stream.seconds)
+            output_size = f.tell()
+        if use_index:
+            if previous_output is not None:
+                previous_output.close()
+            os.replace(target_file, output_file)
+            save_index(index_path(output_file), index._replace(output_size=output_size))
+        if output_format == 'expanded':
+            print(f"Expansion complete. Total nodes in expanded tree: {total_nodes}")
+            if use_index:
+                print(f"Incremental: {reuse.changed_positions} positions changed; reused {reuse.reused_nodes} nodes "
+                      f"({reuse.reused_segments} subtrees) from the previous output")
+            if pruner is not None:
+                lines = pruner.summary()
+                print("Pruning: " + ("; ".join(lines) if lines else "nothing was cut"))
+        else:
+            print(f"Position graph written. Total moves: {total_nodes}")
         print(f"Done! Saved to {output_file}")
     except Exception as e:
         print(f"Error saving file: {e}")
+        if use_index:
+            if previous_output is not None:
+                previous_output.close()
+            if os.path.exists(target_file):
+                os.remove(target_file)
+        return FileStats(label, len(arrival_info), len(confluence_positions), error=str(e))
+    return FileStats(label, len(arrival_info), len(confluence_positions), total_nodes,
+                     pruned=pruner.pruned if pruner is not None else 0)
+
+def print_expansion_estimate(graph, header: str, keys: PositionKeys, confluence_positions: List[int], engine: str = DEFAULT_ENGINE,
+                             encoding: str = DEFAULT_ENCODING):
+    """
+    展開せずに出力規模を見積もって表示する（--dry-run）。
+    """
+    print(f"\nEstimating expansion (dry run)...")
+    estimate = estimate_expansion(new_board(engine), graph, header, keys, encoding)
+    print(f"Total nodes in expanded tree: {estimate.nodes}")
+    print(f"Output lines: {estimate.lines}")
+    print(f"Approximate output size: {estimate.approx_bytes} bytes")
+    
+    if confluence_positions:
+        print("\n--- Subtree copies per confluence point ---")
+        counts = []
+        for key in confluence_positions:
+            pos = graph.position_id(key)
+            counts.append((estimate.multiplicity.get(pos, 0) if pos is not None else 0, key))
+        counts.sort(key=lambda item: item[0], reverse=True)
+        for count, key in counts:
+            board = shogi.Board(keys.sfen(key))
+            side = "先手" if board.turn == shogi.BLACK else "後手"
+            print(f"  {count} copies  手番: {side}  {keys.sfen(key)}")
 
-def get_board_key(board: shogi.Board) -> str:
-    s = board.sfen()
-    parts = s.split(' ')
-    return " ".join(parts[:3]) + " 1"
+def index_files(db_path: str, input_files: List[str], engine: str = DEFAULT_ENGINE):
+    """
+    入力ファイルをコーパス索引（SQLite）に登録する（--index）。
+    """
+    with CorpusIndex(db_path) as corpus:
+        indexed, skipped = corpus.add_files(input_files, engine)
+        files, positions, edges = corpus.counts()
+    print(f"Indexed {indexed} files ({skipped} unchanged) into {db_path}")
+    print(f"Corpus: {files} files, {positions} positions, {edges} moves")
+
+def expand_index(db_path: str, dry_run: bool = False, engine: str = DEFAULT_ENGINE, output_encoding: Optional[str] = None,
+                 output_format: str = 'expanded', pruning: Optional[PruningPolicy] = None, incremental: bool = False,
+                 max_positions: Optional[int] = DEFAULT_MAX_POSITIONS) -> FileStats:
+    """
+    コーパス索引（SQLite）に登録された手を平手の初期局面から展開して書き出す（--from-index）。
+    索引からは初期局面から到達できる局面を max_positions まで読み出し、その先の局面は葉として扱う。
+    """
+    base, _ = os.path.splitext(db_path)
+    suffix, format_ext = OUTPUT_FORMATS[output_format]
+    output_file = f"{base}{suffix}{format_ext or '.ki2'}"
+    if not os.path.exists(db_path):
+        print(f"Error: corpus index {db_path} does not exist.")
+        return FileStats(output_file, error="Corpus index not found")
+
+    print(f"--- Expanding corpus index {db_path} ---")
+    keys = PositionKeys()
+    with CorpusIndex(db_path) as corpus:
+        graph = corpus.subgraph(new_board(engine), keys, max_positions)
+    if max_positions is not None and len(graph) > max_positions:
+        print(f"Note: read the continuations of {max_positions} positions (--max-positions); "
+              f"{len(graph) - max_positions} positions beyond them are written as leaves.")
+    if not graph:
+        print(f"No moves from the initial position in {db_path}. Skipping.")
+        return FileStats(output_file, error="No moves extracted")
+    # 索引は到達経路を持たないので、合流局面の経路の表示はしない
+    arrival_info = {key: {} for key in graph.keys}
+    encoding = output_encoding or ('utf-8' if output_format == 'json' else DEFAULT_ENCODING)
+    return report_and_write(output_file, output_file, graph, arrival_info, "手合割：平手", keys, dry_run, engine, encoding,
+                            output_format=output_format, pruning=pruning, incremental=incremental)
+
+def encoding_name(value: str) -> str:
+    try:
+        codecs.lookup(value)
+    except LookupError:
+        raise argparse.ArgumentTypeError(f"unknown encoding: {value}")
+    return value
+
+def non_negative_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: {value}")
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {value}")
+    return number
 
 def main():
     parser = argparse.ArgumentParser(description="KI2 Branch Expander")
     parser.add_argument("input_files", nargs="*", help="Input KI2 files")
+    parser.add_argument("--dry-run", action="store_true", help="Estimate the expanded size without writing output")
+    parser.add_argument("--jobs", type=int, metavar="N", help="Process files in parallel with N worker processes and print a summary")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse input files instead of using the parse cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Remove all cached parse results before processing")
+    parser.add_argument("--cache-dir", default=os.environ.get("KI2_CACHE_DIR", DEFAULT_CACHE_DIR), help="Directory of the parse cache")
+    parser.add_argument("--index", metavar="DB", help="Add the input files to a SQLite corpus index instead of expanding them")
+    parser.add_argument("--from-index", metavar="DB",
+                        help="Expand the moves stored in a SQLite corpus index from the initial position")
+    parser.add_argument("--max-positions", type=non_negative_int, default=DEFAULT_MAX_POSITIONS, metavar="N",
+                        help="--from-index reads the continuations of at most N positions into memory; "
+                             "positions beyond them are written as leaves (default: 1000000)")
+    parser.add_argument("--merge", metavar="OUTPUT", help="Merge all input files into a single expanded KI2 file")
+    parser.add_argument("--header-from", metavar="FILE", help="Input file whose header is used with --merge (default: the first input)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE, help="Board implementation used for parsing and expansion")
+    parser.add_argument("--output-encoding", type=encoding_name, metavar="ENCODING",
+                        help="Encoding of the output files, e.g. cp932, utf-8, utf-8-sig (default: same as the input file)")
+    parser.add_argument("--output-format", choices=sorted(OUTPUT_FORMATS), default='expanded',
+                        help="expanded: duplicate every subtree below confluence points (default); "
+                             "graph: write each position once as KI2 with #label/#merge comments; "
+                             "json: write the position graph as JSON")
+    parser.add_argument("--max-depth-after-confluence", type=non_negative_int, metavar="N",
+                        help="Expand at most N plies past a confluence point that has already been expanded once "
+                             "(the first arrival is always expanded in full)")
+    parser.add_argument("--max-copies", type=non_negative_int, metavar="N",
+                        help="Expand the continuation of any one position at most N times")
+    parser.add_argument("--max-nodes", type=non_negative_int, metavar="N", help="Stop the expansion after writing N nodes")
+    parser.add_argument("--main-line-after", type=non_negative_int, metavar="N",
+                        help="Beyond ply N, expand only the first move of each position (the main line of the output)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Keep an index next to each expanded output and, on the next run, copy the parts whose "
+                             "positions did not change from the previous output instead of expanding them again")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="Keep running and re-process KI2 files in DIR whenever they are added or modified")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, metavar="SECONDS",
+                        help="How often --watch scans the directory (default: 0.5)")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE, metavar="SECONDS",
+                        help="How long a file must stay unchanged before --watch processes it (default: 0.3)")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="Run a local HTTP service that expands KI2 posted to /expand (worker processes: --jobs)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address --serve listens on (default: 127.0.0.1)")
+    parser.add_argument("--max-request-bytes", type=int, default=DEFAULT_MAX_REQUEST_BYTES, metavar="N",
+                        help="Largest KI2 body --serve accepts (default: 4 MiB)")
+    parser.add_argument("--max-output-nodes", type=int, default=DEFAULT_MAX_OUTPUT_NODES, metavar="N",
+                        help="--serve rejects requests whose estimated expansion exceeds N nodes (default: 2000000)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print wall time and memory per phase and counts of board operations and cache hits")
+    parser.add_argument("--metrics-json", metavar="DIR", help="Write the per-phase metrics of each output as JSON into DIR")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also record the peak Python memory of each phase with tracemalloc (slower)")
+    parser.add_argument("--cprofile", choices=PHASES, metavar="PHASE",
+                        help=f"Run cProfile around one phase ({', '.join(PHASES)}) and print the hottest functions")
     
     args = parser.parse_args()
     
+    cache = ParseCache(args.cache_dir, PARSER_VERSION)
+    if args.clear_cache:
+        print(f"Cleared {cache.clear()} cached parse results.")
+    if args.no_cache:
+        cache = None
+
+    pruning = PruningPolicy(args.max_depth_after_confluence, args.max_copies, args.max_nodes, args.main_line_after)
+    if not pruning.active:
+        pruning = None
+    metrics_options = None
+    if args.profile or args.metrics_json or args.trace_memory or args.cprofile:
+        metrics_options = MetricsOptions(print_summary=args.profile or not args.metrics_json, json_dir=args.metrics_json,
+                                         trace_memory=args.trace_memory, cprofile_phase=args.cprofile)
+
+    if args.serve is not None:
+        if args.watch or args.merge or args.index or args.from_index or args.input_files:
+            parser.error("--serve cannot be combined with input files, --watch, --merge, --index or --from-index")
+        serve(ServiceOptions(args.host, args.serve, max(args.jobs, 0) if args.jobs is not None else os.cpu_count() or 1,
+                             args.max_request_bytes, args.max_output_nodes, engine=args.engine,
+                             pruning=pruning or PruningPolicy()))
+        return
+
+    if args.from_index:
+        if args.watch or args.merge or args.index or args.input_files or args.jobs is not None:
+            parser.error("--from-index cannot be combined with input files, --watch, --merge, --index or --jobs")
+        expand_index(args.from_index, dry_run=args.dry_run, engine=args.engine, output_encoding=args.output_encoding,
+                     output_format=args.output_format, pruning=pruning, incremental=args.incremental,
+                     max_positions=args.max_positions)
+        return
+
+    if args.watch:
+        if args.merge or args.index or args.jobs is not None:
+            parser.error("--watch cannot be combined with --merge, --index or --jobs")
+        # パース結果をメモリに残し、同じ内容に戻ったファイルなどはパースし直さない
+        process = functools.partial(process_file, dry_run=args.dry_run, engine=args.engine, cache=MemoryParseCache(cache),
+                                    output_encoding=args.output_encoding, metrics_options=metrics_options,
+                                    output_format=args.output_format, pruning=pruning, incremental=args.incremental)
+        watch(DirectoryWatcher(args.watch, args.debounce, exclude=is_output_file), process, args.poll_interval)
+        return
+
     files_to_process = args.input_files
     if not files_to_process:
         for f in ["ShogiSekai.ki2", "Test1.ki2"]:
@@ -151,8 +481,28 @@ def main():
         print("No input files found.")
         return
 
+    if args.merge:
+        process_merged(files_to_process, args.merge, args.header_from, dry_run=args.dry_run, engine=args.engine, cache=cache,
+                       output_encoding=args.output_encoding, metrics_options=metrics_options, output_format=args.output_format,
+                       pruning=pruning, incremental=args.incremental)
+        return
+
+    if args.index:
+        index_files(args.index, files_to_process, args.engine)
+        return
+
+    if args.jobs is not None:
+        start = time.perf_counter()
+        results = run_batch(process_file, files_to_process, max(args.jobs, 1), dry_run=args.dry_run, engine=args.engine, cache=cache,
+                            output_encoding=args.output_encoding, metrics_options=metrics_options,
+                            output_format=args.output_format, pruning=pruning, incremental=args.incremental)
+        print_batch_summary(results, time.perf_counter() - start)
+        return
+
     for f in files_to_process:
-        process_file(f)
+        process_file(f, dry_run=args.dry_run, engine=args.engine, cache=cache, output_encoding=args.output_encoding,
+                     metrics_options=metrics_options, output_format=args.output_format, pruning=pruning,
+                     incremental=args.incremental)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,25 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import shogi
+
+from logic.graph import PositionGraph
+from logic.position import get_board_key
+
+def move_map_from_lines(lines: Iterable[Sequence[str]],
+                        comments: Optional[Dict[str, List[str]]] = None) -> Dict[int, Dict[str, List[str]]]:
+    """平手から指した USI の手順の一覧を move_map（局面キー -> { USI -> コメント }）にする。comments は USI -> コメント。"""
+    board = shogi.Board()
+    move_map: Dict[int, Dict[str, List[str]]] = {}
+    for line in lines:
+        for usi in line:
+            move_map.setdefault(get_board_key(board), {}).setdefault(usi, list((comments or {}).get(usi, [])))
+            board.push_usi(usi)
+        for _ in line:
+            board.pop()
+    return move_map
+
+def graph_from_lines(lines: Iterable[Sequence[str]],
+                     comments: Optional[Dict[str, List[str]]] = None) -> Tuple[shogi.Board, PositionGraph]:
+    """手順の一覧から (平手の盤面, 局面グラフ) を作る。"""
+    board = shogi.Board()
+    return board, PositionGraph.from_move_map(move_map_from_lines(lines, comments), board)
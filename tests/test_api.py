@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from contextlib import redirect_stdout
+from benchmarks.generator import GeneratorConfig, generate_ki2
+from logic.api import Expander, ExpansionTooLarge, expand_ki2
+from logic.pruning import PruningPolicy
+from logic.server import ServiceOptions, create_server
+from main import process_file
+
+KI2 = ("手合割：平手\n"
+       "▲７六歩 △３四歩 ▲２六歩 △８四歩\n"
+       "*合流\n\n"
+       "変化：1手目\n▲２六歩 △３四歩 ▲７六歩 △８四歩 ▲２五歩\n\n"
+       "変化：3手目\n▲６六歩\n")
+
+class TestApi(unittest.TestCase):
+    def test_matches_cli_output(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "a.ki2")
+            with open(path, 'w', encoding='cp932') as f:
+                f.write(KI2)
+            with redirect_stdout(io.StringIO()):
+                process_file(path)
+            with open(os.path.join(tmpdir, "a_expanded.ki2"), encoding='cp932') as f:
+                expected = f.read()
+        result = Expander().expand(KI2)
+        self.assertEqual(result.text, expected)
+        self.assertEqual(result.stats.confluence_points, 1)
+        self.assertEqual(result.stats.parse_errors, 0)
+        # バイト列は内容から文字コードを判定する
+        self.assertEqual(expand_ki2(KI2.encode('cp932')).text, expected)
+
+    def test_cache_formats_and_limits(self):
+        expander = Expander()
+        first = expander.expand(KI2)
+        self.assertFalse(first.stats.cached)
+        graph = expander.expand(KI2, 'json')
+        self.assertTrue(graph.stats.cached)
+        self.assertEqual(json.loads(graph.text)["header"], "手合割：平手")
+        pruned = expander.expand(KI2, pruning=PruningPolicy(max_copies=1), include_header=False)
+        self.assertLess(pruned.stats.nodes, first.stats.nodes)
+        self.assertFalse(pruned.text.startswith("手合割"))
+        with self.assertRaises(ExpansionTooLarge):
+            expander.expand(KI2, max_nodes=first.stats.nodes - 1)
+        self.assertEqual(expander.expand(KI2, max_nodes=first.stats.nodes).stats.nodes, first.stats.nodes)
+        self.assertEqual(expander.expand("▲７六歩 △５五角\n").stats.parse_errors, 1)
+
+class TestServer(unittest.TestCase):
+    def start(self, **options):
+        server, service = create_server(ServiceOptions(port=0, **options))
+        self.service = service
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(service.close)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def post(self, url: str, body: bytes):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+                return response.status, dict(response.headers), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, dict(e.headers), e.read()
+
+    def test_expand_and_errors(self):
+        base = self.start(jobs=0, max_request_bytes=1024)
+        status, headers, body = self.post(base + "/expand?encoding=cp932", KI2.encode('cp932'))
+        self.assertEqual(status, 200)
+        self.assertEqual(body.decode('cp932'), Expander().expand(KI2).text)
+        self.assertEqual(headers["X-KI2-Confluence-Points"], "1")
+        status, headers, _ = self.post(base + "/expand?max_copies=1", KI2.encode('cp932'))
+        self.assertEqual(headers["X-KI2-Cached"], "1")
+        self.assertEqual(self.post(base + "/expand?format=csv", b"x")[0], 400)
+        self.assertEqual(self.post(base + "/expand?depth=1", b"x")[0], 400)
+        self.assertEqual(self.post(base + "/expand", b"x" * 2048)[0], 413)
+        self.assertEqual(self.post(base + "/other", b"x")[0], 404)
+        with urllib.request.urlopen(base + "/health") as response:
+            self.assertEqual(json.loads(response.read())["status"], "ok")
+
+    def test_worker_pool(self):
+        base = self.start(jobs=1, max_output_nodes=5)
+        status, _, body = self.post(base + "/expand", KI2.encode('utf-8'))
+        self.assertEqual(status, 413)
+        self.assertIn("more than 5 nodes", json.loads(body)["error"])
+        # 上限を超えた後もワーカーは使える
+        status, headers, _ = self.post(base + "/expand?max_nodes=5", KI2.encode('utf-8'))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["X-KI2-Nodes"], "5")
+
+    def test_timeout_keeps_slot_until_worker_finishes(self):
+        base = self.start(jobs=1, timeout=0.01, max_output_nodes=None)
+        service = self.service
+        text = generate_ki2(GeneratorConfig(variations=60, transposition_rate=0.1))
+        status, _, _ = self.post(base + "/expand", text.encode('utf-8'))
+        self.assertEqual(status, 504)
+        # 応答した後もワーカーでの展開が終わるまで枠は使われたまま
+        self.assertEqual(service.in_progress, 1)
+        deadline = time.monotonic() + 30
+        while service.in_progress and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(service.in_progress, 0)
+
+if __name__ == '__main__':
+    unittest.main()
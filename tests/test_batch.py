@@ -0,0 +1,57 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from logic.batch import FileStats, print_batch_summary, run_batch
+from main import process_file
+
+def _failing_process(input_file: str) -> FileStats:
+    print(f"starting {input_file}")
+    raise ValueError("broken")
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_ki2(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='cp932') as f:
+            f.write(text)
+        return path
+
+    def test_run_batch_groups_output_and_collects_stats(self):
+        files = [
+            self.write_ki2("a.ki2", "手合割：平手\n▲７六歩 △３四歩 ▲２六歩\n\n変化：1手目\n▲２六歩 △３四歩 ▲７六歩\n"),
+            self.write_ki2("b.ki2", "手合割：平手\n▲２六歩 △８四歩\n"),
+        ]
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            results = run_batch(process_file, files, 2)
+        self.assertEqual([r.input_file for r in results], files)
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(results[0].confluence_points, 1)
+        self.assertEqual(results[0].nodes, 6)
+        self.assertEqual(results[1].nodes, 2)
+        output = buffer.getvalue()
+        # 各ファイルの出力はひとまとまりで表示される
+        for path in files:
+            block_start = output.index(f"--- Processing {path} ---")
+            self.assertIn("Done! Saved to", output[block_start:].split("--- Processing")[1])
+            self.assertTrue(os.path.exists(path.replace(".ki2", "_expanded.ki2")))
+
+    def test_run_batch_continues_past_failures(self):
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            results = run_batch(_failing_process, ["x.ki2", "y.ki2"], 2)
+            print_batch_summary(results, 0.0)
+        self.assertEqual([r.error for r in results], ["broken", "broken"])
+        self.assertIn("Error processing x.ki2: broken", buffer.getvalue())
+        self.assertIn("failed: 2", buffer.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import random
+import tempfile
+import unittest
+import shogi
+from logic.attacks import candidate_origins
+from logic.board import CompactBoard, new_board
+from logic.expander import expand_tree
+from extract_moves import extract_moves_from_ki2
+from tests.helpers import graph_from_lines
+
+def _all_moves():
+    for from_sq in range(81):
+        for to_sq in range(81):
+            yield shogi.Move(from_sq, to_sq)
+            yield shogi.Move(from_sq, to_sq, True)
+    for to_sq in range(81):
+        for piece_type in range(shogi.PAWN, shogi.KING):
+            yield shogi.Move(None, to_sq, False, piece_type)
+
+class TestCompactBoard(unittest.TestCase):
+    def assertSamePosition(self, compact, reference):
+        self.assertEqual(compact.sfen(), reference.sfen())
+        self.assertEqual(compact.zobrist_hash(), reference.zobrist_hash())
+        self.assertEqual(bytes(compact.pieces), bytes(reference.pieces))
+        self.assertEqual(compact.occupied[shogi.WHITE], reference.occupied[shogi.WHITE])
+
+    def test_random_games_match_python_shogi(self):
+        rng = random.Random(0)
+        for _ in range(3):
+            reference = shogi.Board()
+            compact = CompactBoard()
+            for ply in range(80):
+                legal = set(reference.legal_moves)
+                if ply % 10 == 0:
+                    self.assertEqual({m for m in _all_moves() if compact.is_legal(m)}, legal, reference.sfen())
+                    for to_sq in range(81):
+                        for piece_type in (shogi.GOLD, shogi.ROOK, shogi.KNIGHT, shogi.PROM_BISHOP):
+                            self.assertEqual(
+                                compact.candidate_origins(reference.turn, piece_type, to_sq),
+                                candidate_origins(reference, reference.turn, piece_type, to_sq))
+                if not legal:
+                    break
+                move = rng.choice(sorted(legal, key=lambda m: m.usi()))
+                reference.push(move)
+                compact.push(move)
+                self.assertSamePosition(compact, reference)
+            while reference.move_stack:
+                self.assertEqual(compact.pop(), reference.pop())
+                self.assertSamePosition(compact, reference)
+
+    def test_sfen_roundtrip(self):
+        for sfen in ["4k4/9/4P4/9/9/9/9/4p4/4K4 w 10P2s 5",
+                     "ln1g1g1nl/1ks2r3/1pppp1bpp/p3spp2/9/P1P1SP1PP/1PBPP1P2/1KS2R3/LN1G1G1NL b - 1",
+                     "8l/4+R2k1/6+Bp1/9/9/9/9/9/K8 b GSNL 1"]:
+            reference = shogi.Board(sfen)
+            self.assertSamePosition(CompactBoard(sfen), reference)
+            self.assertEqual({m for m in _all_moves() if CompactBoard(sfen).is_legal(m)}, set(reference.legal_moves))
+
+    def test_pawn_drop_mate_is_illegal(self):
+        board = CompactBoard("7nk/7p1/8G/9/9/9/9/9/K8 b P 1")
+        self.assertFalse(board.is_legal(shogi.Move.from_usi("P*1b")))
+        self.assertFalse(board.is_drop_possible(shogi.PAWN, shogi.Move.from_usi("P*1b").to_square))
+        # 玉の逃げ道があれば打ち歩詰めではない
+        board = CompactBoard("8k/9/8G/9/9/9/9/9/K8 b P 1")
+        self.assertTrue(board.is_legal(shogi.Move.from_usi("P*1b")))
+
+    def test_expand_tree_same_with_compact_engine(self):
+        _, graph = graph_from_lines((["7g7f", "3c3d", "2g2f"], ["2g2f", "3c3d", "7g7f", "8c8d"], ["7g7f", "8c8d", "8h2b+", "3a2b"]))
+        self.assertEqual(expand_tree(CompactBoard(), graph), expand_tree(shogi.Board(), graph))
+
+    def test_extract_with_compact_engine(self):
+        text = "手合割：平手\n▲７六歩 △３四歩 ▲２二角成 △同　銀 ▲５五角\n\n変化：3手目\n▲２六歩 △８四歩\n"
+        with tempfile.NamedTemporaryFile('w', suffix='.ki2', encoding='cp932', delete=False) as f:
+            f.write(text)
+        try:
+            graphs = [extract_moves_from_ki2(f.name, engine=engine)[0] for engine in ('python-shogi', 'compact')]
+        finally:
+            os.unlink(f.name)
+        reference, compact = graphs
+        self.assertEqual(len(reference), 8)
+        self.assertEqual(list(compact.keys), list(reference.keys))
+        self.assertEqual(list(compact.edge_moves), list(reference.edge_moves))
+        self.assertEqual(list(compact.edge_targets), list(reference.edge_targets))
+
+    def test_new_board_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            new_board("unknown")
+
+if __name__ == '__main__':
+    unittest.main()
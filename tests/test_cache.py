@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from logic.cache import CachedParse, MemoryParseCache, ParseCache, dump_parse, load_parse
+from logic.position import PositionKeys
+from main import load_or_parse
+from tests.helpers import graph_from_lines
+
+def _sample_parse() -> CachedParse:
+    _, graph = graph_from_lines((["7g7f", "3c3d", "2g2f"], ["2g2f", "3c3d", "7g7f"]), {"3c3d": ["コメント 3c3d"]})
+    arrival_info = {graph.keys[-1]: {"▲２六歩": ("▲７六歩", "△３四歩", "▲２六歩"), "▲７六歩": ("▲２六歩", "△３四歩", "▲７六歩")}}
+    return CachedParse(graph, arrival_info, "先手：A\n後手：B", {graph.keys[-1]: "sfen 1"})
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameParse(self, loaded: CachedParse, parsed: CachedParse):
+        for name in ("keys", "edge_offsets", "edge_moves", "edge_targets", "comments"):
+            self.assertEqual(getattr(loaded.graph, name), getattr(parsed.graph, name))
+        self.assertEqual(loaded.arrival_info, parsed.arrival_info)
+        self.assertEqual(loaded.header, parsed.header)
+        self.assertEqual(loaded.sfens, parsed.sfens)
+
+    def test_dump_load_roundtrip(self):
+        parsed = _sample_parse()
+        buffer = io.BytesIO()
+        dump_parse(buffer, parsed)
+        buffer.seek(0)
+        self.assertSameParse(load_parse(buffer), parsed)
+
+    def test_hit_miss_and_parser_version(self):
+        cache = ParseCache(self.tmpdir, parser_version=1)
+        parsed = _sample_parse()
+        cache.store(b"content", parsed)
+        self.assertSameParse(cache.load(b"content"), parsed)
+        self.assertIsNone(cache.load(b"edited content"))
+        self.assertIsNone(ParseCache(self.tmpdir, parser_version=2).load(b"content"))
+
+    def test_corrupt_entry_is_a_miss(self):
+        cache = ParseCache(self.tmpdir)
+        cache.store(b"content", _sample_parse())
+        with open(cache.entry_path(b"content"), 'r+b') as f:
+            f.truncate(20)
+        self.assertIsNone(cache.load(b"content"))
+
+    def test_eviction_removes_least_recently_used(self):
+        cache = ParseCache(self.tmpdir)
+        parsed = _sample_parse()
+        cache.store(b"old", parsed)
+        os.utime(cache.entry_path(b"old"), (1, 1))
+        cache.store(b"new", parsed)
+        cache.max_bytes = os.path.getsize(cache.entry_path(b"new"))
+        cache.evict()
+        self.assertIsNone(cache.load(b"old"))
+        self.assertIsNotNone(cache.load(b"new"))
+        self.assertEqual(cache.clear(), 1)
+
+    def test_memory_cache_keeps_recent_entries_and_uses_backing(self):
+        backing = ParseCache(self.tmpdir)
+        backing.store(b"on disk", _sample_parse())
+        cache = MemoryParseCache(backing, max_entries=2)
+        parsed = _sample_parse()
+        cache.store(b"a", parsed)
+        self.assertIs(cache.load(b"a"), parsed)
+        self.assertSameParse(backing.load(b"a"), parsed)
+        # ディスクから読んだものもメモリに残る
+        self.assertIsNotNone(cache.load(b"on disk"))
+        self.assertEqual(len(cache), 2)
+        cache.store(b"b", parsed)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(MemoryParseCache().load(b"a"))
+
+    def test_load_or_parse_parses_the_hashed_content(self):
+        path = os.path.join(self.tmpdir, "a.ki2")
+        original = "手合割：平手\n▲７六歩 △３四歩\n".encode('cp932')
+        with open(path, 'wb') as f:
+            f.write(original)
+
+        class EditingCache(MemoryParseCache):
+            # 内容を読んだ直後にファイルが書き換えられた状況を作る
+            def load(self, content):
+                with open(path, 'wb') as f:
+                    f.write("手合割：平手\n▲２六歩\n".encode('cp932'))
+                return super().load(content)
+
+        cache = EditingCache()
+        with redirect_stdout(io.StringIO()):
+            graph, _, _ = load_or_parse(path, PositionKeys(), cache=cache)
+        self.assertEqual(graph.edge_count, 2)
+        self.assertIs(MemoryParseCache.load(cache, original).graph, graph)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+import shogi
+from extract_moves import extract_moves_from_ki2
+from logic.corpus import CorpusIndex
+from logic.expander import expand_tree
+from logic.writer import write_expanded_ki2
+from main import expand_index
+
+class TestCorpusIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.corpus = CorpusIndex(os.path.join(self.tmpdir, "corpus.db"))
+
+    def tearDown(self):
+        self.corpus.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_ki2(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='cp932') as f:
+            f.write(text)
+        return path
+
+    def test_subgraph_matches_parsed_graph(self):
+        path = self.write_ki2("a.ki2", "手合割：平手\n▲７六歩 △３四歩 ▲２六歩\n*コメント\n\n変化：1手目\n▲２六歩 △３四歩 ▲７六歩 △８四歩\n")
+        self.assertEqual(self.corpus.add_file(path), 7)
+        graph, _ = extract_moves_from_ki2(path)
+        subgraph = self.corpus.subgraph(shogi.Board())
+        # 局面IDの振り方は読み出し順で変わるので、辺の集合とコメントで比べる
+        def edge_set(g):
+            return {(g.keys[pos], g.edge_moves[e], g.keys[g.edge_targets[e]], g.edge_comments(e))
+                    for pos in range(len(g)) for e in g.edges(pos)}
+        self.assertEqual(edge_set(subgraph), edge_set(graph))
+        self.assertEqual(expand_tree(shogi.Board(), self.corpus), expand_tree(shogi.Board(), graph))
+        self.assertIsNone(self.corpus.add_file(path))
+
+    def test_union_of_files_and_reindex(self):
+        a = self.write_ki2("a.ki2", "▲７六歩 △３四歩 ▲２六歩\n")
+        b = self.write_ki2("b.ki2", "▲２六歩 △３四歩 ▲７六歩 △８四歩\n")
+        self.assertEqual(self.corpus.add_files([a, b]), (2, 0))
+        board = shogi.Board()
+        for usi in ("7g7f", "3c3d", "2g2f"):
+            board.push_usi(usi)
+        # 合流後の局面からは b の続きだけが見える
+        tree = expand_tree(board, self.corpus)
+        self.assertEqual([node.ki2_str for node in tree], ["８四歩"])
+
+        self.write_ki2("b.ki2", "▲２六歩 △８四歩\n")
+        self.assertEqual(self.corpus.add_file(b), 2)
+        self.assertEqual(expand_tree(board, self.corpus), ())
+        self.assertEqual(self.corpus.counts(), (2, 6, 5))
+
+    def test_max_positions_leaves_deeper_positions_unread(self):
+        path = self.write_ki2("a.ki2", "▲７六歩 △３四歩 ▲２六歩 △８四歩\n")
+        self.corpus.add_file(path)
+        # 続きを読むのは初期局面と ▲７六歩 の後だけで、△３四歩 の後は葉になる
+        graph = self.corpus.subgraph(shogi.Board(), max_positions=2)
+        self.assertEqual(len(graph), 3)
+        self.assertEqual([node.ki2_str for node in expand_tree(shogi.Board(), graph)[0].branches], ["３四歩"])
+        self.assertEqual(expand_tree(shogi.Board(), graph)[0].branches[0].branches, ())
+        self.assertEqual(len(self.corpus.subgraph(shogi.Board(), max_positions=None)), 5)
+
+    def test_expand_index_writes_expanded_ki2(self):
+        path = self.write_ki2("a.ki2", "手合割：平手\n▲７六歩 △３四歩 ▲２六歩\n\n変化：1手目\n▲２六歩 △３四歩 ▲７六歩 △８四歩\n")
+        self.corpus.add_file(path)
+        self.corpus.close()
+        with redirect_stdout(io.StringIO()):
+            stats = expand_index(self.corpus.path)
+        self.assertEqual(stats.nodes, 8)
+        with open(os.path.join(self.tmpdir, "corpus_expanded.ki2"), encoding='cp932') as f:
+            text = f.read()
+        graph, _ = extract_moves_from_ki2(path)
+        expected = io.StringIO()
+        write_expanded_ki2(expected, shogi.Board(), graph)
+        self.assertEqual(text, "手合割：平手\n\n" + expected.getvalue())
+        self.corpus = CorpusIndex(self.corpus.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from extract_moves import parse_ki2
+from logic.encoding import SNIFF_SIZE, detect_encoding, detect_file_encoding
+from main import process_file
+
+KI2_TEXT = "開始日時：2024/01/01\n手合割：平手\n▲７六歩 △３四歩 ▲２二角成 △同　銀\n*角交換\n\n変化：2手目\n△８四歩 ▲２六歩\n"
+
+class TestEncoding(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_detect_encoding(self):
+        self.assertEqual(detect_encoding(KI2_TEXT.encode('cp932')), 'cp932')
+        self.assertEqual(detect_encoding(KI2_TEXT.encode('utf-8')), 'utf-8')
+        self.assertEqual(detect_encoding(KI2_TEXT.encode('utf-8-sig')), 'utf-8-sig')
+        self.assertEqual(detect_encoding(KI2_TEXT.encode('utf-16')), 'utf-16')
+        self.assertEqual(detect_encoding(b"abc"), 'cp932')
+        # 先頭の読み込みが文字の途中で切れていても UTF-8 と判定する
+        self.assertEqual(detect_encoding("手合割".encode('utf-8')[:-1]), 'utf-8')
+        self.assertEqual(detect_encoding("手合割".encode('utf-8')[:-1], complete=True), 'cp932')
+
+    def test_detect_after_long_ascii_prefix(self):
+        path = self.write("long.ki2u", b"#" * (SNIFF_SIZE * 3) + "\n手合割：平手\n".encode('utf-8'))
+        self.assertEqual(detect_file_encoding(path), 'utf-8')
+
+    def test_parse_same_graph_in_every_encoding(self):
+        results = []
+        for name, encoding in (("a.ki2", 'cp932'), ("b.ki2u", 'utf-8'), ("c.ki2", 'utf-8-sig')):
+            path = self.write(name, KI2_TEXT.encode(encoding))
+            output = io.StringIO()
+            with redirect_stdout(output):
+                graph, arrival_info, header = parse_ki2(path)
+            self.assertNotIn("Warning", output.getvalue())
+            results.append((list(graph.keys), list(graph.edge_moves), graph.comments, arrival_info, header))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(results[0][4], "開始日時：2024/01/01\n手合割：平手")
+
+    def test_multibyte_characters_across_decode_chunks(self):
+        # チャンクの境界にまたがる全角文字を含む大きな UTF-8 ファイル
+        comments = [f"{i}{'あ' * (i % 97 + 1)}" for i in range(2000)]
+        text = "手合割：平手\n▲７六歩\n" + "".join(f"*{c}\n" for c in comments) + "△３四歩\n"
+        path = self.write("big.ki2u", text.encode('utf-8'))
+        with redirect_stdout(io.StringIO()):
+            graph, _, _ = parse_ki2(path)
+        self.assertEqual(len(graph), 3)
+        self.assertEqual([c for cs in graph.comments.values() for c in cs], comments)
+
+    def test_warns_about_undecodable_bytes(self):
+        path = self.write("broken.ki2", KI2_TEXT.encode('cp932').replace("角交換".encode('cp932'), b"\x81\xff"))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            parse_ki2(path)
+        self.assertIn("Warning: 1 undecodable characters", output.getvalue())
+
+    def test_output_encoding_follows_input_unless_given(self):
+        path = self.write("game.ki2u", KI2_TEXT.encode('utf-8'))
+        output = os.path.join(self.tmpdir, "game_expanded.ki2u")
+        with redirect_stdout(io.StringIO()):
+            process_file(path, cache=None)
+        with open(output, 'rb') as f:
+            self.assertIn("手合割：平手".encode('utf-8'), f.read())
+        with redirect_stdout(io.StringIO()):
+            process_file(path, cache=None, output_encoding='cp932')
+        with open(output, 'rb') as f:
+            self.assertIn("手合割：平手".encode('cp932'), f.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import unittest
+from logic.estimate import estimate_expansion
+from logic.position import get_board_key
+from logic.writer import write_expanded_ki2
+from tests.helpers import graph_from_lines
+
+class TestEstimate(unittest.TestCase):
+    def assert_matches_output(self, board, graph, header):
+        buffer = io.StringIO()
+        buffer.write(header + "\n\n")
+        nodes = write_expanded_ki2(buffer, board, graph)
+        text = buffer.getvalue()
+        estimate = estimate_expansion(board, graph, header)
+        self.assertEqual(estimate.nodes, nodes)
+        self.assertEqual(estimate.lines, len(text.splitlines()))
+        self.assertEqual(estimate.approx_bytes, len(text.encode('cp932')))
+        for encoding in ('utf-8', 'utf-8-sig', 'utf-16'):
+            self.assertEqual(estimate_expansion(board, graph, header, encoding=encoding).approx_bytes,
+                             len(text.encode(encoding)), encoding)
+        return estimate
+
+    def test_transposition_multiplicity(self):
+        board, graph = graph_from_lines(
+            [["7g7f", "3c3d", "2g2f", "8c8d"], ["2g2f", "3c3d", "7g7f", "4a3b"]],
+            {"8c8d": ["note"], "4a3b": ["end"]})
+        estimate = self.assert_matches_output(board, graph, "手合割：平手")
+        for usi in ["7g7f", "3c3d", "2g2f"]:
+            board.push_usi(usi)
+        confluence = graph.position_id(get_board_key(board))
+        self.assertEqual(estimate.multiplicity[confluence], 2)
+
+    def test_cycle_is_cut_per_path(self):
+        # 玉の往復で初期局面に戻る循環と、途中からの分岐
+        board, graph = graph_from_lines([["5i4h", "5a4b", "4h5i", "4b5a", "7g7f"], ["5i4h", "5a4b", "2g2f"]])
+        estimate = self.assert_matches_output(board, graph, "")
+        # 初期局面は根と、循環で打ち切られた △５一玉 の2回現れる
+        self.assertEqual(estimate.multiplicity[graph.position_id(get_board_key(board))], 2)
+        board.push_usi("5i4h")
+        self.assertEqual(estimate.multiplicity[graph.position_id(get_board_key(board))], 1)
+
+    def test_repetition_below_transposition(self):
+        # 合流局面の先で玉が往復し、飛車を振った局面に戻る
+        board, graph = graph_from_lines([
+            ["7g7f", "3c3d", "2g2f", "8c8d", "2h3h", "5a4b", "5i4h", "4b5a", "4h5i", "7a6b"],
+            ["2g2f", "3c3d", "7g7f", "8c8d"],
+        ], {"7a6b": ["end"]})
+        estimate = self.assert_matches_output(board, graph, "手合割：平手")
+        for usi in ["2g2f", "3c3d", "7g7f", "8c8d", "2h3h"]:
+            board.push_usi(usi)
+        # 循環の入口（▲３八飛の後）は2つの経路それぞれで、入口と玉の往復で戻った先の2回ずつ現れる
+        self.assertEqual(estimate.multiplicity[graph.position_id(get_board_key(board))], 4)
+        for _ in range(5):
+            board.pop()
+
+    def test_max_nodes_stops_early(self):
+        board, graph = graph_from_lines([["5i4h", "5a4b", "4h5i", "4b5a", "7g7f"], ["5i4h", "5a4b", "2g2f"]])
+        nodes = estimate_expansion(board, graph).nodes
+        self.assertEqual(estimate_expansion(board, graph, max_nodes=nodes).nodes, nodes)
+        self.assertIsNone(estimate_expansion(board, graph, max_nodes=nodes - 1))
+
+if __name__ == '__main__':
+    unittest.main()
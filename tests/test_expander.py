@@ -1,7 +1,13 @@
+import io
+import sys
 import unittest
 import shogi
-from logic.expander import get_ki2_move_str, expand_tree
+from logic.expander import get_ki2_move_str, expand_tree, count_tree_nodes
+from logic.graph import PositionGraphBuilder, encode_move
+from logic.writer import write_expanded_ki2
+from main import format_as_ki2_text
 from extract_moves import get_board_key
+from tests.helpers import move_map_from_lines
 
 class TestExpander(unittest.TestCase):
     def test_get_ki2_move_str_basic(self):
@@ -25,6 +31,15 @@ class TestExpander(unittest.TestCase):
         ki2_str = get_ki2_move_str(board, move_dou)
         self.assertEqual(ki2_str, "同　銀")
 
+    def test_get_ki2_move_str_relative_and_fundari(self):
+        # 敵陣に入る歩は成か不成かを明示する
+        board = shogi.Board("4k4/9/9/2P6/9/9/9/9/4K4 b - 1")
+        self.assertEqual(get_ki2_move_str(board, shogi.Move.from_usi("7d7c")), "７三歩不成")
+        self.assertEqual(get_ki2_move_str(board, shogi.Move.from_usi("7d7c+")), "７三歩成")
+        # 二枚の金が同じマスに行ける場合
+        board = shogi.Board("4k4/9/9/9/9/9/9/9/3GKG3 b - 1")
+        self.assertEqual(get_ki2_move_str(board, shogi.Move.from_usi("6i5h")), "５八金左上")
+
     def test_expand_tree_simple(self):
         board = shogi.Board()
         # Mock move_map: { sfen_key: { usi: comments } }
@@ -38,9 +53,87 @@ class TestExpander(unittest.TestCase):
         
         tree = expand_tree(board, move_map)
         self.assertEqual(len(tree), 2)
-        moves = [t['ki2_str'] for t in tree]
+        moves = [t.ki2_str for t in tree]
         self.assertIn("７六歩", moves)
         self.assertIn("２六歩", moves)
 
+    def test_expand_tree_memoized_matches_full(self):
+        board = shogi.Board()
+        move_map = move_map_from_lines((["7g7f", "3c3d", "2g2f", "8c8d", "2f2e"], ["2g2f", "3c3d", "7g7f", "8c8d", "6i7h"]))
+
+        def strip(tree):
+            return [(n.ki2_str, strip(n.branches)) for n in tree]
+
+        full = expand_tree(board, move_map)
+        memoized = expand_tree(board, move_map, memoize=True)
+        self.assertEqual(strip(full), strip(memoized))
+        # 合流局面（▲７六歩△３四歩▲２六歩）の直後は直前の手が異なるので別扱い、
+        # △８四歩以降は同じ文脈となり部分木が共有される
+        via_76 = memoized[1].branches[0].branches[0].branches
+        via_26 = memoized[0].branches[0].branches[0].branches
+        self.assertIsNot(via_76, via_26)
+        self.assertIs(via_76[0].branches, via_26[0].branches)
+
+    def test_memoized_shares_subtree_above_repetition(self):
+        board = shogi.Board()
+        # 合流局面（８四歩の後）の先で、４一金→３二金の後に玉が往復して同じ局面に戻る
+        move_map = move_map_from_lines((
+            ["7g7f", "3c3d", "2g2f", "8c8d", "6i7h", "4a3b", "5i5h", "5a5b", "5h5i", "5b5a"],
+            ["2g2f", "3c3d", "7g7f", "8c8d"],
+        ))
+
+        def strip(tree):
+            return [(n.ki2_str, strip(n.branches)) for n in tree]
+
+        full = expand_tree(board, move_map)
+        memoized = expand_tree(board, move_map, memoize=True)
+        self.assertEqual(strip(full), strip(memoized))
+        self.assertEqual(count_tree_nodes(memoized), count_tree_nodes(full))
+        # 循環に到達するが循環の上にはない局面の部分木は共有される
+        via_26 = memoized[0].branches[0].branches[0].branches[0]
+        via_76 = memoized[1].branches[0].branches[0].branches[0]
+        self.assertEqual(via_26.usi, "8c8d")
+        self.assertIs(via_26.branches, via_76.branches)
+
+    def test_tree_nodes_share_notation(self):
+        board = shogi.Board()
+        move_map = move_map_from_lines((["7g7f", "3c3d", "2g2f", "8c8d"], ["2g2f", "3c3d", "7g7f", "8c8d"]), {"8c8d": ["c"]})
+        tree = expand_tree(board, move_map)
+        # 合流局面の後の△８四歩は2つの経路に複製されるが、表記とコメントは同じオブジェクトを使う
+        first = tree[0].branches[0].branches[0].branches[0]
+        second = tree[1].branches[0].branches[0].branches[0]
+        self.assertEqual(first.usi, "8c8d")
+        self.assertIsNot(first, second)
+        self.assertIs(first.ki2_str, second.ki2_str)
+        self.assertIs(first.comments, second.comments)
+        self.assertEqual(first.branches, ())
+        self.assertFalse(hasattr(first, '__dict__'))
+
+    def test_deep_line_does_not_recurse(self):
+        # 玉の往復で再帰上限を超える長さの手順を作る（局面キーは手数ごとに別扱い）
+        plies = sys.getrecursionlimit() + 100
+        cycle = ["5i4h", "5a4b", "4h5i", "4b5a"]
+        board = shogi.Board()
+        builder = PositionGraphBuilder()
+        src = builder.intern(get_board_key(board))
+        for ply in range(plies):
+            dst = builder.intern(ply + 1)
+            builder.add_edge(src, encode_move(shogi.Move.from_usi(cycle[ply % 4])), dst)
+            if ply % 4 == 0:
+                # 深い位置にも変化を入れる
+                builder.add_edge(src, encode_move(shogi.Move.from_usi("5i5h")), builder.intern(plies + ply + 1))
+            src = dst
+        graph = builder.build()
+        variations = (plies + 3) // 4
+
+        tree = expand_tree(board, graph)
+        self.assertEqual(count_tree_nodes(tree), plies + variations)
+        self.assertEqual(format_as_ki2_text(tree).count("変化："), variations)
+
+        buffer = io.StringIO()
+        self.assertEqual(write_expanded_ki2(buffer, board, graph), plies + variations)
+        self.assertEqual(buffer.getvalue(), format_as_ki2_text(tree))
+        self.assertEqual(len(board.move_stack), 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,30 @@
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from benchmarks.generator import GeneratorConfig, generate_ki2
+from extract_moves import parse_ki2
+
+class TestGenerator(unittest.TestCase):
+    def test_deterministic_and_parseable(self):
+        config = GeneratorConfig(main_length=40, variations=30, transposition_rate=0.3, comment_rate=0.2, seed=3)
+        text = generate_ki2(config)
+        self.assertEqual(text, generate_ki2(config))
+        self.assertNotEqual(text, generate_ki2(config._replace(seed=4)))
+        with tempfile.NamedTemporaryFile('w', suffix='.ki2', encoding='cp932', delete=False) as f:
+            f.write(text)
+        try:
+            output = io.StringIO()
+            with redirect_stdout(output):
+                graph, arrival_info, _ = parse_ki2(f.name)
+        finally:
+            os.unlink(f.name)
+        self.assertIn("Errors: 0", output.getvalue())
+        self.assertEqual(text.count("変化："), 30)
+        self.assertTrue(graph.comments)
+        # 手順前後の変化で合流局面ができる
+        self.assertTrue(any(len(arrivals) > 1 for arrivals in arrival_info.values()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import shogi
+from logic.graph import PositionGraph, PositionGraphBuilder, encode_move, decode_move
+from logic.position import get_board_key
+
+class TestGraph(unittest.TestCase):
+    def test_move_code_roundtrip(self):
+        for usi in ["7g7f", "8h2b+", "P*5e", "R*1a", "1i1a"]:
+            move = shogi.Move.from_usi(usi)
+            code = encode_move(move)
+            self.assertLess(code, 1 << 16)
+            self.assertEqual(decode_move(code).usi(), usi)
+
+    def test_edges_sorted_with_comment_table(self):
+        builder = PositionGraphBuilder()
+        root = builder.intern(1)
+        e1 = builder.add_edge(root, encode_move(shogi.Move.from_usi("7g7f")), builder.intern(2))
+        builder.add_edge(root, encode_move(shogi.Move.from_usi("2g2f")), builder.intern(3))
+        builder.add_comment(e1, "Start with pawn")
+        builder.add_comment(e1, "Start with pawn")
+        self.assertEqual(builder.add_edge(root, encode_move(shogi.Move.from_usi("7g7f")), 2), e1)
+
+        graph = builder.build()
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(graph.edge_count, 2)
+        edges = list(graph.edges(graph.position_id(1)))
+        self.assertEqual([decode_move(graph.edge_moves[e]).usi() for e in edges], ["2g2f", "7g7f"])
+        self.assertEqual(graph.edge_comments(edges[0]), ())
+        self.assertEqual(graph.edge_comments(edges[1]), ("Start with pawn",))
+        self.assertEqual(graph.keys[graph.edge_targets[edges[1]]], 2)
+
+    def test_from_move_map(self):
+        board = shogi.Board()
+        move_map = {get_board_key(board): {"7g7f": [], "2g2f": ["note"]}}
+        graph = PositionGraph.from_move_map(move_map, board)
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(len(board.move_stack), 0)
+
+    def test_on_cycle(self):
+        builder = PositionGraphBuilder()
+        a, b, c, d, e = (builder.intern(k) for k in (10, 20, 30, 40, 50))
+        move = encode_move(shogi.Move.from_usi("7g7f"))
+        builder.add_edge(a, move, b)
+        builder.add_edge(b, move, c)
+        builder.add_edge(c, move, b)
+        builder.add_edge(c, encode_move(shogi.Move.from_usi("2g2f")), d)
+        builder.add_edge(a, encode_move(shogi.Move.from_usi("2g2f")), e)
+        builder.add_edge(e, move, e)
+        # 循環に到達するだけの局面（a）や循環の先の局面（d）は含まない。自分自身への手は循環
+        self.assertEqual(list(builder.build().on_cycle()), [0, 1, 1, 0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
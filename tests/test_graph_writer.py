@@ -0,0 +1,42 @@
+import io
+import json
+import unittest
+import shogi
+from logic.graph_writer import write_graph_json, write_graph_ki2
+from tests.helpers import graph_from_lines
+
+def _transposition_graph():
+    """７六歩・３四歩・２六歩 と ２六歩・３四歩・７六歩 が合流する局面グラフ。"""
+    return graph_from_lines((["7g7f", "3c3d", "2g2f"], ["2g2f", "3c3d", "7g7f", "8c8d"], ["7g7f", "8c8d"]),
+                            {"8c8d": ["c 8c8d"]})
+
+class TestGraphWriter(unittest.TestCase):
+    def test_graph_ki2_writes_each_position_once(self):
+        board, graph = _transposition_graph()
+        buffer = io.StringIO()
+        written = write_graph_ki2(buffer, board, graph)
+        self.assertEqual(written, graph.edge_count)
+        self.assertEqual(buffer.getvalue(),
+                         "▲２六歩 △３四歩 ▲７六歩\n*#label 001\n△８四歩\n*c 8c8d\n\n"
+                         "変化：1手目\n▲７六歩 △３四歩 ▲２六歩\n*#merge 001\n\n"
+                         "変化：2手目\n△８四歩\n*c 8c8d\n")
+        self.assertEqual(len(board.move_stack), 0)
+
+    def test_graph_json(self):
+        board, graph = _transposition_graph()
+        buffer = io.StringIO()
+        written = write_graph_json(buffer, board, graph, header="手合割：平手")
+        data = json.loads(buffer.getvalue())
+        self.assertEqual(written, graph.edge_count)
+        self.assertEqual(data["header"], "手合割：平手")
+        positions = {p["id"]: p for p in data["positions"]}
+        self.assertEqual(len(positions), len(graph))
+        root = positions[data["root"]]
+        self.assertEqual(root["sfen"], shogi.Board().sfen())
+        self.assertEqual([m["usi"] for m in root["moves"]], ["2g2f", "7g7f"])
+        self.assertEqual(root["moves"][1]["ki2"], "７六歩")
+        self.assertEqual(sum(p["confluence"] for p in positions.values()), 1)
+        self.assertEqual(len(board.move_stack), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from logic.incremental import index_path, open_previous, save_index, write_incremental_ki2
+from logic.writer import write_expanded_ki2
+from tests.helpers import graph_from_lines
+
+LINES = [
+    ["7g7f", "3c3d", "2g2f", "8c8d", "2f2e", "8d8e"],
+    ["2g2f", "3c3d", "7g7f", "8c8d", "6i7h"],
+    ["2g2f", "8c8d", "7g7f", "3c3d"],
+]
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.directory, "out_expanded.ki2")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_incremental(self, lines, encoding='cp932'):
+        """main.py と同じ手順で、前回の出力と索引を使って書き出し、(出力, 統計) を返す。"""
+        board, graph = graph_from_lines(lines, {"8c8d": ["c 8c8d"]})
+        previous, previous_output = open_previous(self.output_file)
+        tmp_file = self.output_file + ".tmp"
+        with open(tmp_file, 'w', encoding=encoding) as f:
+            f.write("手合割：平手\n\n")
+            written, index, stats = write_incremental_ki2(f, board, graph, None, previous, previous_output)
+            size = f.tell()
+        if previous_output is not None:
+            previous_output.close()
+        os.replace(tmp_file, self.output_file)
+        save_index(index_path(self.output_file), index._replace(output_size=size))
+        self.assertEqual(len(board.move_stack), 0)
+
+        expected = io.StringIO()
+        expected.write("手合割：平手\n\n")
+        self.assertEqual(written, write_expanded_ki2(expected, board, graph))
+        with open(self.output_file, encoding=encoding) as f:
+            self.assertEqual(f.read(), expected.getvalue())
+        return written, stats
+
+    def test_unchanged_graph_is_copied(self):
+        written, stats = self.run_incremental(LINES)
+        self.assertEqual(stats.reused_nodes, 0)
+        _, stats = self.run_incremental(LINES)
+        self.assertEqual(stats.changed_positions, 0)
+        self.assertEqual(stats.reused_nodes, written)
+
+    def test_appended_variation(self):
+        self.run_incremental(LINES)
+        self.run_incremental(LINES)
+        # 全体を写した回の後でも、内側の局面の断片が索引に残っている
+        _, stats = self.run_incremental(LINES + [["7g7f", "3c3d", "2g2f", "4a3b"]])
+        self.assertGreater(stats.changed_positions, 0)
+        self.assertGreater(stats.reused_nodes, 0)
+
+    def test_new_move_at_confluence(self):
+        self.run_incremental(LINES)
+        # 合流局面に手を足すと、そこへ至る局面は展開し直し、合流局面の先の既存の続きは写す
+        _, stats = self.run_incremental(LINES + [["2g2f", "3c3d", "7g7f", "8c8d", "2h2f"]])
+        # 手を足した合流局面と、新しい末端の局面
+        self.assertEqual(stats.changed_positions, 2)
+        self.assertGreater(stats.reused_nodes, 0)
+
+    def test_modified_output_is_not_reused(self):
+        self.run_incremental(LINES)
+        with open(self.output_file, 'a', encoding='cp932') as f:
+            f.write("\n")
+        self.assertEqual(open_previous(self.output_file), (None, None))
+        _, stats = self.run_incremental(LINES)
+        self.assertEqual(stats.reused_nodes, 0)
+
+    def test_utf16_is_rendered_without_splicing(self):
+        self.run_incremental(LINES, 'utf-16')
+        _, stats = self.run_incremental(LINES, 'utf-16')
+        self.assertEqual(stats.reused_nodes, 0)
+
+if __name__ == '__main__':
+    unittest.main()
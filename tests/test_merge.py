@@ -0,0 +1,66 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+import shogi
+from extract_moves import extract_moves_from_ki2
+from logic.expander import expand_tree
+from logic.merge import merge_arrival_info, merge_graphs
+from main import format_as_ki2_text, process_file, process_merged
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_ki2(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='cp932') as f:
+            f.write(text)
+        return path
+
+    def test_merge_graphs_unions_cross_file_branches(self):
+        a = self.write_ki2("a.ki2", "手合割：平手\n▲７六歩 △３四歩 ▲２六歩 △８四歩\n*a のコメント\n")
+        b = self.write_ki2("b.ki2", "手合割：平手\n▲２六歩 △３四歩 ▲７六歩 △４四歩\n*b のコメント\n")
+        with redirect_stdout(io.StringIO()):
+            (graph_a, info_a), (graph_b, info_b) = extract_moves_from_ki2(a), extract_moves_from_ki2(b)
+        graph = merge_graphs([graph_a, graph_b, graph_a])
+        self.assertEqual(len(graph), 8)
+        self.assertEqual(graph.edge_count, 8)
+        text = format_as_ki2_text(expand_tree(shogi.Board(), graph))
+        # どちらの手順からも両方のファイルの続きが見える
+        self.assertEqual(text.count("△８四歩"), 2)
+        self.assertEqual(text.count("△４四歩"), 2)
+        self.assertEqual(text.count("a のコメント"), 2)
+        arrivals = merge_arrival_info([info_a, info_b])
+        self.assertEqual(sum(1 for a in arrivals.values() if len(a) > 1), 1)
+
+    def test_process_merged_writes_single_file(self):
+        a = self.write_ki2("a.ki2", "先手：A\n手合割：平手\n▲７六歩 △３四歩 ▲２六歩 △８四歩\n")
+        b = self.write_ki2("b.ki2", "先手：B\n手合割：平手\n▲２六歩 △３四歩 ▲７六歩\n")
+        output = os.path.join(self.tmpdir, "merged.ki2")
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            stats = process_merged([a, b], output, header_file=b)
+        self.assertIsNone(stats.error)
+        self.assertEqual(stats.confluence_points, 1)
+        self.assertEqual(stats.nodes, 8)
+        self.assertIn("[合流局面]", buffer.getvalue())
+        with open(output, encoding='cp932') as f:
+            self.assertTrue(f.read().startswith("先手：B\n手合割：平手\n\n▲２六歩"))
+
+    def test_merge_of_one_file_matches_process_file(self):
+        a = self.write_ki2("a.ki2", "手合割：平手\n▲７六歩 △３四歩 ▲２六歩\n\n変化：1手目\n▲２六歩 △３四歩 ▲７六歩 △８四歩\n")
+        output = os.path.join(self.tmpdir, "merged.ki2")
+        with redirect_stdout(io.StringIO()):
+            process_file(a)
+            process_merged([a], output)
+        with open(output, encoding='cp932') as merged, open(a.replace(".ki2", "_expanded.ki2"), encoding='cp932') as single:
+            self.assertEqual(merged.read(), single.read())
+
+if __name__ == '__main__':
+    unittest.main()
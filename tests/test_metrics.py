@@ -0,0 +1,64 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from logic.board import ENGINES, new_board
+from logic.metrics import COUNTERS, Metrics, MetricsOptions, counting_engine
+from main import process_file
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_counting_engine_counts_board_operations(self):
+        for engine in ('python-shogi', 'compact'):
+            name = counting_engine(engine)
+            self.assertIn(name, ENGINES)
+            self.assertEqual(counting_engine(name), name)
+            before = COUNTERS.copy()
+            board = new_board(name)
+            move = next(iter(new_board('python-shogi').legal_moves))
+            board.push(move)
+            board.sfen()
+            board.pop()
+            for counter in ('board_push', 'board_pop', 'sfen'):
+                self.assertEqual(COUNTERS[counter] - before[counter], 1, (engine, counter))
+            # python-shogi の is_legal は内部で push/pop するので、その分も数えられる
+            self.assertTrue(board.is_legal(move))
+            self.assertEqual(COUNTERS['legality_checks'] - before['legality_checks'], 1)
+
+    def test_phase_accumulates_and_transfers(self):
+        metrics = Metrics("x")
+        for _ in range(2):
+            with metrics.phase('expand'):
+                pass
+        self.assertIn('expand', metrics.phases)
+        seconds = metrics.phases['expand']['seconds']
+        metrics.transfer('expand', 'write', seconds)
+        self.assertAlmostEqual(metrics.phases['expand']['seconds'], 0.0)
+        self.assertAlmostEqual(metrics.phases['write']['seconds'], seconds)
+
+    def test_process_file_writes_metrics_json(self):
+        path = os.path.join(self.tmpdir, "a.ki2")
+        with open(path, 'w', encoding='cp932') as f:
+            f.write("手合割：平手\n▲７六歩 △３四歩 ▲２六歩\n\n変化：1手目\n▲２六歩 △３四歩 ▲７六歩\n")
+        metrics_dir = os.path.join(self.tmpdir, "metrics")
+        options = MetricsOptions(print_summary=False, json_dir=metrics_dir, cprofile_phase='parse')
+        with redirect_stdout(io.StringIO()):
+            stats = process_file(path, engine='compact', cache=None, metrics_options=options)
+        with open(os.path.join(metrics_dir, "a.ki2.metrics.json"), encoding='utf-8') as f:
+            data = json.load(f)
+        self.assertEqual(data['nodes'], stats.nodes)
+        self.assertEqual(set(data['phases']), {'parse', 'confluence', 'expand', 'write'})
+        self.assertEqual(data['counters']['tokenize_ki2_move_cache_hits'] + data['counters']['tokenize_ki2_move_cache_misses'], 6)
+        self.assertGreater(data['counters']['board_push'], 0)
+        self.assertTrue(os.path.exists(os.path.join(metrics_dir, "a.ki2.parse.prof")))
+
+if __name__ == '__main__':
+    unittest.main()
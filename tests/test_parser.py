@@ -1,6 +1,9 @@
+import os
+import tempfile
 import unittest
 import shogi
-from extract_moves import parse_ki2_move
+from extract_moves import parse_ki2, parse_ki2_move, tokenize_ki2_move
+from logic.expander import get_ki2_move_str
 
 class TestParser(unittest.TestCase):
     def test_parse_ki2_move_basic(self):
@@ -31,5 +34,45 @@ class TestParser(unittest.TestCase):
         self.assertEqual(move.usi(), "8h2b+")
         self.assertTrue(move.promotion)
 
+    def test_tokenize_ki2_move(self):
+        self.assertEqual(tokenize_ki2_move("▲７六歩"), (shogi.Move.from_usi("7g7f").to_square, shogi.PAWN, ""))
+        self.assertEqual(tokenize_ki2_move("△同　成銀左"), (-1, shogi.PROM_SILVER, "左"))
+        self.assertIsNone(tokenize_ki2_move("▲投了"))
+
+    def test_parse_ki2_move_pinned_candidate(self):
+        # ５八の金は飛車に釘付けなので「６八金」は６九の金の手になる
+        board = shogi.Board("k3r4/9/9/9/9/9/9/4G4/3GK4 b - 1")
+        move = parse_ki2_move(board, "▲６八金")
+        self.assertEqual(move.usi(), "6i6h")
+
+    def test_parse_roundtrip_all_legal_moves(self):
+        board = shogi.Board()
+        for usi in ["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e", "6a5b", "6i7h", "4a3b", "5i6h", "B*8e"]:
+            board.push_usi(usi)
+        for move in board.legal_moves:
+            self.assertEqual(parse_ki2_move(board, get_ki2_move_str(board, move)), move)
+
+    def test_parse_ki2_nested_variations(self):
+        # 変化の中の変化と、その後の本譜に近い変化。「同」は分岐元の直前の手を参照する
+        text = ("手合割：平手\n▲７六歩 △３四歩 ▲２二角成 △同　銀 ▲４五角\n\n"
+                "変化：4手目\n△同　飛 ▲６五角\n\n"
+                "変化：5手目\n▲５五角\n\n"
+                "変化：2手目\n△８四歩 ▲２六歩\n")
+        with tempfile.NamedTemporaryFile('w', suffix='.ki2', encoding='cp932', delete=False) as f:
+            f.write(text)
+        try:
+            graph, arrival_info, _ = parse_ki2(f.name)
+        finally:
+            os.unlink(f.name)
+        board = shogi.Board()
+        for usi in ["7g7f", "3c3d", "8h2b+", "8b2b", "B*5e"]:
+            board.push_usi(usi)
+        self.assertEqual(arrival_info[board.zobrist_hash()], {"▲５五角": ("▲２二角成", "△同　飛", "▲５五角")})
+        board = shogi.Board()
+        for usi in ["7g7f", "8c8d", "2g2f"]:
+            board.push_usi(usi)
+        self.assertIsNotNone(graph.position_id(board.zobrist_hash()))
+        self.assertEqual(len(graph), 11)
+
 if __name__ == '__main__':
     unittest.main()
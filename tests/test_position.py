@@ -0,0 +1,37 @@
+import unittest
+import shogi
+from logic.position import get_board_key, get_sfen_key, PositionKeys
+
+class TestPosition(unittest.TestCase):
+    def test_transposition_same_key(self):
+        board_a = shogi.Board()
+        for usi in ["7g7f", "3c3d", "2g2f"]:
+            board_a.push_usi(usi)
+        board_b = shogi.Board()
+        for usi in ["2g2f", "3c3d", "7g7f"]:
+            board_b.push_usi(usi)
+        self.assertEqual(get_board_key(board_a), get_board_key(board_b))
+        self.assertEqual(get_sfen_key(board_a), get_sfen_key(board_b))
+
+    def test_incremental_key_restored_by_pop(self):
+        board = shogi.Board()
+        start = get_board_key(board)
+        board.push_usi("7g7f")
+        self.assertNotEqual(get_board_key(board), start)
+        board.pop()
+        self.assertEqual(get_board_key(board), start)
+
+    def test_collision_fallback(self):
+        keys = PositionKeys()
+        board = shogi.Board()
+        key = keys.key(board)
+        # 別局面の指紋を同じキーに登録して衝突を再現する
+        board.push_usi("7g7f")
+        keys._checks[get_board_key(board)] = keys._checks[key]
+        fallback = keys.key(board)
+        self.assertNotEqual(fallback, get_board_key(board))
+        self.assertEqual(keys.key(board), fallback)
+        self.assertEqual(keys.collisions, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import unittest
+from logic.expander import count_tree_nodes, expand_tree
+from logic.pruning import Pruner, PruningPolicy
+from logic.writer import write_expanded_ki2
+from main import format_as_ki2_text
+from tests.helpers import graph_from_lines
+
+def _transposition_graph():
+    """３通りの手順が同じ局面に合流し、その先に２手の続きと変化がある局面グラフ。"""
+    return graph_from_lines((
+        ["7g7f", "3c3d", "2g2f", "8c8d", "2f2e", "8d8e"],
+        ["2g2f", "3c3d", "7g7f", "8c8d", "6i7h"],
+        ["2g2f", "8c8d", "7g7f", "3c3d"],
+    ))
+
+class TestPruning(unittest.TestCase):
+    def expand(self, policy: PruningPolicy):
+        """ストリーミング出力とツリー展開の両方で展開し、同じ結果になることを確かめる。"""
+        board, graph = _transposition_graph()
+        buffer = io.StringIO()
+        pruner = Pruner(policy)
+        written = write_expanded_ki2(buffer, board, graph, pruner=pruner)
+        tree_pruner = Pruner(policy)
+        tree = expand_tree(board, graph, pruner=tree_pruner)
+        self.assertEqual(buffer.getvalue(), format_as_ki2_text(tree))
+        self.assertEqual(written, count_tree_nodes(tree))
+        self.assertEqual(pruner.summary(), tree_pruner.summary())
+        self.assertEqual(len(board.move_stack), 0)
+        return written, pruner
+
+    def test_unlimited_policy_matches_full_expansion(self):
+        board, graph = _transposition_graph()
+        written, pruner = self.expand(PruningPolicy())
+        self.assertEqual(written, count_tree_nodes(expand_tree(board, graph)))
+        self.assertEqual(pruner.summary(), [])
+
+    def test_max_copies(self):
+        written, pruner = self.expand(PruningPolicy(max_copies=1))
+        # 各局面の続きを一度だけ展開すると、書き出す手は局面グラフの辺の数と同じ
+        self.assertEqual(written, _transposition_graph()[1].edge_count)
+        self.assertEqual(pruner.copy_cuts, 2)
+
+    def test_max_depth_after_confluence(self):
+        full, _ = self.expand(PruningPolicy())
+        written, pruner = self.expand(PruningPolicy(max_depth_after_confluence=1))
+        self.assertLess(written, full)
+        self.assertEqual(pruner.depth_cuts, 2)
+
+    def test_max_nodes(self):
+        written, pruner = self.expand(PruningPolicy(max_nodes=7))
+        self.assertEqual(written, 7)
+        self.assertTrue(pruner.node_limit_reached)
+        self.assertEqual(pruner.pruned, 0)
+
+    def test_main_line_only(self):
+        written, pruner = self.expand(PruningPolicy(main_line_beyond=1))
+        # 初手の2通りだけが分岐として残る。２手目の変化と、２つの経路で着く４手目の局面の変化が省かれる
+        self.assertEqual(pruner.side_branches_cut, 3)
+        self.assertIn("main line only", pruner.summary()[0])
+
+if __name__ == '__main__':
+    unittest.main()
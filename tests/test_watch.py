@@ -0,0 +1,71 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from logic.watch import DirectoryWatcher, watch
+from main import is_output_file
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name: str, text: str, mtime_ns: int) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='cp932') as f:
+            f.write(text)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        return path
+
+    def test_debounce_and_content_hash(self):
+        a = self.write("a.ki2", "▲７六歩\n", 1_000_000_000)
+        self.write("a_expanded.ki2", "▲７六歩\n", 1_000_000_000)
+        self.write("notes.txt", "x", 1_000_000_000)
+        watcher = DirectoryWatcher(self.tmpdir, debounce=1.0, exclude=is_output_file)
+        # 既存のファイルも変化が落ち着いてから処理する
+        self.assertEqual(watcher.poll(now=0.0), [])
+        self.assertEqual(watcher.poll(now=1.0), [a])
+        self.assertEqual(watcher.poll(now=2.0), [])
+
+        # 連続した保存は最後の保存から debounce 秒後に1回だけ
+        self.write("a.ki2", "▲２六歩\n", 2_000_000_000)
+        self.assertEqual(watcher.poll(now=3.0), [])
+        self.write("a.ki2", "▲２六歩 △３四歩\n", 3_000_000_000)
+        self.assertEqual(watcher.poll(now=3.5), [])
+        self.assertEqual(watcher.poll(now=4.0), [])
+        self.assertEqual(watcher.poll(now=4.5), [a])
+
+        # 内容が同じなら更新日時が変わっても処理しない
+        self.write("a.ki2", "▲２六歩 △３四歩\n", 4_000_000_000)
+        self.assertEqual(watcher.poll(now=5.0), [])
+        self.assertEqual(watcher.poll(now=6.0), [])
+
+        # 削除して作り直したファイルは新しいファイルとして扱う
+        os.remove(a)
+        self.assertEqual(watcher.poll(now=7.0), [])
+        self.write("a.ki2", "▲２六歩 △３四歩\n", 5_000_000_000)
+        self.assertEqual(watcher.poll(now=8.0), [])
+        self.assertEqual(watcher.poll(now=9.0), [a])
+
+    def test_watch_continues_after_errors(self):
+        self.write("a.ki2", "▲７六歩\n", 1_000_000_000)
+        self.write("b.ki2", "▲２六歩\n", 1_000_000_000)
+        processed = []
+
+        def process(path: str):
+            processed.append(os.path.basename(path))
+            if path.endswith("a.ki2"):
+                raise ValueError("broken")
+
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            watch(DirectoryWatcher(self.tmpdir, debounce=0.0), process, interval=0.0, cycles=2)
+        self.assertEqual(processed, ["a.ki2", "b.ki2"])
+        self.assertIn("Error processing", buffer.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import io
+import unittest
+from logic.writer import Ki2Emitter, write_expanded_ki2
+from logic.expander import expand_tree
+from main import format_as_ki2_text
+from tests.helpers import graph_from_lines
+
+class TestWriter(unittest.TestCase):
+    def test_emitter_layout(self):
+        buffer = io.StringIO()
+        emitter = Ki2Emitter(buffer)
+        emitter.move(1, "７六歩")
+        emitter.comment("note")
+        emitter.variation(1)
+        emitter.move(1, "２六歩")
+        emitter.move(2, "３四歩")
+        self.assertEqual(buffer.getvalue(), "▲７六歩\n*note\n\n変化：1手目\n▲２六歩 △３四歩")
+
+    def test_streaming_matches_tree_formatting(self):
+        board, graph = graph_from_lines((["7g7f", "3c3d", "2g2f"], ["2g2f", "3c3d", "7g7f", "8c8d"], ["7g7f", "8c8d"]),
+                                        {"3c3d": ["c 3c3d"]})
+
+        buffer = io.StringIO()
+        written = write_expanded_ki2(buffer, board, graph)
+        expected = format_as_ki2_text(expand_tree(board, graph))
+        self.assertEqual(buffer.getvalue(), expected)
+        self.assertEqual(written, 9)
+
+if __name__ == '__main__':
+    unittest.main()